@@ -5,6 +5,7 @@ from django.db import transaction
 
 from customs.services import OldBaseService
 from apps.user.services import AuthService
+from apps.user import profiles
 from .models import Author, Book
 from .serializers import AuthorSerializer, BookSerializer
 import ast
@@ -38,9 +39,9 @@ class AuthorService:
                 'user_info': []
             }
 
+            users = profiles.get_users(group.members["user"])
             for user_id in group.members["user"]:
-                member_id = user_id
-                user = user_service.get(id=str(member_id))
+                user = users.get(funcs.hex_id(user_id))
                 user_data = user_service.serialize(user)
                 user_info_list.append(user_data)
 
@@ -66,9 +67,11 @@ class AuthorService:
         Gives the author list based on a group_id
         '''
         author_list = []
-        author_group_member = Author.objects.get_or_none(id=group_id).members
+        author_group = Author.objects.get_or_none(id=group_id)
+        if author_group is None:
+            return author_list
 
-        for user in author_group_member['user']:
+        for user in author_group.members.get('user', []):
             author_list.append(user)
 
         return author_list
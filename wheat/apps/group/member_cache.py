@@ -0,0 +1,33 @@
+# -*- coding:utf-8 -*-
+'''
+Cached member ids of homes, by the owner of the home.
+
+Feeds, moment fan-out and home lookups only need who is in a home, the ids
+are kept in Redis so they skip loading the group. GroupService drops them
+when a member is added or deleted, see GroupService.get_home_member_ids.
+'''
+
+from customs import backends
+from customs.funcs import get_setting
+
+get_backend = backends.lazy_backend('HOME_MEMBER_CACHE_BACKEND', {
+    backends.MEMORY: backends.MemoryIdSets,
+    backends.REDIS: lambda: backends.RedisIdSets(
+        'home_members',
+        get_setting('HOME_MEMBER_CACHE_REDIS_DB', 3),
+        get_setting('HOME_MEMBER_CACHE_TIMEOUT', 60 * 60 * 24)),
+})
+
+
+def get_member_ids(owner_id):
+    ''' None if not cached '''
+    member_ids = get_backend().get(owner_id)
+    return list(member_ids) if member_ids is not None else None
+
+
+def set_member_ids(owner_id, member_ids):
+    get_backend().set(owner_id, member_ids)
+
+
+def invalidate(*owner_ids):
+    get_backend().drop(owner_ids)
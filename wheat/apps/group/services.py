@@ -10,10 +10,17 @@ from .serializers import GroupSerializer, GroupMemberSerializer, InvitationSeria
 from customs.services import MessageService
 from customs.services import role_map
 from apps.moment.services import MomentService
+from apps.moment import timeline
+from apps.message.services import GroupMessageService
+from apps.user import counters
+from apps.user import profiles
 from customs.api_tools import api
 from information import redis_tools
 from customs.delegates import delegate
+from customs.funcs import hex_id
+from customs.transaction_hooks import on_commit
 from . import roles
+from . import member_cache
 
 
 class GroupService(BaseService):
@@ -79,16 +86,21 @@ class GroupService(BaseService):
 
     @api
     def get_home(self, owner_id):
-        home = self.get(creator_id=owner_id, group_type=GroupService.ALL_HOME)
+        home = self._get_home_group(owner_id)
         home = self.add_home_member_info(home)
         return home
 
+    def _get_home_group(self, owner_id):
+        ''' The home without member information, None if not created '''
+        return Group.objects.filter(creator_id=owner_id, group_type=GroupService.ALL_HOME).first()
+
     def add_home_member_info(self, home):
+        member_profiles = profiles.get_profiles(home.members)
         for user_id, user_info in home.members.iteritems():
-            avatar = UserService().get(id=user_id).avatar
-            nickname = UserService().get(id=user_id).nickname
-            user_info['avatar'] = str(avatar)
-            user_info['nickname'] = nickname
+            profile = member_profiles.get(hex_id(user_id))
+            if profile:
+                user_info['avatar'] = profile['avatar']
+                user_info['nickname'] = profile['nickname']
         return home
         
     def consist_role(self, group_id, role):
@@ -125,9 +137,11 @@ class GroupService(BaseService):
 
         GroupMemberService().create(group, user_id, character, member_info['role'])
         FriendshipService().create(str(group.creator_id), str(user_id))
+        self._invalidate_home_timeline(group, user_id)
         
         # set group member by character. 
         group.save()
+        self._invalidate_home_members(group)
         return getattr(group, character)
 
     def add_group_member(self, group, user_id, role=None):
@@ -143,15 +157,37 @@ class GroupService(BaseService):
         GroupMemberService().delete(group.id, member_id)
         # delete friendship relation.
         FriendshipService().delete(group.creator_id, member_id)
+        self._invalidate_home_timeline(group, member_id)
+        self._invalidate_home_members(group)
+        GroupMessageService.delete_read_cursor(group.id, member_id)
         return group
 
+    def _invalidate_home_timeline(self, group, member_id):
+        # moment timelines are built from home members, rebuild them when read
+        if group.group_type == GroupService.ALL_HOME:
+            timeline.invalidate(group.creator_id, member_id)
+
+    def _invalidate_home_members(self, group):
+        if group.group_type == GroupService.ALL_HOME:
+            owner_id = group.creator_id
+            member_cache.invalidate(owner_id)
+            # others may cache the old members before the change commits
+            on_commit(lambda: member_cache.invalidate(owner_id))
+
+    def get_home_member_ids(self, owner_id):
+        '''
+        Ids of the members in home of owner, cached until the members change.
+        The home is created if the owner has none.
+        '''
+        member_ids = member_cache.get_member_ids(owner_id)
+        if member_ids is None:
+            home = self._get_home_group(owner_id) or self.create_default_home(owner_id)
+            member_ids = [str(uid) for uid in home.members]
+            member_cache.set_member_ids(owner_id, member_ids)
+        return member_ids
+
     def get_user_home_member(self, user_id):
-        home = self.get_home(user_id)
-        if not home:
-            home = self.create_default_home(user_id)
-            
-        members = [str(uid) for uid in home.members]
-        return members
+        return self.get_home_member_ids(user_id)
 
     def get_user_groups(self, user_id):
         member_records = GroupMemberService().get(member_id=user_id, deleted=False, many=True)
@@ -161,19 +197,20 @@ class GroupService(BaseService):
         return groups
 
     def delete_person_relation(self, host_id, member_id):
-        host_group = self.get_home(host_id)
+        host_group = self._get_home_group(host_id)
 
         if host_group:
             self.delete_member(host_group, member_id)
             GroupMemberService().delete(group_id=host_group.id, member_id=member_id)
 
-        member_group = self.get_home(member_id)
+        member_group = self._get_home_group(member_id)
 
         if member_group:
             self.delete_member(member_group, member_id)
             GroupMemberService().delete(group_id=member_group.id, member_id=host_id)
 
         FriendshipService().delete(host_id, member_id)
+        member_cache.invalidate(host_id, member_id)
 
         redis_tools.publish_delete_friend(member_id, host_id)
 
@@ -351,6 +388,7 @@ class InvitationService(BaseService):
 
         # publish redis message.
         redis_tools.accept_invitation(invitation, invitee_id)
+        counters.decr(invitee_id, counters.UNREAD_INVITATIONS)
 
         return invitation
 
@@ -358,6 +396,9 @@ class InvitationService(BaseService):
     def reject(self, invitation_id):
         invitation = self.get(id=invitation_id)
         self.delete(invitation)
+        invitee = UserService().get(phone=invitation.invitee)
+        if invitee:
+            counters.decr(invitee.id, counters.UNREAD_INVITATIONS)
         return invitation
 
     @transaction.atomic
@@ -369,6 +410,7 @@ class InvitationService(BaseService):
             # if user is registered send to redis
             message = invitation.message
             redis_tools.publish_invitation(invitation, inviter, group, invitee, message)
+            counters.incr([invitee.id], unread_invitations=1)
 
         append_msg = str(append_msg).strip()
 
@@ -10,9 +10,10 @@ from apps.group.services import GroupService
 from apps.group.services import GroupMemberService
 from apps.group.services import InvitationService
 from apps.group.models import Group
+from apps.group import member_cache
 from apps.group.models import GroupMember
 from apps.group.models import Invitation
-from information.utils import RedisPubsub
+from information import transport
 
 
 group_service = GroupService()
@@ -150,6 +151,28 @@ class GroupServiceTest(TestCase):
         self.assertTrue(str(user.id) in members)
         self.assertTrue(str(user2.id) in members)
 
+    def test_home_member_ids_cached(self):
+        member_cache.get_backend().clear()
+        user, user2, user3 = self.users[:3]
+        group = group_service.create_default_home(user.id)
+        group_service.add_group_member(group, user2.id)
+
+        self.assertEqual(len(group_service.get_home_member_ids(user.id)), 2)
+        with self.assertNumQueries(0):
+            members = group_service.get_home_member_ids(user.id)
+        self.assertEqual(set(members), set([str(user.id), str(user2.id)]))
+
+        group_service.add_group_member(group, user3.id)
+        self.assertTrue(str(user3.id) in group_service.get_home_member_ids(user.id))
+
+        group_service.delete_member(group, user2.id)
+        self.assertFalse(str(user2.id) in group_service.get_home_member_ids(user.id))
+
+    def test_home_member_ids_create_home(self):
+        user = self.users[0]
+        self.assertEqual(group_service.get_home_member_ids(user.id), [str(user.id)])
+        self.assertTrue(Group.objects.filter(creator_id=user.id, group_type=GroupService.ALL_HOME).exists())
+
     def test_user_group(self):
         user = self.users[0]
         user2 = self.users[1]
@@ -209,6 +232,7 @@ class InvitationServiceTest(TestCase):
         self.users[-1].phone = '15705116597'  # myself phone for test.
         self.users[-1].save()
         self.homes = [group_service.create_default_home(self.users[i].id) for i in range(TOTAL)]
+        transport.get_transport().clear()
 
     def test_create(self):
         user = self.users[0]
@@ -231,11 +255,9 @@ class InvitationServiceTest(TestCase):
         self.assertFalse(Invitation.objects.get(inviter=inviter.id).accepted)
         # invitation is created.
 
-        # redis has received msg.
-        redis_tool = RedisPubsub()
-        r_msg = redis_tool.get()
+        # invitation message is sent.
+        r_msg = transport.get_transport().get()
         self.assertIsNotNone(r_msg)
-        r_msg = redis_tool.get()
         self.assertTrue(role in str(r_msg['data']))
 
     def test_accept_one_user_register_one_not_registert(self):
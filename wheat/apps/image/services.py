@@ -37,6 +37,16 @@ class ImageService(BaseService):
     def get_images(cls, **kwargs):
         return Image.objects.filter(**kwargs)
 
+    @classmethod
+    def get_image_sizes(cls, image_srcs):
+        '''
+        Gets {src: (width, height)} of uploaded images in one query,
+        src is the image path such as origin/xxx.jpg, unknown src is left out.
+        '''
+        if not image_srcs:
+            return {}
+        images = Image.objects.filter(image__in=list(image_srcs)).values_list('image', 'width', 'height')
+        return dict((src, (width, height)) for src, width, height in images)
 
     @staticmethod
     def save_image_by_ratio(image, ratio=1.0):
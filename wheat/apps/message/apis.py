@@ -1,15 +1,292 @@
 # -*- coding:utf-8 -*-
+import uuid
 from apps.user.permissions import login_required
-from apps.user.permissions import user_is_same_as_logined_user
 from customs.response import SimpleResponse
-from rest_framework.views import APIView
+from customs import class_tools
+from information import streams
+from apps.user import counters
+from apps.group.models import Group
+from . import services
+from .services import MessageService, GroupMessageService
+from .services import ConversationSummaryService, CHAT, GROUP
+from rest_framework import status, viewsets
+from rest_framework.decorators import list_route
 
 
-class Message(APIView):
+@class_tools.default_view_set
+class MessageViewSet(viewsets.GenericViewSet):
+    """
+    消息相关API.
+    ### Resource Description
+    """
+    MAX_REPLAY = 500
+    MAX_HISTORY = 100
+
+    @login_required
+    @list_route(methods=['get'])
+    def history(self, request):
+        '''
+        获得历史信息 Gets the history of a chat or a group, a page of messages next to a cursor.
+
+        ### Example Request:
+        Url: {API_URL}/messages/history/?with={user_id}&before={cursor}&number={int}&fields={fields}
+        Url: {API_URL}/messages/history/?group={group_id}&after={cursor}
+
+        with -- the other user of the chat
+        group -- the group, instead of with
+        before -- cursor of a message, gets the messages older than it; the newest ones if no cursor
+        after -- cursor of a message, gets the messages newer than it
+        number -- messages of a page, 20 by default, 1 at least and 100 at most
+        fields -- the fields given, split by comma, all by default:
+            id,sender_id,receiver_id,group_id,content_type,content,post_date,cursor
+
+        Messages are from older to newer, content_type is not given when it is text.
+        Group history is given only when GROUP_MESSAGE_STORAGE is cursor.
+        Use `before` of the response to scroll back, and `after` to get new ones.
+
+        ### Response Example:
+
+            {
+              "data": {
+                "messages": [
+                  {"id": "...", "sender_id": "...", "receiver_id": "...",
+                   "content": {"text": "hi"}, "post_date": "2016-06-22T10:21:03.120211",
+                   "cursor": "MjAxNi0wNi0yMiAx..."}
+                ],
+                "before": "MjAxNi0wNi0yMiAx...",
+                "after": "MjAxNi0wNi0yMiAx...",
+                "has_more": true
+              },
+              "request": "success"
+            }
+        ---
+        omit_serializer: true
+        '''
+        WITH, GROUP_ID, BEFORE, AFTER, NUMBER, FIELDS = 'with', 'group', 'before', 'after', 'number', 'fields'
+        params = request.query_params
+
+        try:
+            number = max(1, min(int(params.get(NUMBER, 20)), self.MAX_HISTORY))
+            before = params.get(BEFORE, None)
+            after = params.get(AFTER, None)
+            before = services.decode_history_cursor(before) if before else None
+            after = services.decode_history_cursor(after) if after else None
+            other_id = params.get(WITH, None)
+            group_id = params.get(GROUP_ID, None)
+            other_id = uuid.UUID(other_id).hex if other_id else None
+            group_id = uuid.UUID(group_id).hex if group_id else None
+        except ValueError:
+            return SimpleResponse(status=status.HTTP_400_BAD_REQUEST, errors='invalid cursor, number or id')
+
+        fields = services.HISTORY_FIELDS
+        if params.get(FIELDS, None):
+            fields = [f for f in params.get(FIELDS).split(',') if f in services.HISTORY_FIELDS]
+        if bool(other_id) == bool(group_id) or (before and after) or not fields:
+            return SimpleResponse(status=status.HTTP_400_BAD_REQUEST,
+                                  errors='give one of with and group, and valid fields')
+
+        user_id = request.user.id
+        if other_id:
+            messages = MessageService.get_chat_messages(user_id, other_id)
+        else:
+            group = Group.objects.get_or_none(id=group_id)
+            if not group or str(user_id) not in group.members:
+                return SimpleResponse(status=status.HTTP_404_NOT_FOUND, errors='no such group')
+            messages = GroupMessageService.get_group_messages(user_id, group_id)
+            if messages is None:
+                return SimpleResponse(status=status.HTTP_400_BAD_REQUEST,
+                                      errors='group history needs the cursor storage of group messages')
+
+        page, has_more = services.get_history_page(messages, before, after, number)
+        return SimpleResponse(data={
+            'messages': [services.serialize_history_message(m, fields) for m in page],
+            'before': services.encode_history_cursor(page[0]) if page else params.get(BEFORE, None),
+            'after': services.encode_history_cursor(page[-1]) if page else params.get(AFTER, None),
+            'has_more': has_more,
+        })
+
+    @login_required
+    @list_route(methods=['get'])
+    def replay(self, request):
+        '''
+        Gets the messages sent to the logined user after a stream id, for
+        catching up after the connection was lost.
+
+        ### Example Request:
+        Url: {API_URL}/messages/replay/?after={stream_id}&count={int}
+
+        after -- stream id of the last received message (`stream_id` of live messages too),
+                 the last acked one if not given
+        count -- max messages, 100 by default, 1 at least and 500 at most
+
+        Ack the `last_id` of response when they are handled.
+
+        ### Response Example:
+
+            {
+              "data": {
+                "messages": [
+                  {"stream_id": "1466585731201-0", "message": {"event": "moment", ...}}
+                ],
+                "last_id": "1466585731201-0"
+              },
+              "request": "success"
+            }
+        ---
+        omit_serializer: true
+        '''
+        AFTER, COUNT = 'after', 'count'
+
+        if not streams.is_enabled():
+            return SimpleResponse(status=status.HTTP_404_NOT_FOUND, errors='message streams are disabled')
+
+        try:
+            count = max(1, min(int(request.query_params.get(COUNT, 100)), self.MAX_REPLAY))
+            after = request.query_params.get(AFTER, None)
+            if after is not None:
+                streams.parse_id(after)
+        except ValueError:
+            return SimpleResponse(status=status.HTTP_400_BAD_REQUEST, errors='invalid after or count')
+
+        backend = streams.get_streams()
+        user_id = request.user.id
+        if after is None:
+            messages = backend.replay_unacked(user_id, count)
+        else:
+            messages = backend.replay(user_id, after, count)
+
+        return SimpleResponse(data={
+            'messages': [{'stream_id': sid, 'message': m} for sid, m in messages],
+            'last_id': messages[-1][0] if messages else after,
+        })
+
     @login_required
-    @user_is_same_as_logined_user
-    def get(self, begin_id, step):
+    @list_route(methods=['post'])
+    def ack(self, request):
         '''
-        获得历史信息Get History information
+        Marks the messages of the logined user until a stream id as received.
+
+        ### Example Request:
+        Url: {API_URL}/messages/ack/
+
+        stream_id -- last handled stream id
+
+        ---
+        omit_serializer: true
+        parameters:
+            - name: stream_id
+              type: string
+        '''
+        STREAM_ID = 'stream_id'
+
+        if not streams.is_enabled():
+            return SimpleResponse(status=status.HTTP_404_NOT_FOUND, errors='message streams are disabled')
+
+        stream_id = request.data.get(STREAM_ID, None)
+        try:
+            streams.parse_id(stream_id)
+        except (TypeError, ValueError):
+            return SimpleResponse(status=status.HTTP_400_BAD_REQUEST, errors='invalid stream_id')
+
+        moved = streams.get_streams().ack(request.user.id, stream_id)
+        return SimpleResponse(data={'acked': moved})
+
+    @login_required
+    @list_route(methods=['get'])
+    def badges(self, request):
+        '''
+        Gets the unread counters and the recent conversations of the logined user, in two queries.
+
+        ### Example Request:
+        Url: {API_URL}/messages/badges/?conversations={int}
+
+        conversations -- recent conversations given, 20 by default, 1 at least and 100 at most
+
+        ### Response Example:
+
+            {
+              "data": {
+                "counters": {
+                  "unread_msgs": 3,
+                  "unread_feeds": 12,
+                  "unread_comments": 1,
+                  "unread_invitations": 0,
+                  ...
+                },
+                "conversations": [
+                  {
+                    "type": "chat",
+                    "id": "{user_id}",
+                    "last_message": {"id": "...", "sender_id": "...", "content_type": "text", "content": {...}},
+                    "last_activity_at": "2016-06-22T10:21:03",
+                    "unread_count": 3
+                  }
+                ]
+              },
+              "request": "success"
+            }
+        ---
+        omit_serializer: true
         '''
-        return SimpleResponse(data={'test': 'succeed'})
+        CONVERSATIONS = 'conversations'
+
+        try:
+            number = max(1, min(int(request.query_params.get(CONVERSATIONS, 20)), 100))
+        except ValueError:
+            return SimpleResponse(status=status.HTTP_400_BAD_REQUEST, errors='invalid conversations')
+
+        user_id = request.user.id
+        summaries = ConversationSummaryService.get_summaries(user_id, number)
+        return SimpleResponse(data={
+            'counters': counters.serialize_counter(counters.get_counter(user_id)),
+            'conversations': map(ConversationSummaryService.serialize, summaries),
+        })
+
+    @login_required
+    @list_route(methods=['post'])
+    def read(self, request):
+        '''
+        Clears badges of the logined user, a conversation or some counters.
+
+        ### Example Request:
+        Url: {API_URL}/messages/read/
+
+        type -- chat or group, with id
+        id -- the other user of a chat, or the group
+        counters -- unread_feeds, unread_comments or unread_invitations, split by comma
+
+        ---
+        omit_serializer: true
+        parameters:
+            - name: type
+              type: string
+            - name: id
+              type: string
+            - name: counters
+              type: string
+        '''
+        TYPE, ID, COUNTERS = 'type', 'id', 'counters'
+        CLEARABLE = (counters.UNREAD_FEEDS, counters.UNREAD_COMMENTS, counters.UNREAD_INVITATIONS)
+
+        conversation_type = request.data.get(TYPE, None)
+        conversation_id = request.data.get(ID, None)
+        fields = [f for f in str(request.data.get(COUNTERS, '')).split(',') if f]
+
+        if conversation_type and conversation_type not in (CHAT, GROUP) or \
+                bool(conversation_type) != bool(conversation_id) or \
+                any(f not in CLEARABLE for f in fields):
+            return SimpleResponse(status=status.HTTP_400_BAD_REQUEST, errors='invalid type, id or counters')
+
+        if conversation_id:
+            try:
+                conversation_id = uuid.UUID(str(conversation_id)).hex
+            except ValueError:
+                return SimpleResponse(status=status.HTTP_400_BAD_REQUEST, errors='invalid id')
+
+        user_id = request.user.id
+        read = 0
+        if conversation_type:
+            read = ConversationSummaryService.mark_read(user_id, conversation_type, conversation_id)
+        if fields:
+            counters.clear(user_id, *fields)
+        return SimpleResponse(data={'read': read})
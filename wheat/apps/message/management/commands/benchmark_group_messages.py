@@ -0,0 +1,103 @@
+# -*- coding:utf-8 -*-
+
+import time
+import uuid
+from collections import namedtuple
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from apps.message.models import GroupMessage, GroupChatMessage, GroupReadCursor
+from apps.message.services import GroupMessageService, ROWS, CURSOR
+
+Group = namedtuple('Group', ['id', 'members'])
+
+CONTENT = {'text': u'今天天气不错' * 10}
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _count_rows():
+    return GroupMessage.objects.find().count() + GroupChatMessage.objects.count() \
+        + GroupReadCursor.objects.count()
+
+
+def _write(storage, group, sender_id, rounds):
+    messages = []
+    for i in range(rounds):
+        if storage == CURSOR:
+            messages.append(GroupMessageService._create_chat_message(sender_id, group, 'text', CONTENT))
+        else:
+            messages += GroupMessageService._create_member_messages(sender_id, group, 'text', CONTENT)
+    return messages
+
+
+def _read(storage, group, sender_id, messages):
+    ''' Every member marks all the messages received '''
+    for member_id in group.members:
+        if member_id == sender_id:
+            continue
+        if storage == CURSOR:
+            GroupMessageService.update_read_cursor(group.id, member_id, messages[-1].id)
+        else:
+            GroupMessageService.update_messages_as_received(
+                [m.id for m in messages if m.receiver_id == member_id], member_id)
+
+
+def benchmark(storage, group_size, rounds):
+    '''
+    Sends `rounds` messages to a group of group_size, then every member reads them,
+    nothing is left in database. Returns (write seconds, read seconds, rows written).
+    '''
+    members = [uuid.uuid4().hex for i in range(group_size)]
+    group = Group(uuid.uuid4().hex, dict((member_id, {}) for member_id in members))
+    result = None
+    try:
+        with transaction.atomic():
+            rows_before = _count_rows()
+            start = time.time()
+            messages = _write(storage, group, members[0], rounds)
+            written = time.time()
+            _read(storage, group, members[0], messages)
+            result = (written - start, time.time() - written, _count_rows() - rows_before)
+            raise _Rollback()
+    except _Rollback:
+        pass
+    return result
+
+
+class Command(BaseCommand):
+    help = u'Compares writing and reading group messages in rows and cursor storage'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--usage',
+                    action='help',
+                    help='python manage.py benchmark_group_messages --sizes=5,15,50 --rounds=100'),
+        make_option('--sizes',
+                    action='store',
+                    dest='sizes',
+                    default='5,15,50',
+                    help='group sizes, split by comma'),
+        make_option('--rounds',
+                    action='store',
+                    type='int',
+                    dest='rounds',
+                    default=100,
+                    help='messages sent to every group'),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError('sizes should be integers split by comma')
+        rounds = options['rounds']
+
+        print '{0:<8}{1:>8}{2:>12}{3:>14}{4:>14}'.format('storage', 'group', 'rows', 'write ms/msg', 'read ms/msg')
+        for size in sizes:
+            for storage in (ROWS, CURSOR):
+                write, read, rows = benchmark(storage, size, rounds)
+                print '{0:<8}{1:>8}{2:>12}{3:>14.3f}{4:>14.3f}'.format(
+                    storage, size, rows, write * 1000 / rounds, read * 1000 / rounds)
@@ -0,0 +1,125 @@
+# -*- coding:utf-8 -*-
+
+import time
+import uuid
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from information import redis_tools
+from information import transport
+
+EVENTS = ('moment', 'invitation', 'book')
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _ids(number):
+    return [uuid.uuid4().hex for i in range(number)]
+
+
+def publish_moment(receiver_ids):
+    ''' One moment notifies the whole family in one batch '''
+    redis_tools.publish_moment_messages(uuid.uuid4().hex, uuid.uuid4().hex, receiver_ids)
+
+
+def publish_invitation(receiver_ids):
+    ''' Every member is invited by one message '''
+    for receiver_id in receiver_ids:
+        redis_tools.publish_invite_message('invitation', 'sub_inv', uuid.uuid4().hex, receiver_id, {})
+
+
+def publish_book(receiver_ids):
+    book_id = uuid.uuid4().hex
+    for receiver_id in receiver_ids:
+        redis_tools.publish_book_message(receiver_id, book_id, {})
+
+
+PUBLISHERS = {
+    'moment': publish_moment,
+    'invitation': publish_invitation,
+    'book': publish_book,
+}
+
+
+def benchmark(event, family_size, rounds):
+    '''
+    Publishes `rounds` events to families of family_size, nothing is left in database.
+    Returns (seconds, messages).
+    '''
+    publish = PUBLISHERS[event]
+    families = [_ids(family_size) for i in range(rounds)]
+    seconds = 0
+    try:
+        with transaction.atomic():
+            start = time.time()
+            for receiver_ids in families:
+                publish(receiver_ids)
+            seconds = time.time() - start
+            raise _Rollback()  # drop the backups
+    except _Rollback:
+        pass
+    return seconds, rounds * family_size
+
+
+class Command(BaseCommand):
+    help = u'Measures publish and fan-out throughput of notifications'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--usage',
+                    action='help',
+                    help='python manage.py benchmark_publish --sizes=5,20,100 --rounds=200 --transport=recording'),
+        make_option('--sizes',
+                    action='store',
+                    dest='sizes',
+                    default='5,20,100',
+                    help='family sizes, split by comma'),
+        make_option('--rounds',
+                    action='store',
+                    type='int',
+                    dest='rounds',
+                    default=200,
+                    help='events published for every event and size'),
+        make_option('--events',
+                    action='store',
+                    dest='events',
+                    default=','.join(EVENTS),
+                    help='events to publish, in ' + ','.join(EVENTS)),
+        make_option('--transport',
+                    action='store',
+                    dest='transport',
+                    default=None,
+                    help='redis, memory or recording, MESSAGE_TRANSPORT by default'),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError('sizes should be integers split by comma')
+        events = options['events'].split(',')
+        for event in events:
+            if event not in PUBLISHERS:
+                raise CommandError('unknown event: {0}'.format(event))
+
+        selected = transport.get_transport()
+        if options['transport']:
+            try:
+                selected = transport.make_transport(options['transport'])
+            except ValueError as e:
+                raise CommandError(e)
+
+        with transport.use_transport(selected):
+            self.run(events, sizes, options['rounds'])
+
+    def run(self, events, sizes, rounds):
+        print '{0:<12}{1:>8}{2:>14}{3:>16}{4:>14}'.format(
+            'event', 'family', 'events/s', 'messages/s', 'ms/event')
+        for event in events:
+            for size in sizes:
+                seconds, messages = benchmark(event, size, rounds)
+                seconds = seconds or 1e-9
+                print '{0:<12}{1:>8}{2:>14.1f}{3:>16.1f}{4:>14.3f}'.format(
+                    event, size, rounds / seconds, messages / seconds, seconds * 1000 / rounds)
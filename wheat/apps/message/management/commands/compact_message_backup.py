@@ -0,0 +1,76 @@
+# -*- coding:utf-8 -*-
+
+import time
+from datetime import datetime, timedelta
+from optparse import make_option
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.message.services import MessageService
+
+
+def _by_chunks(compact_chunk, chunk_size, pause):
+    '''
+    Runs compact_chunk() until a chunk is not full, every chunk in a short transaction.
+    '''
+    compacted_num = 0
+    while True:
+        compacted = compact_chunk()
+        compacted_num += compacted
+        if compacted < chunk_size:
+            return compacted_num
+        time.sleep(pause)  # let other writers in
+
+
+def compact(days, chunk_size, pause, archive=True):
+    before = MessageService.get_compact_before(days)
+    return _by_chunks(lambda: MessageService.compact_back_ups(before, chunk_size, archive), chunk_size, pause)
+
+
+def purge_outbox(days, chunk_size, pause):
+    ''' Outbox messages sent more than `days` ago are deleted, never archived '''
+    before = datetime.now() - timedelta(days=days)
+    return _by_chunks(lambda: MessageService.purge_sent_outbox(before, chunk_size), chunk_size, pause)
+
+
+class Command(BaseCommand):
+    help = u'Moves old message backups to message_backup_archive, or deletes them, and deletes old sent outbox messages'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--usage',
+                    action='help',
+                    help='python manage.py compact_message_backup --days=30 --chunk=1000'),
+        make_option('--days',
+                    action='store',
+                    type='int',
+                    dest='days',
+                    default=None,
+                    help='keep backups and sent outbox messages of the recent days, '
+                         'MESSAGE_BACKUP_RETENTION_DAYS by default'),
+        make_option('--chunk',
+                    action='store',
+                    type='int',
+                    dest='chunk',
+                    default=1000,
+                    help='backups moved in one transaction'),
+        make_option('--pause',
+                    action='store',
+                    type='float',
+                    dest='pause',
+                    default=0.1,
+                    help='seconds to wait between two chunks'),
+        make_option('--delete',
+                    action='store_true',
+                    dest='delete',
+                    default=False,
+                    help='delete old backups instead of archiving them'),
+    )
+
+    def handle(self, *args, **options):
+        days = options['days']
+        if days is None:
+            days = getattr(settings, 'MESSAGE_BACKUP_RETENTION_DAYS', 30)
+        compacted_num = compact(days, options['chunk'], options['pause'], not options['delete'])
+        print '{0} {1} message backups'.format('delete' if options['delete'] else 'archive', compacted_num)
+        purged_num = purge_outbox(days, options['chunk'], options['pause'])
+        print 'delete {0} sent outbox messages'.format(purged_num)
@@ -0,0 +1,43 @@
+# -*- coding:utf-8 -*-
+
+import time
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from information import redis_tools
+
+
+def flush(interval, once=False):
+    sent_num = 0
+    while True:
+        sent_num += redis_tools.flush_coalesced()
+        if once:
+            return sent_num
+        connection.close()
+        time.sleep(interval)
+
+
+class Command(BaseCommand):
+    help = u'Publishes the coalesced notifications whose window is over'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--usage',
+                    action='help',
+                    help='python manage.py flush_notifications --interval=0.5'),
+        make_option('--interval',
+                    action='store',
+                    type='float',
+                    dest='interval',
+                    default=0.5,
+                    help='seconds between two flushes, keep it below MESSAGE_COALESCE_WINDOW'),
+        make_option('--once',
+                    action='store_true',
+                    dest='once',
+                    default=False,
+                    help='flush once and exit'),
+    )
+
+    def handle(self, *args, **options):
+        sent_num = flush(options['interval'], options['once'])
+        print 'flush {0} messages'.format(sent_num)
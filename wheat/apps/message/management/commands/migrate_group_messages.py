@@ -0,0 +1,42 @@
+# -*- coding:utf-8 -*-
+
+from optparse import make_option
+from django.core.management.base import BaseCommand
+
+from apps.message.models import GroupMessage
+from apps.message.services import GroupMessageService
+
+
+def migrate(delete_rows=False):
+    '''
+    Migrates group by group, every group in a transaction. Returns (groups, messages).
+    Groups with read cursors are skipped, so stop sending group messages until
+    GROUP_MESSAGE_STORAGE is switched, or the ones sent in between stay in rows.
+    '''
+    group_ids = GroupMessage.objects.find().values_list('group_id', flat=True).distinct()
+    group_num, message_num = 0, 0
+    for group_id in list(group_ids):
+        migrated = GroupMessageService.migrate_group_to_cursor(group_id, delete_rows)
+        if migrated is not None:
+            group_num += 1
+            message_num += migrated
+    return group_num, message_num
+
+
+class Command(BaseCommand):
+    help = u'Moves group messages from per member rows to group_chat_message and read cursors'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--usage',
+                    action='help',
+                    help='python manage.py migrate_group_messages, then set GROUP_MESSAGE_STORAGE = \'cursor\''),
+        make_option('--delete',
+                    action='store_true',
+                    dest='delete',
+                    default=False,
+                    help='delete the group_message rows of migrated groups'),
+    )
+
+    def handle(self, *args, **options):
+        group_num, message_num = migrate(options['delete'])
+        print 'migrate {0} messages of {1} groups'.format(message_num, group_num)
@@ -0,0 +1,51 @@
+# -*- coding:utf-8 -*-
+
+import time
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from information import redis_tools
+
+
+def relay(batch_size, interval, once=False):
+    sent_num = 0
+    while True:
+        sent = redis_tools.relay_outbox(batch_size)
+        sent_num += sent
+        if once and sent < batch_size:
+            return sent_num
+        if sent < batch_size:
+            connection.close()
+            time.sleep(interval)
+
+
+class Command(BaseCommand):
+    help = u'Publishes the messages in message_outbox to redis'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--usage',
+                    action='help',
+                    help='python manage.py relay_outbox --batch=500 --interval=0.5'),
+        make_option('--batch',
+                    action='store',
+                    type='int',
+                    dest='batch',
+                    default=500,
+                    help='messages published in one pipeline'),
+        make_option('--interval',
+                    action='store',
+                    type='float',
+                    dest='interval',
+                    default=0.5,
+                    help='seconds to wait when outbox is empty'),
+        make_option('--once',
+                    action='store_true',
+                    dest='once',
+                    default=False,
+                    help='exit when outbox is empty'),
+    )
+
+    def handle(self, *args, **options):
+        sent_num = relay(options['batch'], options['interval'], options['once'])
+        print 'relay {0} messages'.format(sent_num)
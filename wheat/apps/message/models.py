@@ -10,9 +10,9 @@ from customs.models import EnhancedModel, CommonUpdateAble, CacheableManager
 
 class MessageBackup(CommonUpdateAble, models.Model, EnhancedModel):
     id = UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    message_id = models.CharField(max_length=50)
+    message_id = models.CharField(max_length=50, db_index=True)  # snowflake id, see customs.snowflake
     content = JSONField(default={})
-    created_data = models.DateTimeField(auto_now_add=True)
+    created_data = models.DateTimeField(auto_now_add=True, db_index=True)  # compacted by date
     event = models.CharField(max_length=50, null=False)
     sub_event = models.CharField(max_length=50, default=None, null=True)
 
@@ -20,6 +20,34 @@ class MessageBackup(CommonUpdateAble, models.Model, EnhancedModel):
         db_table = 'message_backup'
 
 
+class MessageBackupArchive(models.Model, EnhancedModel):
+    ''' Backups older than MESSAGE_BACKUP_RETENTION_DAYS, moved by compact_message_backup '''
+    id = UUIDField(primary_key=True, editable=False)  # same as in message_backup
+    message_id = models.CharField(max_length=50, db_index=True)
+    content = JSONField(default={})
+    created_data = models.DateTimeField(db_index=True)
+    event = models.CharField(max_length=50, null=False)
+    sub_event = models.CharField(max_length=50, default=None, null=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'message_backup_archive'
+
+
+class MessageOutbox(models.Model, EnhancedModel):
+    ''' Messages to publish, written in the transaction of their event and sent by relay_outbox '''
+    message = JSONField(default={})
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent = models.BooleanField(default=False)
+    sent_at = models.DateTimeField(null=True, default=None)
+
+    class Meta:
+        db_table = 'message_outbox'
+        index_together = [
+            ('sent', 'id'),  # for relay draining unsent messages in order
+        ]
+
+
 class Message(CommonUpdateAble, models.Model, EnhancedModel):
     CONTENT_TYPES = (
         ('text', u'文字'),
@@ -43,6 +71,9 @@ class Message(CommonUpdateAble, models.Model, EnhancedModel):
 
     class Meta:
         db_table = 'message'
+        index_together = [
+            ('sender_id', 'receiver_id', 'post_date'),  # history of a chat
+        ]
 
     @classmethod
     def valid_content_type(cls, content_type):
@@ -82,6 +113,9 @@ class GroupMessage(CommonUpdateAble, models.Model, EnhancedModel):
 
     class Meta:
         db_table = 'group_message'
+        index_together = [
+            ('group_id', 'receiver_id', 'post_date'),  # history of a group
+        ]
 
     @classmethod
     def valid_content_type(cls, content_type):
@@ -95,3 +129,56 @@ class GroupMessage(CommonUpdateAble, models.Model, EnhancedModel):
         if not isinstance(content, dict):
             return False
         return True
+
+
+class GroupChatMessage(models.Model, EnhancedModel):
+    ''' One row for a group message, read by members through GroupReadCursor '''
+    sender_id = UUIDField(db_index=True)
+    group_id = UUIDField()
+    content_type = models.CharField(max_length=15, choices=GroupMessage.CONTENT_TYPES)
+    content = JSONField(default={})
+    post_date = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        db_table = 'group_chat_message'
+        index_together = [
+            ('group_id', 'id'),  # messages after a cursor
+            ('group_id', 'post_date'),  # history of a group
+        ]
+
+
+class GroupReadCursor(models.Model, EnhancedModel):
+    ''' The last GroupChatMessage a member received in a group '''
+    group_id = UUIDField()
+    member_id = UUIDField(db_index=True)
+    last_read_id = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'group_read_cursor'
+        unique_together = [
+            ('group_id', 'member_id'),
+        ]
+
+
+class ConversationSummary(models.Model, EnhancedModel):
+    ''' The latest message and unread count of a conversation of a user, kept when messages are created '''
+    CONVERSATION_TYPES = (
+        ('chat', u'私聊'),
+        ('group', u'群聊'),
+    )
+    user_id = UUIDField()
+    conversation_type = models.CharField(max_length=15, choices=CONVERSATION_TYPES)
+    conversation_id = UUIDField()  # the other user of a chat, or the group
+    last_message = JSONField(default={})
+    last_activity_at = models.DateTimeField()
+    unread_count = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'conversation_summary'
+        unique_together = [
+            ('user_id', 'conversation_type', 'conversation_id'),
+        ]
+        index_together = [
+            ('user_id', 'last_activity_at'),  # recent conversations of a user
+        ]
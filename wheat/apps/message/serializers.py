@@ -1,7 +1,7 @@
 # -*- coding:utf-8 -*-
 
 from customs.serializers import XModelSerializer
-from .models import Message, GroupMessage
+from .models import Message, GroupMessage, GroupChatMessage
 
 
 class MessageSerializer(XModelSerializer):
@@ -20,3 +20,12 @@ class GroupMessageSerializer(XModelSerializer):
         fields = ('id', 'sender_id', 'group_id', 'receiver_id',
                   'content_type', 'content',
                   'post_date', 'received',)
+
+
+class GroupChatMessageSerializer(XModelSerializer):
+
+    class Meta:
+        model = GroupChatMessage
+        fields = ('id', 'sender_id', 'group_id',
+                  'content_type', 'content',
+                  'post_date',)
@@ -1,13 +1,122 @@
 # -*- coding:utf-8 -*-
 
-from django.db import transaction
-from django.db.models import Q
+from django.db import transaction, IntegrityError
+from django.db.models import Q, F, Min, Max, Count
+from datetime import datetime, timedelta
+from itertools import islice
+import base64
+import operator
 import uuid
 
 from customs.services import BaseService
+from customs.funcs import get_setting, hex_id
 from .models import Message, GroupMessage
-from .serializers import MessageSerializer, GroupMessageSerializer
+from .serializers import MessageSerializer, GroupMessageSerializer, GroupChatMessageSerializer
 from .models import MessageBackup
+from .models import MessageOutbox
+from .models import MessageBackupArchive
+from .models import GroupChatMessage, GroupReadCursor
+from .models import ConversationSummary
+from apps.user import counters
+from apps.group.models import Group
+
+
+SYNC_PAGE_SIZE = 200
+
+# storage of group messages
+# rows: a GroupMessage for every member, marked received one by one
+# cursor: one GroupChatMessage, members read it by moving their GroupReadCursor
+ROWS, CURSOR = 'rows', 'cursor'
+
+# types of ConversationSummary
+CHAT, GROUP = 'chat', 'group'
+
+
+def get_group_message_storage():
+    return get_setting('GROUP_MESSAGE_STORAGE', ROWS)
+
+
+def _iter_by_cursor(queryset, page_size):
+    '''
+    Yields the objects of queryset in (post_date, id) order, one query for every page.
+    '''
+    cursor_q = Q()
+    while True:
+        page = list(queryset.filter(cursor_q).order_by('post_date', 'id')[:page_size])
+        for obj in page:
+            yield obj
+        if len(page) < page_size:
+            return
+        last = page[-1]
+        cursor_q = Q(post_date__gt=last.post_date) | Q(post_date=last.post_date, id__gt=last.id)
+
+
+HISTORY_CURSOR_DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+HISTORY_FIELDS = ('id', 'sender_id', 'receiver_id', 'group_id', 'content_type', 'content', 'post_date', 'cursor')
+DEFAULT_CONTENT_TYPE = 'text'
+
+
+def encode_history_cursor(message):
+    '''
+    Gives an opaque cursor of message's position (post_date, id) in its conversation.
+    '''
+    position = '{0}|{1}'.format(message.post_date.strftime(HISTORY_CURSOR_DATE_FORMAT), hex_id(message.id))
+    return base64.urlsafe_b64encode(position)
+
+
+def decode_history_cursor(cursor):
+    '''
+    Returns:
+        (post_date, id) of the cursor
+    Raises:
+        ValueError: if cursor is not given by encode_history_cursor
+    '''
+    try:
+        post_date, message_id = base64.urlsafe_b64decode(str(cursor)).split('|')
+        return datetime.strptime(post_date, HISTORY_CURSOR_DATE_FORMAT), message_id
+    except (TypeError, ValueError):
+        raise ValueError('unvalid cursor: {0}'.format(cursor))
+
+
+def get_history_page(messages, before=None, after=None, number=20):
+    '''
+    Gets `number` messages right before (or after) the decoded cursor, the newest
+    ones if no cursor, from older to newer. Returns (messages, has_more).
+    A range on post_date for every conversation condition of messages.
+    '''
+    if after:
+        post_date, message_id = after
+        messages = messages.filter(post_date__gte=post_date) \
+            .filter(Q(post_date__gt=post_date) | Q(id__gt=message_id)).order_by('post_date', 'id')
+    else:
+        if before:
+            post_date, message_id = before
+            messages = messages.filter(post_date__lte=post_date) \
+                .filter(Q(post_date__lt=post_date) | Q(id__lt=message_id))
+        messages = messages.order_by('-post_date', '-id')
+
+    page = list(messages[:number + 1])
+    has_more = len(page) > number
+    page = page[:number]
+    if not after:
+        page.reverse()
+    return page, has_more
+
+
+def serialize_history_message(message, fields=HISTORY_FIELDS):
+    '''
+    Compact: content_type is left out when it is text, and so are fields the model has not.
+    '''
+    data = {}
+    for field in fields:
+        if field == 'cursor':
+            data[field] = encode_history_cursor(message)
+        elif hasattr(message, field):
+            value = getattr(message, field)
+            if field == 'content_type' and value == DEFAULT_CONTENT_TYPE:
+                continue
+            data[field] = hex_id(value) if field.endswith('id') else value
+    return data
 
 
 class MessageService(BaseService):
@@ -50,6 +159,9 @@ class MessageService(BaseService):
                 receiver_id=receiver_id,
                 content_type=content_type,
                 content=content)
+            last_message = ConversationSummaryService.summarize(message)
+            ConversationSummaryService.touch(CHAT, sender_id, last_message, [receiver_id], unread=1)
+            ConversationSummaryService.touch(CHAT, receiver_id, last_message, [sender_id])
             return message
         return None
 
@@ -82,16 +194,34 @@ class MessageService(BaseService):
         return list(messages)
 
     @classmethod
-    def get_user_unreceived_messages(cls, receiver_id):
-        ''' 获取某个用户的所有未接受到的消息 '''
-        senders = set(Message.objects.filter(
+    def get_chat_messages(cls, user_id, other_id):
+        ''' 两个用户之间的所有消息 '''
+        return Message.objects.find(
+            Q(sender_id=user_id, receiver_id=other_id) |
+            Q(sender_id=other_id, receiver_id=user_id))
+
+    @classmethod
+    def get_user_unreceived_messages(cls, receiver_id, limit=None):
+        ''' 获取某个用户的所有未接受到的消息，按post_date排序 '''
+        return list(islice(cls.iter_user_unreceived_messages(receiver_id), limit))
+
+    @classmethod
+    def iter_user_unreceived_messages(cls, receiver_id, page_size=SYNC_PAGE_SIZE):
+        '''
+        Yields the messages of every session after its first unreceived one, in post_date order.
+        Makes one query for the sessions and one for every page, however many sessions there are.
+        '''
+        starts = list(Message.objects.find(
             receiver_id=receiver_id,
-            received=False).values_list('sender_id', flat=True))
-        messages = []
-        for sender_id in senders:
-            messages += MessageService.get_session_unreceived_messages(
-                sender_id, receiver_id)
-        return messages
+            received=False).values('sender_id').annotate(start=Min('post_date')))
+        if not starts:
+            return iter([])
+
+        sessions_q = reduce(operator.or_, [Q(
+            Q(Q(sender_id=start['sender_id']) & Q(receiver_id=receiver_id)) |
+            Q(Q(sender_id=receiver_id) & Q(receiver_id=start['sender_id'])),
+            post_date__gte=start['start']) for start in starts])
+        return _iter_by_cursor(Message.objects.find(sessions_q), page_size)
 
     @staticmethod
     def backup(message, uid, event, sub_event):
@@ -102,15 +232,110 @@ class MessageService(BaseService):
         backup.sub_event = sub_event
         backup.save()
 
+    @staticmethod
+    def backup_many(messages):
+        '''
+        Backs up published messages with one insert, every message has its mid.
+        '''
+        MID, EVENT, SUB_EVENT = 'mid', 'event', 'sub_event'
+        MessageBackup.objects.bulk_create([
+            MessageBackup(
+                message_id=message[MID],
+                content=message,
+                event=message[EVENT],
+                sub_event=message.get(SUB_EVENT, ""))
+            for message in messages
+        ])
+
+    @staticmethod
+    def get_back_ups_after(message_id, number=100):
+        '''
+        Gets the backups made after message_id, older to newer.
+        '''
+        return list(MessageBackup.objects.filter(message_id__gt=message_id).order_by('message_id')[:number])
+
+    @staticmethod
+    def add_to_outbox(messages):
+        MessageOutbox.objects.bulk_create([MessageOutbox(message=message) for message in messages])
+
+    @staticmethod
+    @transaction.atomic
+    def relay_outbox(publish, batch_size):
+        '''
+        Publishes a batch of unsent outbox messages by publish(messages) and marks them sent.
+        Rows are locked until marked, so relays running together don't send one twice.
+        Returns the number of sent messages.
+        '''
+        outbox = list(MessageOutbox.objects.select_for_update()
+                      .filter(sent=False).order_by('id')[:batch_size])
+        if not outbox:
+            return 0
+
+        publish([o.message for o in outbox])
+        MessageOutbox.objects.filter(id__in=[o.id for o in outbox]).update(sent=True, sent_at=datetime.now())
+        return len(outbox)
+
     @staticmethod
     def get_back_up(message_id):
         try:
             backup = MessageBackup.objects.get(message_id=message_id)
             return backup
+        except MessageBackup.DoesNotExist:
+            return MessageBackupArchive.objects.filter(message_id=message_id).first()
         except Exception as e:
             print e
             return None
 
+    @staticmethod
+    def get_compact_before(days):
+        '''
+        Backups before it can be compacted: older than `days`, and not waiting in outbox.
+        '''
+        before = datetime.now() - timedelta(days=days)
+        oldest_unsent = MessageOutbox.objects.filter(sent=False).order_by('id').first()
+        if oldest_unsent is not None:
+            before = min(before, oldest_unsent.created_at)
+        return before
+
+    @staticmethod
+    @transaction.atomic
+    def compact_back_ups(before, chunk_size, archive=True):
+        '''
+        Moves (or deletes if not archive) up to chunk_size backups created before `before`,
+        oldest first. Returns the number of them, 0 when nothing is left.
+        '''
+        ids = list(MessageBackup.objects.filter(created_data__lt=before)
+                   .order_by('created_data').values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            return 0
+        if archive:
+            MessageBackupArchive.objects.bulk_create([
+                MessageBackupArchive(
+                    id=backup.id,
+                    message_id=backup.message_id,
+                    content=backup.content,
+                    created_data=backup.created_data,
+                    event=backup.event,
+                    sub_event=backup.sub_event)
+                for backup in MessageBackup.objects.filter(id__in=ids)
+            ])
+        MessageBackup.objects.filter(id__in=ids).delete()
+        return len(ids)
+
+    @staticmethod
+    @transaction.atomic
+    def purge_sent_outbox(before, chunk_size):
+        '''
+        Deletes up to chunk_size outbox messages sent before `before`, oldest first,
+        their backups are kept. Returns the number of them, 0 when nothing is left.
+        '''
+        ids = list(MessageOutbox.objects.filter(sent=True, sent_at__lt=before)
+                   .order_by('id').values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            return 0
+        MessageOutbox.objects.filter(id__in=ids).delete()
+        return len(ids)
+
 
 class GroupMessageService(BaseService):
     @classmethod
@@ -127,6 +352,8 @@ class GroupMessageService(BaseService):
     def serialize(cls, obj, context={}):
         if isinstance(obj, GroupMessage):
             return GroupMessageSerializer(obj, context=context).data
+        if isinstance(obj, GroupChatMessage):
+            return GroupChatMessageSerializer(obj, context=context).data
 
     @classmethod
     def get_message(cls, **kwargs):
@@ -139,8 +366,10 @@ class GroupMessageService(BaseService):
     @classmethod
     @transaction.atomic
     def create_messages(cls, message_dict):
-        ''' group里面除sender之外的所有成员都会创建一条新消息 '''
-        from apps.group.services import GroupService
+        '''
+        group里面除sender之外的所有成员都会创建一条新消息
+        In cursor storage, creates one GroupChatMessage for the group instead.
+        '''
         sender_id = message_dict.get('sender_id')
         group_id = message_dict.get('group_id')
         content_type = message_dict.get('content_type')
@@ -148,38 +377,217 @@ class GroupMessageService(BaseService):
         if sender_id and group_id \
                 and GroupMessage.valid_content_type(content_type) \
                 and GroupMessage.valid_content(content):
-            group = GroupService.get_group(id=group_id)
+            group = Group.objects.get_or_none(id=group_id)
             messages = []
             if not group:
                 return messages
-            for member_id, member_info in group.members.items():
-                if member_id == sender_id:
-                    continue
-                message = GroupMessage(
-                    id=uuid.uuid4(),
-                    sender_id=sender_id,
-                    group_id=group_id,
-                    receiver_id=member_id,
-                    content_type=content_type,
-                    content=content)
-                messages.append(message)
-            GroupMessage.objects.bulk_create(messages)
+            if get_group_message_storage() == CURSOR:
+                messages = [cls._create_chat_message(sender_id, group, content_type, content)]
+            else:
+                messages = cls._create_member_messages(sender_id, group, content_type, content)
+            cls._touch_summaries(sender_id, group, messages)
             return messages
         return []
 
+    @classmethod
+    def _touch_summaries(cls, sender_id, group, messages):
+        if not messages:
+            return
+        last_message = ConversationSummaryService.summarize(messages[0])
+        member_ids = [member_id for member_id in group.members.keys() if member_id != sender_id]
+        ConversationSummaryService.touch(GROUP, group.id, last_message, member_ids, unread=1)
+        ConversationSummaryService.touch(GROUP, group.id, last_message, [sender_id])
+
+    @classmethod
+    def _create_member_messages(cls, sender_id, group, content_type, content):
+        messages = []
+        for member_id, member_info in group.members.items():
+            if member_id == sender_id:
+                continue
+            message = GroupMessage(
+                id=uuid.uuid4(),
+                sender_id=sender_id,
+                group_id=group.id,
+                receiver_id=member_id,
+                content_type=content_type,
+                content=content)
+            messages.append(message)
+        GroupMessage.objects.bulk_create(messages)
+        return messages
+
+    @classmethod
+    def _create_chat_message(cls, sender_id, group, content_type, content):
+        message = GroupChatMessage.objects.create(
+            sender_id=sender_id,
+            group_id=group.id,
+            content_type=content_type,
+            content=content)
+        # members joined before this message start reading from it
+        cls._ensure_read_cursors(group.id, group.members.keys(), message.id - 1)
+        return message
+
+    @classmethod
+    def _ensure_read_cursors(cls, group_id, member_ids, last_read_id):
+        member_ids = set(hex_id(member_id) for member_id in member_ids)
+        existed = set(hex_id(member_id) for member_id in GroupReadCursor.objects.filter(
+            group_id=group_id,
+            member_id__in=member_ids).values_list('member_id', flat=True))
+        missing = member_ids - existed
+        if not missing:
+            return
+        try:
+            with transaction.atomic():
+                GroupReadCursor.objects.bulk_create([
+                    GroupReadCursor(group_id=group_id, member_id=member_id, last_read_id=last_read_id)
+                    for member_id in missing
+                ])
+        except IntegrityError:
+            pass  # made by another message of the group at the same time
+
+    @classmethod
+    def update_read_cursor(cls, group_id, member_id, message_id):
+        '''
+        Marks the messages of group until message_id as received by member,
+        the cursor never moves back. Returns whether it is moved.
+        '''
+        moved = GroupReadCursor.objects.filter(
+            group_id=group_id,
+            member_id=member_id,
+            last_read_id__lt=message_id).update(last_read_id=message_id, updated_at=datetime.now())
+        if not moved and not GroupReadCursor.objects.filter(group_id=group_id, member_id=member_id).exists():
+            cls._ensure_read_cursors(group_id, [member_id], message_id)
+            moved = 1
+        return bool(moved)
+
+    @classmethod
+    def delete_read_cursor(cls, group_id, member_id):
+        ''' A member left the group receives no more message of it '''
+        GroupReadCursor.objects.filter(group_id=group_id, member_id=member_id).delete()
+
     @classmethod
     @transaction.atomic
-    def update_message_as_received(cls, message):
-        if not message.received:
+    def update_message_as_received(cls, message, receiver_id=None):
+        '''
+        receiver_id is needed for a message in cursor storage, raises ValueError without it.
+        '''
+        if isinstance(message, GroupChatMessage):
+            if not receiver_id:
+                raise ValueError('receiver_id is needed to move the read cursor')
+            cls.update_read_cursor(message.group_id, receiver_id, message.id)
+        elif not message.received:
             message.update(received=True)
 
     @classmethod
     @transaction.atomic
-    def update_messages_as_received(cls, message_ids):
+    def update_messages_as_received(cls, message_ids, receiver_id=None):
+        '''
+        receiver_id is needed in cursor storage, cursors are moved to the newest message of each group.
+        Raises ValueError without it.
+        '''
+        if get_group_message_storage() == CURSOR:
+            if not receiver_id:
+                raise ValueError('receiver_id is needed to move the read cursors')
+            last_ids = GroupChatMessage.objects.filter(
+                id__in=message_ids).values('group_id').annotate(last_id=Max('id'))
+            for item in last_ids:
+                cls.update_read_cursor(item['group_id'], receiver_id, item['last_id'])
+            return
         GroupMessage.objects.filter(
             id__in=message_ids,
             received=False).update(received=True)
 
+    @classmethod
+    @transaction.atomic
+    def migrate_group_to_cursor(cls, group_id, delete_rows=False):
+        '''
+        Makes GroupChatMessages and read cursors from the GroupMessage rows of a group.
+        The rows made for one message (same sender and content, and in one second)
+        become one GroupChatMessage. A member's cursor stops before the first message
+        it has not received. Returns the number of GroupChatMessages, None if the
+        group is migrated already.
+        '''
+        if GroupReadCursor.objects.filter(group_id=group_id).exists():
+            return None
+
+        chat_messages = []  # [(GroupChatMessage, {receiver_id: received})]
+        for row in GroupMessage.objects.find(group_id=group_id).order_by('post_date', 'id').iterator():
+            receiver_id = hex_id(row.receiver_id)
+            if chat_messages:
+                last, receivers = chat_messages[-1]
+                if last.sender_id == row.sender_id and last.content == row.content \
+                        and last.content_type == row.content_type \
+                        and (row.post_date - last.post_date).total_seconds() < 1 \
+                        and receiver_id not in receivers:
+                    receivers[receiver_id] = row.received
+                    continue
+            chat_message = GroupChatMessage.objects.create(
+                sender_id=row.sender_id,
+                group_id=group_id,
+                content_type=row.content_type,
+                content=row.content)
+            # keep the time it was sent, auto_now_add is set on create
+            GroupChatMessage.objects.filter(id=chat_message.id).update(post_date=row.post_date)
+            chat_message.post_date = row.post_date
+            chat_messages.append((chat_message, {receiver_id: row.received}))
+
+        cursors = {}
+        unreceived = set()
+        for chat_message, receivers in chat_messages:
+            for receiver_id, received in receivers.items():
+                if receiver_id in unreceived:
+                    continue
+                if received:
+                    cursors[receiver_id] = chat_message.id
+                else:
+                    cursors[receiver_id] = chat_message.id - 1
+                    unreceived.add(receiver_id)
+
+        GroupReadCursor.objects.bulk_create([
+            GroupReadCursor(group_id=group_id, member_id=member_id, last_read_id=last_read_id)
+            for member_id, last_read_id in cursors.items()
+        ])
+        if delete_rows:
+            GroupMessage.objects.find(group_id=group_id).delete()
+        return len(chat_messages)
+
+    @classmethod
+    def get_group_messages(cls, user_id, group_id):
+        '''
+        The messages of a group seen by user, None with rows storage: a message
+        sent by user has a row for every other member and none for user, so the
+        history of user cannot be paged from the rows.
+        '''
+        if get_group_message_storage() == CURSOR:
+            return GroupChatMessage.objects.filter(group_id=group_id)
+        return None
+
+    @classmethod
+    def get_unread_counts(cls, receiver_id):
+        '''
+        Gets {group_id: number of unreceived messages}, in one query for either storage.
+        '''
+        if get_group_message_storage() == CURSOR:
+            unread = cls._get_unread_chat_messages(receiver_id)
+            if unread is None:
+                return {}
+        else:
+            unread = GroupMessage.objects.find(receiver_id=receiver_id, received=False)
+        counts = unread.values('group_id').annotate(number=Count('id'))
+        return dict((hex_id(item['group_id']), item['number']) for item in counts)
+
+    @classmethod
+    def _get_unread_chat_messages(cls, receiver_id):
+        '''
+        The GroupChatMessages after the cursors of receiver, None if receiver has no cursor.
+        '''
+        cursors = list(GroupReadCursor.objects.filter(
+            member_id=receiver_id).values_list('group_id', 'last_read_id'))
+        if not cursors:
+            return None
+        after_cursors_q = reduce(operator.or_, [
+            Q(group_id=group_id, id__gt=last_read_id) for group_id, last_read_id in cursors])
+        return GroupChatMessage.objects.filter(after_cursors_q).exclude(sender_id=receiver_id)
+
     @classmethod
     def get_session_unreceived_messages(cls, group_id, receiver_id):
         ''' 获取某个群会话中从第一条未接收的消息之后的所有群消息 '''
@@ -196,13 +604,104 @@ class GroupMessageService(BaseService):
         return list(messages)
 
     @classmethod
-    def get_user_unreceived_messages(cls, receiver_id):
-        ''' 获取所有未接收到的群消息 '''
-        group_ids = set(GroupMessage.objects.filter(
+    def get_user_unreceived_messages(cls, receiver_id, limit=None):
+        ''' 获取所有未接收到的群消息，按post_date排序 '''
+        return list(islice(cls.iter_user_unreceived_messages(receiver_id), limit))
+
+    @classmethod
+    def iter_user_unreceived_messages(cls, receiver_id, page_size=SYNC_PAGE_SIZE):
+        '''
+        Yields the group messages of every group after its first unreceived one, in post_date order.
+        In cursor storage, yields the GroupChatMessages after the cursors of receiver.
+        '''
+        if get_group_message_storage() == CURSOR:
+            unread = cls._get_unread_chat_messages(receiver_id)
+            return iter([]) if unread is None else _iter_by_cursor(unread, page_size)
+
+        starts = list(GroupMessage.objects.find(
             receiver_id=receiver_id,
-            received=False).values_list('group_id', flat=True))
-        messages = []
-        for group_id in group_ids:
-            messages += GroupMessageService.get_session_unreceived_messages(
-                group_id, receiver_id)
-        return messages
+            received=False).values('group_id').annotate(start=Min('post_date')))
+        if not starts:
+            return iter([])
+
+        groups_q = reduce(operator.or_, [
+            Q(group_id=start['group_id'], post_date__gte=start['start']) for start in starts])
+        return _iter_by_cursor(GroupMessage.objects.find(groups_q, receiver_id=receiver_id), page_size)
+
+
+class ConversationSummaryService(object):
+    '''
+    Keeps a ConversationSummary for every conversation of a user, and
+    unread_msgs of UserCounter as the sum of their unread counts.
+    '''
+
+    @staticmethod
+    def summarize(message):
+        return {
+            'id': hex_id(message.id),
+            'sender_id': hex_id(message.sender_id),
+            'content_type': message.content_type,
+            'content': message.content,
+        }
+
+    @staticmethod
+    def touch(conversation_type, conversation_id, last_message, user_ids, unread=0):
+        '''
+        Sets the last message of the conversation of users, and adds unread to their unread counts.
+        '''
+        user_ids = set(hex_id(user_id) for user_id in user_ids)
+        if not user_ids:
+            return
+        now = datetime.now()
+        conversation = dict(conversation_type=conversation_type, conversation_id=conversation_id)
+        updates = dict(last_message=last_message, last_activity_at=now, unread_count=F('unread_count') + unread)
+
+        existed = set(hex_id(user_id) for user_id in ConversationSummary.objects.filter(
+            user_id__in=user_ids, **conversation).values_list('user_id', flat=True))
+        if existed:
+            ConversationSummary.objects.filter(user_id__in=existed, **conversation).update(**updates)
+        missing = user_ids - existed
+        if missing:
+            try:
+                with transaction.atomic():
+                    ConversationSummary.objects.bulk_create([ConversationSummary(
+                        user_id=user_id,
+                        last_message=last_message,
+                        last_activity_at=now,
+                        unread_count=unread,
+                        **conversation) for user_id in missing])
+            except IntegrityError:  # created by others just now
+                ConversationSummary.objects.filter(user_id__in=missing, **conversation).update(**updates)
+
+        counters.incr(user_ids, **{counters.UNREAD_MSGS: unread})
+
+    @staticmethod
+    @transaction.atomic
+    def mark_read(user_id, conversation_type, conversation_id):
+        '''
+        Returns the number of messages marked read.
+        '''
+        summary = ConversationSummary.objects.select_for_update().filter(
+            user_id=user_id,
+            conversation_type=conversation_type,
+            conversation_id=conversation_id).first()
+        if summary is None or not summary.unread_count:
+            return 0
+        ConversationSummary.objects.filter(id=summary.id).update(unread_count=0)
+        counters.decr(user_id, counters.UNREAD_MSGS, summary.unread_count)
+        return summary.unread_count
+
+    @staticmethod
+    def get_summaries(user_id, number=20):
+        ''' Recent conversations first '''
+        return list(ConversationSummary.objects.filter(user_id=user_id).order_by('-last_activity_at')[:number])
+
+    @staticmethod
+    def serialize(summary):
+        return {
+            'type': summary.conversation_type,
+            'id': hex_id(summary.conversation_id),
+            'last_message': summary.last_message,
+            'last_activity_at': summary.last_activity_at,
+            'unread_count': summary.unread_count,
+        }
@@ -0,0 +1,197 @@
+# -*- coding:utf-8 -*-
+
+import uuid
+from django.test import TestCase
+
+from apps.group.models import Group
+from .models import Message, GroupMessage, GroupChatMessage, GroupReadCursor
+from apps.user import counters
+from . import services
+from .services import MessageService, GroupMessageService, ConversationSummaryService, CURSOR, CHAT
+
+
+class UnreceivedMessageTest(TestCase):
+    def setUp(self):
+        self.receiver = uuid.uuid4().hex
+        self.senders = [uuid.uuid4().hex for i in range(3)]
+
+    def _send(self, sender_id, receiver_id, received=False):
+        return Message.objects.create(
+            sender_id=sender_id, receiver_id=receiver_id,
+            content_type='text', content={'text': 'hi'}, received=received)
+
+    def test_sessions_in_one_page(self):
+        old = self._send(self.senders[0], self.receiver, received=True)
+        expected = []
+        for sender_id in self.senders:
+            expected.append(self._send(sender_id, self.receiver))
+            expected.append(self._send(self.receiver, sender_id))  # reply after the unreceived one
+        self._send(uuid.uuid4().hex, uuid.uuid4().hex)  # other users
+
+        with self.assertNumQueries(2):  # sessions and one page
+            messages = MessageService.get_user_unreceived_messages(self.receiver)
+
+        self.assertEqual([m.id for m in messages], [m.id for m in expected])
+        self.assertFalse(old.id in [m.id for m in messages])
+
+    def test_pages(self):
+        for i in range(5):
+            self._send(self.senders[i % 3], self.receiver)
+
+        messages = list(MessageService.iter_user_unreceived_messages(self.receiver, page_size=2))
+        self.assertEqual(len(messages), 5)
+        self.assertEqual(messages, sorted(messages, key=lambda m: m.post_date))
+        self.assertEqual(len(MessageService.get_user_unreceived_messages(self.receiver, limit=3)), 3)
+
+    def test_nothing_unreceived(self):
+        self._send(self.senders[0], self.receiver, received=True)
+        self.assertEqual(MessageService.get_user_unreceived_messages(self.receiver), [])
+
+    def test_group_messages(self):
+        group_id = uuid.uuid4().hex
+        for received in (True, False, False):
+            GroupMessage.objects.create(
+                sender_id=self.senders[0], group_id=group_id, receiver_id=self.receiver,
+                content_type='text', content={}, received=received)
+
+        messages = GroupMessageService.get_user_unreceived_messages(self.receiver)
+        self.assertEqual([m.received for m in messages], [False, False])
+
+
+class GroupCursorStorageTest(TestCase):
+    def setUp(self):
+        self.members = [uuid.uuid4().hex for i in range(4)]
+        self.sender = self.members[0]
+        self.group = Group.objects.create(
+            group_type='common', name='chat', creator_id=self.sender,
+            members=dict((member_id, {}) for member_id in self.members))
+
+    def _send(self, text):
+        return GroupMessageService.create_messages({
+            'sender_id': self.sender,
+            'group_id': self.group.id,
+            'content_type': 'text',
+            'content': {'text': text}})
+
+    def test_one_row_per_message(self):
+        with self.settings(GROUP_MESSAGE_STORAGE=CURSOR):
+            messages = self._send('hi') + self._send('again')
+
+            self.assertEqual(GroupChatMessage.objects.count(), 2)
+            self.assertFalse(GroupMessage.objects.find().exists())
+            self.assertEqual(GroupReadCursor.objects.count(), len(self.members))
+
+            reader = self.members[1]
+            unreceived = GroupMessageService.get_user_unreceived_messages(reader)
+            self.assertEqual([m.id for m in unreceived], [m.id for m in messages])
+            self.assertEqual(GroupMessageService.get_unread_counts(reader), {self.group.id.hex: 2})
+            self.assertEqual(GroupMessageService.get_user_unreceived_messages(self.sender), [])
+
+            self.assertRaises(ValueError, GroupMessageService.update_messages_as_received, [messages[0].id])
+            self.assertRaises(ValueError, GroupMessageService.update_message_as_received, messages[0])
+            self.assertFalse(GroupReadCursor.objects.filter(member_id=None).exists())
+            GroupMessageService.update_messages_as_received([messages[0].id], reader)
+            self.assertEqual(GroupMessageService.get_unread_counts(reader), {self.group.id.hex: 1})
+            self.assertFalse(GroupMessageService.update_read_cursor(self.group.id, reader, messages[0].id))
+
+    def test_group_history(self):
+        self.assertIsNone(GroupMessageService.get_group_messages(self.members[1], self.group.id))
+        with self.settings(GROUP_MESSAGE_STORAGE=CURSOR):
+            messages = self._send('hi')
+            history = GroupMessageService.get_group_messages(self.sender, self.group.id)
+            page, has_more = services.get_history_page(history)
+            self.assertEqual([m.id for m in page], [m.id for m in messages])  # sent by user, once
+            self.assertFalse(has_more)
+
+    def test_unread_counts_of_rows(self):
+        self._send('hi')
+        self.assertEqual(GroupMessageService.get_unread_counts(self.members[1]), {self.group.id.hex: 1})
+
+    def test_migrate(self):
+        first, second = self._send('hi'), self._send('again')
+        self.assertEqual(len(second), len(self.members) - 1)  # a row for every member but sender
+        reader, other = self.members[1], self.members[2]
+        GroupMessageService.update_messages_as_received([m.id for m in first if m.receiver_id == reader], reader)
+
+        self.assertEqual(GroupMessageService.migrate_group_to_cursor(self.group.id, delete_rows=True), 2)
+        self.assertIsNone(GroupMessageService.migrate_group_to_cursor(self.group.id))  # migrated
+
+        with self.settings(GROUP_MESSAGE_STORAGE=CURSOR):
+            self.assertEqual(GroupMessageService.get_unread_counts(reader), {self.group.id.hex: 1})
+            self.assertEqual(GroupMessageService.get_unread_counts(other), {self.group.id.hex: 2})
+
+
+class ConversationSummaryTest(TestCase):
+    def setUp(self):
+        self.sender, self.receiver = uuid.uuid4().hex, uuid.uuid4().hex
+
+    def _send(self, sender_id, receiver_id, text):
+        return MessageService.create_message({
+            'sender_id': sender_id,
+            'receiver_id': receiver_id,
+            'content_type': 'text',
+            'content': {'text': text}})
+
+    def test_chat_summary(self):
+        self._send(self.sender, self.receiver, 'hi')
+        message = self._send(self.sender, self.receiver, 'again')
+
+        summary, = ConversationSummaryService.get_summaries(self.receiver)
+        self.assertEqual(summary.unread_count, 2)
+        self.assertEqual(summary.last_message['id'], message.id.hex)
+        self.assertEqual(counters.get_counter(self.receiver).unread_msgs, 2)
+        self.assertEqual(ConversationSummaryService.get_summaries(self.sender)[0].unread_count, 0)
+
+        self.assertEqual(ConversationSummaryService.mark_read(self.receiver, CHAT, self.sender), 2)
+        self.assertEqual(counters.get_counter(self.receiver).unread_msgs, 0)
+        self.assertEqual(ConversationSummaryService.mark_read(self.receiver, CHAT, self.sender), 0)
+
+    def test_counters(self):
+        counters.incr([self.sender, self.receiver], unread_feeds=2)
+        counters.incr([self.receiver], unread_feeds=1, unread_comments=1)
+        counters.decr(self.receiver, counters.UNREAD_COMMENTS, 5)
+
+        counter = counters.get_counter(self.receiver)
+        self.assertEqual((counter.unread_feeds, counter.unread_comments), (3, 0))
+        counters.clear(self.receiver, counters.UNREAD_FEEDS)
+        self.assertEqual(counters.get_counter(self.receiver).unread_feeds, 0)
+        self.assertEqual(counters.get_counter(self.sender).unread_feeds, 2)
+
+
+class ChatHistoryTest(TestCase):
+    def setUp(self):
+        self.user_id, self.other_id = uuid.uuid4().hex, uuid.uuid4().hex
+        self.sent = []
+        for i in range(5):
+            sender_id, receiver_id = (self.user_id, self.other_id) if i % 2 else (self.other_id, self.user_id)
+            self.sent.append(Message.objects.create(
+                sender_id=sender_id, receiver_id=receiver_id, content_type='text', content={'text': str(i)}))
+        Message.objects.create(sender_id=self.user_id, receiver_id=uuid.uuid4().hex,
+                               content_type='text', content={})  # another chat
+
+    def _page(self, before=None, after=None, number=2):
+        messages = MessageService.get_chat_messages(self.user_id, self.other_id)
+        return services.get_history_page(messages, before, after, number)
+
+    def test_scroll_back(self):
+        page, has_more = self._page()
+        self.assertEqual([m.id for m in page], [m.id for m in self.sent[3:]])
+        self.assertTrue(has_more)
+
+        cursor = services.decode_history_cursor(services.encode_history_cursor(page[0]))
+        page, has_more = self._page(before=cursor, number=3)
+        self.assertEqual([m.id for m in page], [m.id for m in self.sent[:3]])
+        self.assertFalse(has_more)
+
+    def test_new_messages(self):
+        cursor = services.decode_history_cursor(services.encode_history_cursor(self.sent[1]))
+        page, has_more = self._page(after=cursor, number=10)
+        self.assertEqual([m.id for m in page], [m.id for m in self.sent[2:]])
+        self.assertFalse(has_more)
+
+    def test_compact_encoding(self):
+        message = services.serialize_history_message(self.sent[0])
+        self.assertFalse('content_type' in message)
+        self.assertEqual(message['sender_id'], self.other_id)
+        self.assertEqual(sorted(services.serialize_history_message(self.sent[0], ('id', 'cursor'))), ['cursor', 'id'])
+        self.assertRaises(ValueError, services.decode_history_cursor, 'not a cursor')
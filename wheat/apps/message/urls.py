@@ -0,0 +1,5 @@
+from customs.urls import get_urlpattern
+import apis
+urlpatterns = get_urlpattern({
+    'messages': apis.MessageViewSet,
+}, api_name='message-api')
@@ -1,5 +1,6 @@
 # -*- coding:utf-8 -*-
 
+import uuid
 from rest_framework import permissions, viewsets, status
 from rest_condition import Or
 
@@ -10,10 +11,11 @@ from apps.user.permissions import login_required
 from apps.user.permissions import user_is_same_as_logined_user
 from .services import MomentService
 from . import services
+from . import jobs
 from rest_framework.decorators import list_route, detail_route
-from customs.utility import get_image_from_maili_by_img_list
 from .services import CommentService, MarkService
 from customs import class_tools
+from customs.funcs import hex_id
 
 
 @class_tools.default_view_set
@@ -31,7 +33,7 @@ class MomentViewSet(ListModelMixin,
         获取和家信息
 
         ### Example Request:
-        Url: {API_URL}/moments/?receiver={id}&sender={id}&number={int}&begin-id={id}&compare={previous/after}
+        Url: {API_URL}/moments/?receiver={id}&sender={id}&number={int}&cursor={cursor}&compare={previous/after}
 
         获取某人的和家页面的moments（不限制非得本人发的）
 
@@ -63,12 +65,18 @@ class MomentViewSet(ListModelMixin,
         /moment?receiver=b123asd128hjkasdhjk&begin=ajkhsd1234hkjasdhjk&step＝15compare=after&query=1&sender={String}
         表示，获得author_group的id为XXX的全部用户的状态，且该状态要求比begin更早，返回数量最大为15条
 
+        e.g 06
+        /moment?receiver=b123asd128hjkasdhjk&cursor=MjAxNi0wNS0xMCAx...&number=15
+        表示，获取比cursor所在状态更早的15条数据，每条返回的状态都带有自己的cursor，
+        以及stat（like_count点赞数，comment_count评论数，share_count分享数）
+
 
         receiver -- 接收者的id, 为保证信息的安全，接收者的id必须与当前 token 的user_id一致，否则请求错误
         sender -- 发送者的id， 可以为空，为空则返回所有好友的和家信息
         number -- 获得的信息数量， 可以为空，为空则至多返回10条
-        begin-id -- 起始信息的id，可以为空，为空则返回系统中该用户可见的最新的信息（该信息有可能意见阅读或尚未阅读过）
-        compare -- 在begin－id之前发送的（previous）还是之后发送的（after），可以为空，为空时，既获得历史消息
+        cursor -- 起始信息的cursor（由返回的每条状态给出），可以为空，为空则返回系统中该用户可见的最新的信息
+        begin-id -- 起始信息的id，兼容旧版本，推荐使用cursor，同时给出时以cursor为准
+        compare -- 在cursor（或begin－id）之前发送的（previous）还是之后发送的（after），可以为空，为空时，既获得历史消息
         group -- 当该值为1的时候，所传送的id为查询某个“作者组”的和家状态, 如果该参数为空，默认为0，既查询的是关于个人的和家状态
         tags -- tags list, defalut is None, means all tags. Example:  tags=育儿,家庭， 注意，每个元素之间不需要引号，以英文逗号隔开
 
@@ -77,13 +85,14 @@ class MomentViewSet(ListModelMixin,
         '''
 
         RECEIVER, SENDER, STEP = 'receiver', 'sender', 'number'
-        BEGIN_ID, COMPARE = 'begin-id', 'compare'
+        BEGIN_ID, COMPARE, CURSOR = 'begin-id', 'compare', 'cursor'
         GROUP, TAGS = 'group', 'tags'
 
         receiver_id = request.query_params.get(RECEIVER, None)
         sender_id = request.query_params.get(SENDER, None)
         step = request.query_params.get(STEP, 10)
         begin_id = request.query_params.get(BEGIN_ID, None)
+        cursor = request.query_params.get(CURSOR, None)
         compare = request.query_params.get(COMPARE, None)
         group = request.query_params.get(GROUP, False)
         tags = request.query_params.get(TAGS, None)
@@ -93,13 +102,25 @@ class MomentViewSet(ListModelMixin,
         else:
             tags = []
 
+        try:
+            if cursor:
+                cursor = services.decode_cursor(cursor)
+            else:
+                cursor = services.get_begin_cursor(begin_id)
+        except ValueError as e:
+            return SimpleResponse(status=status.HTTP_400_BAD_REQUEST, errors=str(e))
+
         if receiver_id == str(request.user.id):
             moments = self._get_moment_by_condition(
                 receiver_id,
-                sender_id, step, begin_id,
+                sender_id, step, cursor,
                 compare, group, tags
             )
             moments_json_data = MomentService.serialize_objs(moments)
+            stats = services.get_moment_stats([moment.id for moment in moments])
+            for moment, moment_data in zip(moments, moments_json_data):
+                moment_data['cursor'] = services.encode_cursor(moment)
+                moment_data['stat'] = services.serialize_moment_stat(stats[hex_id(moment.id)])
             return SimpleResponse(moments_json_data)
         else:
             return SimpleResponse(
@@ -107,34 +128,28 @@ class MomentViewSet(ListModelMixin,
                 errors='need receiver_id the same as the id of login use'
             )
 
-    def _get_moment_by_condition(self, receiver, sender, step, begin_id, compare, group, tags):
-        if str(group) == '1':
-            # moments = AuthorService.get_author_list_by_author_group(sender)
-            moments = services.get_moment_from_author_list(receiver, sender)
+    def _get_moment_by_condition(self, receiver, sender, step, cursor, compare, group, tags):
+        if str(group) != '1' and sender is None and not tags:
+            # receiver's own feed, read from his timeline
+            moments = services.get_moment_from_timeline(receiver, compare, cursor, step)
         else:
-            moments = services.get_moment_by_receiver_and_sender_id(receiver, sender)
+            by_group = str(group) == '1'
+            if by_group:
+                # moments = AuthorService.get_author_list_by_author_group(sender)
+                moments = services.get_moment_from_author_list(receiver, sender)
+            else:
+                moments = services.get_moment_by_receiver_and_sender_id(receiver, sender)
 
-        moments = services.get_moment_compare_with_begin_id(moments, compare, begin_id)
-
-        moments = services.confine_moment_number(moments, step)
-
-        try:
-            moments = map(self._get_moment_img_size, moments)
-        except IOError:
-            print('Cannot find this picture')
+            if tags:
+                authors = services.get_moment_authors(receiver, sender, by_group)
+                moments = services.get_moment_page_by_tags(moments, authors, tags, compare, cursor, step)
+            else:
+                moments = services.get_moment_page(moments, compare, cursor, step)
 
-        moments = services.get_moment_by_tags(moments, tags)
+        moments = services.fill_moment_img_size(moments)
 
         return moments
 
-    def _get_moment_img_size(self, moment):
-        PICS, IMG_SIZE = 'pics', 'img_size'
-        if PICS in moment.content:
-            pictures = moment.content[PICS]
-            moment.content.setdefault(IMG_SIZE, get_image_from_maili_by_img_list(pictures))
-
-        return moment
-
     @login_required
     @user_is_same_as_logined_user
     def create(self, request):
@@ -411,44 +426,48 @@ class MomentViewSet(ListModelMixin,
 
         ### Request Example
 
-        >1. Get moment activities by moment id list.
+        >1. Get moment activities by moment id list, at most 100 moments once.
 
             URL: /moment/activity/
 
             Request:
 
             {
-                "moment_id_list": [{UID}],
+                "moment_id_list": [{UID}, {UID}],
                 "user_id": {UID}
             }
 
         ### Response Example:
 
+        Activities are keyed by the moment ids in moment_id_list.
+
             {
               "data": {
-                "comment": {
-                  "total": 3, // comment total number
-                  "detail": [
-                    {
-                      "@": null, // @ person
-                      "sender": "b35024e4280b4a7ba9baf9c1a80a1c05"
-                    },
-                    {
-                      "@": "4560cbcf0d4c47378f45fb6c4bb1e4f8",
-                      "sender": "b35024e4280b4a7ba9baf9c1a80a1c05"
-                    },
-                    {
-                      "@": "4560cbcf0d4c47378f45fb6c4bb1e4f8",
-                      "sender": "b35024e4280b4a7ba9baf9c1a80a1c05"
-                    }
-                  ]
-                },
-                "mark": {
-                  "like": {
-                    "total": 1,
+                "{UID}": {
+                  "comment": {
+                    "total": 3, // comment total number
                     "detail": [
-                      "b35024e4280b4a7ba9baf9c1a80a1c05"
+                      {
+                        "@": null, // @ person
+                        "sender": "b35024e4280b4a7ba9baf9c1a80a1c05"
+                      },
+                      {
+                        "@": "4560cbcf0d4c47378f45fb6c4bb1e4f8",
+                        "sender": "b35024e4280b4a7ba9baf9c1a80a1c05"
+                      },
+                      {
+                        "@": "4560cbcf0d4c47378f45fb6c4bb1e4f8",
+                        "sender": "b35024e4280b4a7ba9baf9c1a80a1c05"
+                      }
                     ]
+                  },
+                  "mark": {
+                    "like": {
+                      "total": 1,
+                      "detail": [
+                        "b35024e4280b4a7ba9baf9c1a80a1c05"
+                      ]
+                    }
                   }
                 }
               },
@@ -465,15 +484,35 @@ class MomentViewSet(ListModelMixin,
 
         moment_ids = request.data.get('moment_id_list', [])
         user_id = request.user.id
-        moment_id = moment_ids[0]
+
+        try:
+            id_map = self._get_hex_id_map(moment_ids)
+        except ValueError as e:
+            return SimpleResponse(status=status.HTTP_400_BAD_REQUEST, errors=str(e))
+
         try:
-            mark_activities = MarkService.get_content(moment_id, user_id)
-            comment_activities = CommentService.get_content(moment_id, user_id)
-            activities = self._get_acticities(mark_activities, comment_activities)
+            hex_ids = id_map.keys()
+            mark_activities = MarkService.get_contents(hex_ids, user_id)
+            comment_activities = CommentService.get_contents(hex_ids, user_id)
+            activities = {}
+            for moment_hex, moment_id in id_map.items():
+                activities[moment_id] = self._get_acticities(
+                    mark_activities[moment_hex], comment_activities[moment_hex])
             return SimpleResponse(data=activities)
         except Exception as e:
             return SimpleResponse(success=False, errors=str(e))
 
+    def _get_hex_id_map(self, moment_ids):
+        '''
+        Maps the hex of moment ids to the ids given by client.
+        '''
+        MAX_MOMENT_NUMBER = 100
+        if not isinstance(moment_ids, list):
+            raise ValueError('moment_id_list should be a list')
+        if len(moment_ids) > MAX_MOMENT_NUMBER:
+            raise ValueError('at most {0} moments once'.format(MAX_MOMENT_NUMBER))
+        return dict((uuid.UUID(str(mid)).hex, mid) for mid in moment_ids)
+
     def _get_acticities(self, mark_activities, comment_activities):
         COMMENT, MARK = 'comment', 'mark'
         info = {COMMENT: None, MARK: None}
@@ -485,6 +524,16 @@ class MomentViewSet(ListModelMixin,
     def wechat(self, request):
         '''
         Receives the wechat post moment
+        The moments are imported in background, gets the progress by job_id in /moment/wechat_status/
+
+        ### Response Example:
+
+            {
+              "data": {
+                "job_id": "2f1fa1b5-8d83-4d3c-9ac8-d1ef4f21a5d3"
+              },
+              "request": "success"
+            }
         ---
         omit_serializer: true
         omit_parameters:
@@ -496,16 +545,53 @@ class MomentViewSet(ListModelMixin,
 
         data = request.data
 
-        import_moments = None
+        job_id = None
 
         try:
-            import_moments = MomentService.import_wechat(data)
-            MomentService.create_wechat_moments(import_moments)
+            job_id = jobs.enqueue_wechat_import(data)
         except Exception as e:
             print e
 
-        success = import_moments is not None
-        return SimpleResponse(success=success)
+        success = job_id is not None
+        return SimpleResponse(data={'job_id': job_id}, success=success)
+
+    @login_required
+    @list_route(methods=['get'])
+    def wechat_status(self, request):
+        '''
+        Gets the progress of a wechat import of the logined user, kept for a day after it ends
+
+        ### Example Request:
+        Url: {API_URL}/moment/wechat_status/?job_id={job_id}
+
+        status -- queued/started/finished/failed
+        total -- moments to import
+        processed -- moments done, including the ones imported before
+        failed -- moments failed
+        imported -- moments created, given when finished
+
+        ### Response Example:
+
+            {
+              "data": {
+                "job_id": "2f1fa1b5-8d83-4d3c-9ac8-d1ef4f21a5d3",
+                "status": "started",
+                "total": 3000,
+                "processed": 1000,
+                "failed": 0
+              },
+              "request": "success"
+            }
+        ---
+        omit_serializer: true
+        '''
+        JOB_ID = 'job_id'
+
+        job_id = request.query_params.get(JOB_ID, None)
+        status_data = jobs.get_wechat_import_status(job_id, request.user.id) if job_id else None
+        if status_data is None:
+            return SimpleResponse(status=status.HTTP_404_NOT_FOUND, errors='no such import job')
+        return SimpleResponse(data=status_data)
             
                 
         
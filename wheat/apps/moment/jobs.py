@@ -0,0 +1,138 @@
+# -*- coding:utf-8 -*-
+'''
+Background jobs of moment app, run by rq workers:
+
+    python manage.py rqworker low
+'''
+
+import uuid
+
+import django_rq
+from rq import get_current_job
+from django.conf import settings
+
+from customs.funcs import hex_id
+from .models import Moment
+from .services import MomentService
+from . import services
+
+
+class InProcessJob(object):
+    '''
+    A job run when it is made, with the fields of rq job read here.
+    '''
+
+    def __init__(self, func, args, kwargs):
+        self.id = str(uuid.uuid4())
+        self.args = args
+        self.meta = {}
+        try:
+            self.result = func(*args, **kwargs)
+            self.status = 'finished'
+        except Exception:
+            self.result = None
+            self.status = 'failed'
+
+    def get_status(self):
+        return self.status
+
+
+class InProcessQueue(object):
+    '''
+    Runs jobs at once and keeps them in this process, as an rq queue with
+    ASYNC=False would, but needs no redis. Used when RQ_IN_PROCESS is set (tests).
+    '''
+
+    def __init__(self):
+        self.jobs = {}
+
+    def enqueue(self, func, *args, **kwargs):
+        kwargs.pop('result_ttl', None)
+        job = InProcessJob(func, args, kwargs)
+        self.jobs[job.id] = job
+        return job
+
+    def fetch_job(self, job_id):
+        return self.jobs.get(job_id)
+
+
+_in_process_queues = {}
+
+
+def _get_queue(setting='WECHAT_IMPORT_QUEUE'):
+    name = getattr(settings, setting, 'default')
+    if getattr(settings, 'RQ_IN_PROCESS', False):
+        return _in_process_queues.setdefault(name, InProcessQueue())
+    return django_rq.get_queue(name)
+
+
+def import_wechat(data, chunk_size):
+    '''
+    Imports wechat moments, keeps the progress in job.meta.
+    Returns the counts of the import.
+    '''
+    TOTAL, PROCESSED, FAILED, IMPORTED = 'total', 'processed', 'failed', 'imported'
+    job = get_current_job()
+    result = {TOTAL: 0, PROCESSED: 0, FAILED: 0}
+
+    def save_progress(total, processed, failed):
+        result.update({TOTAL: total, PROCESSED: processed, FAILED: failed})
+        if job is not None:
+            job.meta.update(result)
+            job.save()
+
+    moments = MomentService.import_wechat_bulk(data, chunk_size, save_progress)
+    services.record_img_sizes(moments)  # wechat pictures are not in image table
+
+    result[IMPORTED] = len(moments)
+    return result
+
+
+def enqueue_wechat_import(data):
+    '''
+    Enqueues a wechat import, returns the job id.
+    '''
+    chunk_size = getattr(settings, 'WECHAT_IMPORT_CHUNK', 500)
+    # rq drops the result in 500 seconds by default, too soon for a client polling late
+    result_ttl = getattr(settings, 'WECHAT_IMPORT_RESULT_TTL', 60 * 60 * 24)
+    job = _get_queue().enqueue(import_wechat, data, chunk_size, result_ttl=result_ttl)
+    return job.id
+
+
+def _get_import_user_id(job):
+    ''' The user importing moments, cuid of the data the job is given '''
+    try:
+        return hex_id(job.args[0]['data']['cuid'])
+    except Exception:
+        return None
+
+
+def get_wechat_import_status(job_id, user_id):
+    '''
+    Gets the status and counts of a wechat import of user, None if no such job,
+    or it is not of user.
+    '''
+    job = _get_queue().fetch_job(job_id)
+    if job is None or _get_import_user_id(job) != hex_id(user_id):
+        return None
+
+    status = {'job_id': job.id, 'status': job.get_status()}
+    if isinstance(job.result, dict):
+        status.update(job.result)
+    else:
+        status.update(job.meta)
+    return status
+
+
+def record_img_sizes(moment_ids):
+    '''
+    Records the picture sizes of moments, downloading the pictures not uploaded to us.
+    Returns the number of moments saved.
+    '''
+    moments = Moment.objects.find(id__in=moment_ids, deleted=False)
+    return services.record_img_sizes(list(moments))
+
+
+def enqueue_img_sizes(moment_ids):
+    if moment_ids:
+        _get_queue('MOMENT_IMG_SIZE_QUEUE').enqueue(record_img_sizes, map(hex_id, moment_ids))
@@ -0,0 +1,53 @@
+# -*- coding:utf-8 -*-
+
+from optparse import make_option
+from django.core.management.base import BaseCommand
+
+from apps.moment.models import Moment
+from apps.moment.services import record_img_sizes
+
+
+def backfill_moment_img_size(chunk_size, fetch=True):
+    '''
+    Records the picture sizes of existing moments, a chunk of moments is looked
+    up in image table with one query. Returns the number of moments saved.
+    '''
+    moments = Moment.objects.find(deleted=False).only('id', 'content').order_by('post_date')
+
+    updated = 0
+    chunk = []
+    for moment in moments.iterator():
+        chunk.append(moment)
+        if len(chunk) >= chunk_size:
+            updated += record_img_sizes(chunk, fetch)
+            chunk = []
+
+    if chunk:
+        updated += record_img_sizes(chunk, fetch)
+
+    return updated
+
+
+class Command(BaseCommand):
+    help = u'Records picture sizes in the content of existing moments'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--usage',
+                    action='help',
+                    help='python manage.py backfill_moment_img_size --chunk=200'),
+        make_option('--chunk',
+                    action='store',
+                    type='int',
+                    dest='chunk',
+                    default=200,
+                    help='moments looked up in one query'),
+        make_option('--no-fetch',
+                    action='store_false',
+                    dest='fetch',
+                    default=True,
+                    help='do not download the pictures not in image table'),
+    )
+
+    def handle(self, *args, **options):
+        updated = backfill_moment_img_size(options['chunk'], options['fetch'])
+        print 'backfill img_size of {0} moments'.format(updated)
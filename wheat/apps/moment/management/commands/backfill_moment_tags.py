@@ -0,0 +1,56 @@
+# -*- coding:utf-8 -*-
+
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.moment.models import Moment, MomentTag
+from apps.moment.services import build_moment_tags
+
+
+@transaction.atomic
+def _backfill_chunk(moments):
+    MomentTag.objects.filter(moment_id__in=[m.id for m in moments]).delete()
+    tags = []
+    for moment in moments:
+        tags += build_moment_tags(moment)
+    MomentTag.objects.bulk_create(tags)
+    return len(tags)
+
+
+def backfill_moment_tags(chunk_size):
+    moments = Moment.objects.find(deleted=False).only('id', 'user_id', 'tag', 'post_date').order_by('post_date')
+
+    chunk, moment_num, tag_num = [], 0, 0
+    for moment in moments.iterator():
+        chunk.append(moment)
+        if len(chunk) >= chunk_size:
+            tag_num += _backfill_chunk(chunk)
+            moment_num += len(chunk)
+            chunk = []
+
+    if chunk:
+        tag_num += _backfill_chunk(chunk)
+        moment_num += len(chunk)
+
+    return moment_num, tag_num
+
+
+class Command(BaseCommand):
+    help = u'Builds moment_tag table by the tags of existing moments'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--usage',
+                    action='help',
+                    help='python manage.py backfill_moment_tags --chunk=500'),
+        make_option('--chunk',
+                    action='store',
+                    type='int',
+                    dest='chunk',
+                    default=500,
+                    help='moments handled in one transaction'),
+    )
+
+    def handle(self, *args, **options):
+        moment_num, tag_num = backfill_moment_tags(options['chunk'])
+        print 'backfill {0} tags of {1} moments'.format(tag_num, moment_num)
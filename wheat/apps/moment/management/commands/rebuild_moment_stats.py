@@ -0,0 +1,52 @@
+# -*- coding:utf-8 -*-
+
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.moment.models import Moment, MomentStat
+from apps.moment.services import build_moment_stats
+
+
+@transaction.atomic
+def _rebuild_chunk(moment_ids):
+    stats = build_moment_stats(moment_ids)
+    MomentStat.objects.find(moment_id__in=[s.moment_id for s in stats]).delete()
+    MomentStat.objects.bulk_create(stats)
+    return len(stats)
+
+
+def rebuild_moment_stats(chunk_size):
+    moment_ids = Moment.objects.find(deleted=False).order_by('post_date').values_list('id', flat=True)
+
+    chunk, stat_num = [], 0
+    for moment_id in moment_ids.iterator():
+        chunk.append(moment_id)
+        if len(chunk) >= chunk_size:
+            stat_num += _rebuild_chunk(chunk)
+            chunk = []
+
+    if chunk:
+        stat_num += _rebuild_chunk(chunk)
+
+    return stat_num
+
+
+class Command(BaseCommand):
+    help = u'Rebuilds moment_stat table by counting marks and comments'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--usage',
+                    action='help',
+                    help='python manage.py rebuild_moment_stats --chunk=500'),
+        make_option('--chunk',
+                    action='store',
+                    type='int',
+                    dest='chunk',
+                    default=500,
+                    help='moments handled in one transaction'),
+    )
+
+    def handle(self, *args, **options):
+        stat_num = rebuild_moment_stats(options['chunk'])
+        print 'rebuild stats of {0} moments'.format(stat_num)
@@ -54,6 +54,9 @@ class Moment(CommonUpdateAble, models.Model, EnhancedModel):
 
     class Meta:
         db_table = "moment"
+        index_together = [
+            ('user_id', 'deleted', 'post_date'),  # for feeds paged by post_date
+        ]
 
     @classmethod
     def valid_content_type(cls, content_type, content):
@@ -75,6 +78,23 @@ class Moment(CommonUpdateAble, models.Model, EnhancedModel):
         return visible in AVALIABLE_SCOPES or len(visible) == 32
 
 
+class MomentTag(models.Model, EnhancedModel):
+    '''
+    One row for every tag of a moment, so moments could be filtered by tags in database.
+    Kept the same as Moment.tag by MomentService.
+    '''
+    moment_id = UUIDField(db_index=True)
+    user_id = UUIDField()
+    tag = models.CharField(max_length=100)
+    post_date = models.DateTimeField()
+
+    class Meta:
+        db_table = "moment_tag"
+        index_together = [
+            ('user_id', 'tag', 'post_date'),
+        ]
+
+
 class Comment(CommonUpdateAble, models.Model, EnhancedModel):
     id = UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     moment_id = UUIDField(default=None)
@@ -1,22 +1,32 @@
 # -*- coding:utf-8 -*-
 
 from datetime import datetime
-from django.db import transaction
-from django.db.models import Q
+from django.db import transaction, IntegrityError
+from django.db.models import Q, F, Count
 
 from customs.services import OldBaseService
-from apps.user.services import FriendshipService
+from customs.funcs import hex_id
+from apps.user.friend_cache import FriendSnapshot
 from .models import Moment
 from .models import WechatMoment
 from .serializers import MomentSerializer
-from django.db.models import Min
+from apps.image.services import ImageService
+from customs.utility import UNVALID_SIZE, get_image_from_maili
+from customs.transaction_hooks import on_commit
 from apps.book.services import AuthorService
 from itertools import chain
 from .models import Comment
 from .models import Mark
+from .models import MomentTag
+from .models import MomentStat
 import abc
-import functools
+import base64
+import logging
 from information import redis_tools
+from . import timeline
+from apps.user import counters
+
+logger = logging.getLogger('moment')
 
 
 class MomentService(OldBaseService):
@@ -53,6 +63,20 @@ class MomentService(OldBaseService):
                 content.setdefault(f, [])
         return content
 
+    @staticmethod
+    def _set_img_size(content):
+        '''
+        Records the sizes of pictures uploaded to us in content, so feeds needn't look them up.
+        The other pictures (from wechat or links) are left to record_img_sizes.
+        '''
+        IMG_SIZE = 'img_size'
+        pictures = _get_pictures(content)
+        if pictures:
+            sizes = ImageService.get_image_sizes(pictures)
+            if sizes:
+                content[IMG_SIZE] = sizes
+        return content
+
     @classmethod
     @transaction.atomic
     def create_moment(cls, **kwargs):
@@ -67,6 +91,7 @@ class MomentService(OldBaseService):
                 and Moment.valid_visible_field(visible):
 
             content = MomentService._fix_content(content)
+            content = MomentService._set_img_size(content)
             moment = Moment.objects.create(
                 user_id=user_id,
                 content_type=content_type,
@@ -74,32 +99,25 @@ class MomentService(OldBaseService):
                 moment_date=moment_date,
                 visible=visible,
                 tags=tags)
-
-            _notify_moment_to_firends(visible, user_id, moment.id)
+            _save_moment_tags(moment)
+
+            receivers = _get_moment_receivers(visible, user_id)
+            timeline.push_moment(receivers, moment)
+            _notify_moment_to_firends(receivers, user_id, moment.id)
+            if _get_lacking_pictures(content):
+                from . import jobs
+                moment_id = hex_id(moment.id)
+                on_commit(lambda: jobs.enqueue_img_sizes([moment_id]))
             return moment
 
         return None
 
-    @classmethod
-    def import_wechat(cls, data):
-
-        data = data['data']
-        user_id = data.pop('cuid', None)
-
-        xinshu_import_ids = []
-        for item in data['items']:
-            origin_id = item.pop('origin_id', None)
-            if not WechatMoment.objects.filter(origin_id=origin_id).exists():
-                wechat = WechatMoment.objects.create(item=item, user_id=user_id, origin_id=origin_id)
-                wechat.save()
-                xinshu_import_ids.append(wechat.id)
-
-        return xinshu_import_ids
-
-    @classmethod
-    def decode_wechat(cls, import_id):
-
-        data_item = WechatMoment.objects.get(id=import_id).item
+    @staticmethod
+    def _decode_wechat_item(user_id, data_item):
+        '''
+        Gives the create_moment arguments of a wechat item.
+        '''
+        data_item = dict(data_item)
 
         wechat_maili_type_map = {
             'text': 'text',
@@ -138,8 +156,6 @@ class MomentService(OldBaseService):
         maili_tags = ['__wechat']
         moment_date = data_item['post_date']
 
-        user_id = WechatMoment.objects.get(id=import_id).user_id
-
         create_data = {
             'user_id': user_id,
             'content_type': maili_type,
@@ -149,12 +165,66 @@ class MomentService(OldBaseService):
             'tags': maili_tags,
         }
 
-        MomentService.create_moment(**create_data)
+        return create_data
+
+    @classmethod
+    def import_wechat_bulk(cls, data, chunk_size=500, progress=None):
+        '''
+        Imports wechat moments in chunks, every chunk is one origin_id__in query
+        and bulk inserts of WechatMoment, Moment and MomentTag.
+        A failed chunk is rolled back and counted, the others go on.
+        progress(total, processed, failed) is called after every chunk.
+        Home members get one notification for the whole import.
+        Returns the created moments.
+        '''
+        data = data['data']
+        user_id = data.get('cuid')
+        items = _dedupe_wechat_items(data['items'])
+
+        moments = []
+        processed, failed = 0, 0
+        for begin in range(0, len(items), chunk_size):
+            chunk = items[begin:begin + chunk_size]
+            try:
+                moments += cls._import_wechat_chunk(user_id, chunk)
+                processed += len(chunk)
+            except Exception:
+                logger.exception('fail to import {0} wechat moments of {1}'.format(len(chunk), user_id))
+                failed += len(chunk)
+            if progress:
+                progress(len(items), processed, failed)
+
+        if moments:
+            receivers = _get_moment_receivers('friends', user_id)
+            timeline.invalidate(*receivers)  # rebuilt on next read
+            _notify_wechat_import_to_friends(receivers, user_id, moments)
+
+        return moments
 
     @classmethod
-    def create_wechat_moments(cls, ids):
-        for mid in ids:
-            MomentService.decode_wechat(mid)
+    @transaction.atomic
+    def _import_wechat_chunk(cls, user_id, items):
+        ORIGIN_ID = 'origin_id'
+        origin_ids = [item[ORIGIN_ID] for item in items]
+        existed = set(WechatMoment.objects.filter(origin_id__in=origin_ids).values_list(ORIGIN_ID, flat=True))
+
+        wechats, moments = [], []
+        for item in items:
+            if item[ORIGIN_ID] in existed:
+                continue
+            item = dict(item)
+            origin_id = item.pop(ORIGIN_ID)
+            wechats.append(WechatMoment(item=item, user_id=user_id, origin_id=origin_id))
+
+            create_data = cls._decode_wechat_item(user_id, item)
+            create_data['content'] = cls._set_img_size(cls._fix_content(create_data['content']))
+            moments.append(Moment(**create_data))
+
+        WechatMoment.objects.bulk_create(wechats)
+        Moment.objects.bulk_create(moments)  # cached moment queries are invalidated, after commit too
+        MomentTag.objects.bulk_create(list(chain.from_iterable(build_moment_tags(m) for m in moments)))
+
+        return moments
         
     @classmethod
     @transaction.atomic
@@ -162,6 +232,8 @@ class MomentService(OldBaseService):
         if not moment.deleted:
             moment.deleted = True
             moment.save()
+            _delete_moment_tags(moment)
+            timeline.remove_moment(_get_moment_receivers(moment.visible, moment.user_id), moment)
         return True
 
     @classmethod
@@ -195,67 +267,263 @@ class MomentService(OldBaseService):
             return None, None
 
 
-def _notify_moment_to_firends(visible, user_id, moment_id):
+def _get_moment_receivers(visible, user_id):
+    '''
+    Gets the home members who could see a moment in their feeds.
+    '''
     from apps.group.services import GroupService
 
     PUBLIC, FRIENDS = 'public', 'friends'
     if visible == PUBLIC or visible == FRIENDS:
-        friend_list = GroupService().get_user_home_member(user_id)
+        return GroupService().get_user_home_member(user_id)
     #else:
     #    friend_list = get_friend_from_group_id(visible, user_id)
-        print 'friend list:', friend_list
+    return []
 
-        _send_msg = functools.partial(redis_tools.publish_moment_message, moment_id, user_id)
-        map(_send_msg, friend_list)
 
+def _notify_moment_to_firends(friend_list, user_id, moment_id):
+    redis_tools.publish_moment_messages(
+        hex_id(moment_id), hex_id(user_id), friend_list, after_commit=True)
+    _count_unread_feeds(friend_list, user_id, 1)
 
-def get_moment_from_author_list(receiver, group_id):
-    author_list = AuthorService.get_author_list_by_author_group(group_id)
 
-    moments_list = []
-    for author in author_list:
-        temp_moment = get_moment_by_receiver_and_sender_id(receiver, author)
-        moments_list.append(temp_moment)
+def _notify_wechat_import_to_friends(friend_list, user_id, moments):
+    newest = max(moments, key=lambda m: m.post_date)
+    redis_tools.publish_moment_import_messages(
+        hex_id(newest.id), hex_id(user_id), len(moments), friend_list, after_commit=True)
+    _count_unread_feeds(friend_list, user_id, len(moments))
 
-    moments = reduce(lambda m1, m2: m1 | m2, moments_list)
 
+def _count_unread_feeds(friend_list, user_id, number):
+    user_id = hex_id(user_id)
+    counters.incr([f for f in friend_list if hex_id(f) != user_id], unread_feeds=number)
+
+
+def _dedupe_wechat_items(items):
+    '''
+    Drops the items without origin_id or repeated in one import.
+    '''
+    ORIGIN_ID = 'origin_id'
+    origin_ids = set()
+    deduped = []
+    for item in items:
+        origin_id = item.get(ORIGIN_ID)
+        if origin_id and origin_id not in origin_ids:
+            origin_ids.add(origin_id)
+            deduped.append(item)
+    return deduped
+
+
+def get_moment_from_timeline(receiver_id, compare, cursor, number):
+    '''
+    Gets receiver's feed by his timeline, newer to older.
+    cursor and compare have the same meaning as in get_moment_page.
+    The timeline only keeps the newest moments, the pages past it are
+    finished from the database.
+    '''
+    AFTER = 'after'
+    after = compare == AFTER
+    number = int(number)
+
+    ids = timeline.get_moment_ids(receiver_id, number, cursor, after)
+    if ids is None:
+        timeline.rebuild(receiver_id, MomentService.get_user_moments(receiver_id))
+        ids = timeline.get_moment_ids(receiver_id, number, cursor, after) or []
+
+    if after:
+        if cursor and timeline.is_older_than_tail(receiver_id, cursor):
+            # the moments right after cursor may be trimmed from the timeline
+            return get_moment_page(MomentService.get_user_moments(receiver_id), compare, cursor, number)
+        return get_moments_by_ids(ids)
+
+    moments = get_moments_by_ids(ids)
+    if len(ids) < number:
+        # the end of timeline, older moments may be trimmed from it
+        last = (moments[-1].post_date, hex_id(moments[-1].id)) if moments else cursor
+        moments += get_moment_page(
+            MomentService.get_user_moments(receiver_id), None, last, number - len(moments))
     return moments
 
 
-def get_moment_compare_with_begin_id(moment, compare, begin_id):
+def _get_pictures(content):
+    PICS = 'pics'
+    pictures = content.get(PICS)
+    if not isinstance(pictures, list):
+        return []
+    return [p for p in pictures if isinstance(p, basestring)]
+
+
+def _get_lacking_pictures(content):
+    ''' The pictures whose size is not recorded in content '''
+    IMG_SIZE = 'img_size'
+    img_size = content.get(IMG_SIZE) or {}
+    return [p for p in _get_pictures(content) if p not in img_size]
+
+
+def fill_moment_img_size(moments):
     '''
-    if compare is None, give the neariest moments
-    if begin_id is None, give the neariest moments
+    Sets the sizes in content['img_size'] not recorded yet but known by image table,
+    pictures of all the moments are looked up in one query. Only the contents
+    of the moments are changed, record_img_sizes saves them.
     '''
-    PREVIOUS, AFTER = 'previous', 'after'
-    POST_DATE = 'post_date'
-    GREATER_THAN, LESS_THAN, MIN = '__gt', '__lt', '__min'
-    # will be used in django query
+    IMG_SIZE = 'img_size'
 
-    query = GREATER_THAN if compare == AFTER else LESS_THAN
-    # if needs AFTER explicitly, need greather than, default is less than
-    query_str = POST_DATE+query
+    lacking = [m for m in moments if _get_lacking_pictures(m.content)]
+    pictures = set(chain.from_iterable(_get_lacking_pictures(m.content) for m in lacking))
+    sizes = ImageService.get_image_sizes(pictures)
 
-    get_eariest_time = lambda: Moment.objects.aggregate(Min(POST_DATE)).get(POST_DATE + MIN, datetime.now())
+    for m in lacking:
+        known = [p for p in _get_lacking_pictures(m.content) if p in sizes]
+        if known:
+            img_size = m.content.setdefault(IMG_SIZE, {})
+            img_size.update((p, sizes[p]) for p in known)
 
-    forget_give_less_than_begin = lambda query, moment: query == LESS_THAN and moment is None
+    return moments
 
-    temp_moment = MomentService.get_moment(id=begin_id)
 
-    if forget_give_less_than_begin(query, temp_moment):  # need less than query but not gave the begin id
-        moment_date = datetime.now()
-    else:
-        moment_date = temp_moment.post_date if temp_moment else get_eariest_time()
+def fetch_image_size(picture):
+    '''
+    Downloads a picture not in image table to get its size, UNVALID_SIZE if failed.
+    '''
+    return get_image_from_maili(picture)
+
+
+def record_img_sizes(moments, fetch=True):
+    '''
+    Records the picture sizes not in the contents of moments, and saves them.
+    Sizes are looked up in image table, the other pictures are downloaded if
+    fetch. A picture failed to download is left out, to be tried again.
+    Returns the number of moments saved.
+    '''
+    IMG_SIZE = 'img_size'
+    moments = [m for m in moments if _get_lacking_pictures(m.content)]
+    recorded = [dict(m.content.get(IMG_SIZE) or {}) for m in moments]
+    fill_moment_img_size(moments)
+
+    fetched = {}
+    updated = 0
+    for moment, img_size in zip(moments, recorded):
+        lacking = _get_lacking_pictures(moment.content)
+        if lacking and fetch:
+            for picture in lacking:
+                if picture not in fetched:
+                    fetched[picture] = fetch_image_size(picture)
+                if tuple(fetched[picture]) != UNVALID_SIZE:
+                    moment.content.setdefault(IMG_SIZE, {})[picture] = fetched[picture]
+
+        if moment.content.get(IMG_SIZE, {}) != img_size:
+            Moment.objects.find(id=moment.id).update(content=moment.content)
+            updated += 1
+    return updated
+
+
+def get_moments_by_ids(ids):
+    '''
+    Loads moments with one query, keeps the order of ids.
+    '''
+    if not ids:
+        return []
+    moments = Moment.objects.filter(id__in=ids, deleted=False)
+    moment_map = dict((hex_id(m.id), m) for m in moments)
+    return [moment_map[mid] for mid in ids if mid in moment_map]
+
+
+def get_moment_from_author_list(receiver, group_id):
+    '''
+    Gets the moments of all authors in an author group that receiver could see,
+    as one user_id__in query. Page it by get_moment_page.
+    '''
+    PUBLIC, FRIENDS = 'public', 'friends'
+
+    author_ids = set(map(hex_id, AuthorService.get_author_list_by_author_group(group_id)))
+    if not author_ids:
+        return Moment.objects.none()
+
+    receiver = hex_id(receiver)
+    condition = Q(user_id__in=list(author_ids - set([receiver])), visible__in=[PUBLIC, FRIENDS])
+    if receiver in author_ids:
+        condition |= Q(user_id=receiver)  # receiver could see all of his own moments
 
-    condition = {query_str: moment_date}         # get condition by compare key word
-    # if compare said it need after, mean needs get new message, otherwish, get history message
+    return Moment.objects.filter(condition, deleted=False)
 
-    sort_order = '-' + POST_DATE  # sort message by time order from newer to older
 
-   # if compare == AFTER:
-    #    sort_order = POST_DATE  # if get unread message, order from older to newer
+CURSOR_DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
 
-    return moment.filter(**condition).order_by(sort_order)  # ordered by post date reversed order
+
+def encode_cursor(moment):
+    '''
+    Gives an opaque cursor of moment's position (post_date, id) in feeds.
+    '''
+    position = '{0}|{1}'.format(moment.post_date.strftime(CURSOR_DATE_FORMAT), hex_id(moment.id))
+    return base64.urlsafe_b64encode(position)
+
+
+def decode_cursor(cursor):
+    '''
+    Returns:
+        (post_date, id) of the cursor
+    Raises:
+        ValueError: if cursor is not given by encode_cursor
+    '''
+    try:
+        position = base64.urlsafe_b64decode(str(cursor))
+        post_date, moment_id = position.split('|')
+        return datetime.strptime(post_date, CURSOR_DATE_FORMAT), moment_id
+    except (TypeError, ValueError):
+        raise ValueError('unvalid cursor: {0}'.format(cursor))
+
+
+def get_begin_cursor(begin_id):
+    '''
+    Turns an old begin-id to cursor, None if begin moment not exist.
+    '''
+    begin_moment = MomentService.get_moment(id=begin_id) if begin_id else None
+    if begin_moment:
+        return begin_moment.post_date, hex_id(begin_moment.id)
+    return None
+
+
+def filter_moment_by_cursor(moments, compare, cursor, id_field='id'):
+    '''
+    Gets moments before (previous) or after cursor, ordered by (post_date, id) from newer to older.
+    If cursor is None, gives all the moments.
+    id_field is the moment id of the rows, moment_id for MomentTag.
+    '''
+    AFTER = 'after'
+
+    if cursor:
+        post_date, moment_id = cursor
+        if compare == AFTER:
+            moments = moments.filter(post_date__gte=post_date) \
+                .filter(Q(post_date__gt=post_date) | Q(**{id_field + '__gt': moment_id}))
+        else:
+            moments = moments.filter(post_date__lte=post_date) \
+                .filter(Q(post_date__lt=post_date) | Q(**{id_field + '__lt': moment_id}))
+        # a range on post_date, served by the (user_id, deleted, post_date) index
+
+    return moments.order_by('-post_date', '-' + id_field)
+
+
+def get_moment_page(moments, compare, cursor, number):
+    '''
+    Gets `number` moments next to the cursor, from newer to older.
+    The newest ones if no cursor, whatever compare is, as the timeline gives.
+    '''
+    AFTER = 'after'
+    moments = filter_moment_by_cursor(moments, compare, cursor)
+    if compare == AFTER and cursor:
+        # the moments right after cursor, not the newest ones.
+        return list(moments.reverse()[:int(number)])[::-1]
+    return list(moments[:int(number)])
+
+
+def get_moment_compare_with_begin_id(moment, compare, begin_id):
+    '''
+    Compatible with the requests of begin-id.
+    if compare is None, give the neariest moments
+    if begin_id is None, give the neariest moments
+    '''
+    return filter_moment_by_cursor(moment, compare, get_begin_cursor(begin_id))
 
 
 def confine_moment_number(moment, number):
@@ -278,36 +546,91 @@ def get_moment_by_receiver_and_sender_id(receiver_id, sender_id):
     return moments
 
 
-def have_same_elements(list_1):
-    def contains(list_2):
-        if list_2:
-            return len(filter(lambda e: e in list_1, list_2)) > 0
-        else:
-            return False
-    return contains
+def get_moment_authors(receiver_id, sender_id=None, group=None):
+    '''
+    Gets the users whose moments are in the feed of get_moment_by_receiver_and_sender_id,
+    or of get_moment_from_author_list if group is given.
+    '''
+    from apps.group.services import GroupService
 
+    if group:
+        return AuthorService.get_author_list_by_author_group(sender_id)
+    elif sender_id is None:
+        return GroupService().get_user_home_member(receiver_id)
+    return [sender_id]
 
-def get_moment_by_tags(moments, _TAGS):
-    if len(_TAGS) > 0:
-        contain_user_ask_tags = have_same_elements(_TAGS)
-        return filter(lambda m: contain_user_ask_tags(m.tags), moments)
-    else:
-        return moments
 
+def get_moment_page_by_tags(moments, author_ids, tags, compare, cursor, number):
+    '''
+    Gets `number` moments having any of the tags next to the cursor, from newer to older.
+
+    Pages are read from MomentTag of the authors, by its (user_id, tag, post_date)
+    index, then the moments are loaded from `moments`, which keeps the other
+    conditions of the feed (visibility, deleted). Rows of the moments not in it
+    are skipped, and more rows are read until the page is full.
+    The newest ones if no cursor, as get_moment_page.
+    '''
+    AFTER = 'after'
+    if not cursor:
+        compare = None
+    number = int(number)
+    author_ids = [hex_id(a) for a in author_ids]
+    if not tags or not author_ids or number <= 0:
+        return []
+
+    tagged = MomentTag.objects.filter(user_id__in=author_ids, tag__in=tags)
+    chunk_size = number * 2
+    page, seen = [], set()
+    while len(page) < number:
+        rows = filter_moment_by_cursor(tagged, compare, cursor, 'moment_id').values_list('moment_id', 'post_date')
+        if compare == AFTER:
+            rows = rows.reverse()  # the rows right after cursor, older to newer
+        rows = list(rows[:chunk_size])
+        if not rows:
+            break
+
+        ids = []
+        for moment_id, post_date in rows:
+            moment_id = hex_id(moment_id)
+            if moment_id not in seen:  # a row for every tag of a moment
+                seen.add(moment_id)
+                ids.append(moment_id)
+        found = dict((hex_id(m.id), m) for m in moments.filter(id__in=ids))
+        page += [found[mid] for mid in ids if mid in found]
+
+        if len(rows) < chunk_size:
+            break
+        cursor = (rows[-1][1], hex_id(rows[-1][0]))
+
+    page = page[:number]
+    if compare == AFTER:
+        page.reverse()
+    return page
+
+
+def build_moment_tags(moment):
+    '''
+    Gets the MomentTag rows of a moment, not saved.
+    '''
+    tags = moment.tags if isinstance(moment.tags, list) else []
+    tags = set(t for t in tags if isinstance(t, basestring) and t)
+    return [
+        MomentTag(moment_id=moment.id, user_id=moment.user_id, tag=t, post_date=moment.post_date)
+        for t in tags
+    ]
 
-def get_user_all_personal_tags(user_id):
-    from collections import Counter
 
-    tags = []
-    moments = Moment.objects.filter(user_id=user_id)
+def _save_moment_tags(moment):
+    MomentTag.objects.bulk_create(build_moment_tags(moment))
 
-    for m in moments:
-        if m.tags and len(m.tags) > 0:
-            tags += m.tags
 
-    tags = Counter(tags).keys()
+def _delete_moment_tags(moment):
+    MomentTag.objects.filter(moment_id=moment.id).delete()
 
-    return tags
+
+def get_user_all_personal_tags(user_id):
+    tags = MomentTag.objects.filter(user_id=user_id).values_list('tag', flat=True).distinct()
+    return list(tags)
 
 
 def get_user_recommend_tags(user_id):
@@ -335,6 +658,68 @@ def is_visible(moment_owver, message_sender, message_receiver):
     return True
 
 
+MARK_STAT_FIELDS = {'like': 'like_count'}
+
+
+def build_moment_stats(moment_ids):
+    '''
+    Counts marks and comments of moments from their own tables,
+    returns unsaved MomentStat of every moment.
+    '''
+    stats = dict((hex_id(mid), MomentStat(moment_id=hex_id(mid))) for mid in moment_ids)
+    if not stats:
+        return []
+
+    marks = Mark.objects.filter(moment_id__in=stats.keys(), deleted=False) \
+        .values('moment_id', 'mark_type').annotate(number=Count('id'))
+    for mark in marks:
+        field = MARK_STAT_FIELDS.get(mark['mark_type'])
+        if field:
+            setattr(stats[hex_id(mark['moment_id'])], field, mark['number'])
+
+    comments = Comment.objects.filter(moment_id__in=stats.keys(), deleted=False) \
+        .values('moment_id').annotate(number=Count('id'))
+    for comment in comments:
+        stats[hex_id(comment['moment_id'])].comment_count = comment['number']
+
+    return stats.values()
+
+
+def update_moment_stat(moment_id, **deltas):
+    '''
+    Adds deltas to the counters of a moment stat, such as like_count=1.
+    A moment without stat gets one counted from its marks and comments.
+    '''
+    updates = dict((field, F(field) + delta) for field, delta in deltas.items())
+    if MomentStat.objects.find(moment_id=moment_id).update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            MomentStat.objects.bulk_create(build_moment_stats([moment_id]))
+    except IntegrityError:  # created by others just now
+        MomentStat.objects.find(moment_id=moment_id).update(**updates)
+
+
+def get_moment_stats(moment_ids):
+    '''
+    Gets {moment_id: MomentStat} with one query, moment_ids are hex strings.
+    '''
+    moment_ids = map(hex_id, moment_ids)
+    stats = dict((mid, MomentStat(moment_id=mid)) for mid in moment_ids)
+    if moment_ids:
+        for stat in MomentStat.objects.filter(moment_id__in=moment_ids):
+            stats[hex_id(stat.moment_id)] = stat
+    return stats
+
+
+def serialize_moment_stat(stat):
+    return {
+        'like_count': stat.like_count,
+        'comment_count': stat.comment_count,
+        'share_count': stat.share_count,
+    }
+
+
 '''
 Commemt Service Functions
 Author: Minchiuan Gao 2016-4-26
@@ -346,11 +731,16 @@ class BaseCommentService(object):
     factory_model = None
 
     @classmethod
+    @transaction.atomic
     def add(cls, moment_id, sender_id, body):
         if cls.is_visible(moment_id, sender_id):
             target = cls.set_moment_and_sender(moment_id, sender_id)
-            target = cls.set_target_content(target, body)
-            return target
+            result = cls.set_target_content(target, body)
+            field = cls.get_stat_field(target)
+            if field and not target._state.adding:  # saved, not an existed mark
+                update_moment_stat(moment_id, **{field: 1})
+            cls.count_unread(target, moment_id, sender_id)
+            return result
         else:
             raise ReferenceError
 
@@ -369,6 +759,7 @@ class BaseCommentService(object):
         return
 
     @classmethod
+    @transaction.atomic
     def cancle(cls, mid, user_id, body=None):
         '''
         Cancle a moment or mark.
@@ -383,9 +774,26 @@ class BaseCommentService(object):
         if target:
             target.deleted = True
             target.save()
+            field = cls.get_stat_field(target)
+            if field:
+                update_moment_stat(mid, **{field: -1})
         else:
             raise ReferenceError
 
+    @classmethod
+    def get_stat_field(cls, target):
+        '''
+        The counter of MomentStat changed by target.
+        '''
+        return
+
+    @classmethod
+    def count_unread(cls, target, moment_id, sender_id):
+        '''
+        Adds to the UserCounter of the users notified by target.
+        '''
+        return
+
     @classmethod
     def is_visible(cls, user_id, moment_id):
         '''
@@ -416,7 +824,31 @@ class BaseCommentService(object):
             moment_id, user_id, test_friends
         )
 
-        return cls.produce_content(targets)
+        info = cls.produce_content(targets)
+        stat = get_moment_stats([moment_id])[hex_id(moment_id)]
+        return cls.set_total(info, stat)
+
+    @classmethod
+    def get_contents(cls, moment_ids, user_id):
+        '''
+        Gets one person's activity info of many moments with one query.
+        Returns {moment_id: info}, moment_ids are hex strings.
+        '''
+        if not moment_ids:
+            return {}
+
+        test_friends = cls.friends_visible_func(user_id)
+        targets = cls.factory_model.objects \
+            .filter(moment_id__in=moment_ids) \
+            .filter(deleted=False).order_by('created_at')
+
+        grouped = dict((mid, []) for mid in moment_ids)
+        for target in filter(test_friends, targets):
+            grouped.setdefault(hex_id(target.moment_id), []).append(target)
+
+        stats = get_moment_stats(grouped.keys())
+        return dict((mid, cls.set_total(cls.produce_content(targets), stats[mid]))
+                    for mid, targets in grouped.items())
 
     @classmethod
     def friends_visible_func(cls, *args):
@@ -432,6 +864,13 @@ class BaseCommentService(object):
         '''
         return
 
+    @classmethod
+    def set_total(cls, info, stat):
+        '''
+        Sets the total numbers of info by moment stat.
+        '''
+        return info
+
 '''
 Mark Service
 Author: Minchiuan Gao 2016-4-26
@@ -456,9 +895,14 @@ class MarkService(BaseCommentService):
         except Exception as e:
             raise e
 
+    @classmethod
+    def get_stat_field(cls, target):
+        return MARK_STAT_FIELDS.get(target.mark_type)
+
     @classmethod
     def friends_visible_func(cls, user_id):  # m is a moment
-        return lambda m: FriendshipService().all_is_friend([user_id, m.sender_id])
+        friends = FriendSnapshot()
+        return lambda m: friends.all_is_friend([user_id, m.sender_id])
 
     @classmethod
     def produce_content(cls, target_models):
@@ -478,6 +922,13 @@ class MarkService(BaseCommentService):
 
         return info
 
+    @classmethod
+    def set_total(cls, info, stat):
+        TOTAL = 'total'
+        for emotion, _ in Mark.TYPES:
+            info[emotion][TOTAL] = getattr(stat, MARK_STAT_FIELDS[emotion])
+        return info
+
 '''
 Comment Service
 Author: Minchiuan Gao 2016-4-5
@@ -501,9 +952,21 @@ class CommentService(BaseCommentService):
         model_target.save()
         return model_target.id
 
+    @classmethod
+    def get_stat_field(cls, target):
+        return 'comment_count'
+
+    @classmethod
+    def count_unread(cls, target, moment_id, sender_id):
+        moment = Moment.objects.find(id=moment_id).only('user_id').first()
+        notified = set([target.specific_person, moment and moment.user_id])
+        sender_id = hex_id(sender_id)
+        counters.incr([u for u in notified if u and hex_id(u) != sender_id], unread_comments=1)
+
     @classmethod
     def friends_visible_func(cls, user_id):
-        return lambda m: FriendshipService().all_is_friend([
+        friends = FriendSnapshot()
+        return lambda m: friends.all_is_friend([
             user_id,
             m.sender_id,
             m.specific_person
@@ -525,3 +988,9 @@ class CommentService(BaseCommentService):
             })
 
         return info
+
+    @classmethod
+    def set_total(cls, info, stat):
+        TOTAL = 'total'
+        info[TOTAL] = stat.comment_count
+        return info
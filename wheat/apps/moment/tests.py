@@ -1,5 +1,497 @@
+# -*- coding:utf-8 -*-
 '''
 Test cases for moment app.
 Author: Minchiuan 2016-2-24
 '''
 
+from django.test import TestCase
+from django.test.utils import override_settings
+from datetime import datetime, timedelta
+
+from apps.user.services import UserService
+from apps.group.services import GroupService
+from apps.moment.services import MomentService, MarkService, CommentService
+from apps.moment import services
+from apps.moment import timeline
+from apps.moment import jobs
+from apps.moment.models import Moment, MomentTag, MomentStat, WechatMoment
+from apps.image.models import Image
+from apps.book.models import Author
+from customs.utility import UNVALID_SIZE
+from customs.funcs import hex_id
+from apps.moment.management.commands.backfill_moment_tags import backfill_moment_tags
+from apps.moment.management.commands.rebuild_moment_stats import rebuild_moment_stats
+
+
+class MemoryTimelineTest(TestCase):
+    def setUp(self):
+        self.backend = timeline.MemoryTimelineBackend(size=3)
+
+    def test_push_without_timeline(self):
+        self.backend.push(['u1'], 'm1', 1.0)
+        self.assertFalse(self.backend.exists('u1'))
+
+    def test_push_is_bounded(self):
+        self.backend.fill('u1', [])
+        for i in range(5):
+            self.backend.push(['u1'], 'm%d' % i, float(i))
+
+        self.assertEqual([mid for mid, _ in self.backend.range_before('u1', None, 10)], ['m4', 'm3', 'm2'])
+
+    def test_range(self):
+        self.backend.fill('u1', [('m1', 1.0), ('m2', 2.0), ('m3', 3.0)])
+
+        self.assertEqual(self.backend.range_before('u1', None, 1), [('m3', 3.0)])
+        self.assertEqual(self.backend.range_before('u1', 2.0, 10), [('m2', 2.0), ('m1', 1.0)])
+        self.assertEqual(self.backend.range_after('u1', 2.0, 10), [('m2', 2.0), ('m3', 3.0)])
+        self.assertEqual(self.backend.count('u1', 2.0), 1)
+
+    def test_remove_and_drop(self):
+        self.backend.fill('u1', [('m1', 1.0), ('m2', 2.0)])
+        self.backend.remove(['u1'], 'm1')
+        self.assertEqual(self.backend.range_before('u1', None, 10), [('m2', 2.0)])
+
+        self.backend.drop(['u1'])
+        self.assertFalse(self.backend.exists('u1'))
+
+
+class MomentTimelineTest(TestCase):
+    def setUp(self):
+        timeline.get_backend().clear()
+        PRE = '1881234100'
+        self.users = [UserService().create(phone=PRE + str(i), password='123456') for i in range(3)]
+        self.home = GroupService().get_home(self.users[0].id)
+        GroupService().add_group_member(self.home, self.users[1].id)
+        # in each other's home, as InvitationService.accept does
+        GroupService().add_group_member(GroupService().get_home(self.users[1].id), self.users[0].id)
+
+    def _create_moment(self, user, text, visible='friends'):
+        return MomentService.create_moment(
+            user_id=user.id,
+            content_type='text',
+            content={'text': text},
+            visible=visible)
+
+    def _feed_ids(self, user, number=10, compare=None, begin_id=None):
+        cursor = services.get_begin_cursor(begin_id)
+        moments = services.get_moment_from_timeline(user.id, compare, cursor, number)
+        return [hex_id(m.id) for m in moments]
+
+    def test_feed_is_newest_first(self):
+        m1 = self._create_moment(self.users[0], 'first')
+        m2 = self._create_moment(self.users[1], 'second')
+        self._create_moment(self.users[1], 'private', visible='private')
+
+        self.assertEqual(self._feed_ids(self.users[0]), [hex_id(m2.id), hex_id(m1.id)])
+        self.assertEqual(self._feed_ids(self.users[0], number=1), [hex_id(m2.id)])
+
+    def test_new_moment_pushed_to_built_timeline(self):
+        m1 = self._create_moment(self.users[0], 'first')
+        self.assertEqual(self._feed_ids(self.users[0]), [hex_id(m1.id)])
+
+        m2 = self._create_moment(self.users[1], 'second')
+        self.assertTrue(timeline.get_backend().exists(self.users[0].id))
+        self.assertEqual(self._feed_ids(self.users[0]), [hex_id(m2.id), hex_id(m1.id)])
+
+    def test_begin_id(self):
+        m1 = self._create_moment(self.users[0], 'first')
+        m2 = self._create_moment(self.users[0], 'second')
+        m2.update(post_date=m1.post_date + timedelta(seconds=1))
+        timeline.invalidate(self.users[0].id)
+
+        self.assertEqual(self._feed_ids(self.users[0], begin_id=m2.id), [hex_id(m1.id)])
+        self.assertEqual(self._feed_ids(self.users[0], compare='after', begin_id=m1.id), [hex_id(m2.id)])
+
+    def test_deleted_moment_removed(self):
+        m1 = self._create_moment(self.users[1], 'first')
+        self.assertEqual(self._feed_ids(self.users[0]), [hex_id(m1.id)])
+
+        MomentService.delete_moment(m1)
+        self.assertEqual(self._feed_ids(self.users[0]), [])
+
+    def test_pages_past_timeline(self):
+        backend = timeline.get_backend()
+        size, backend.size = backend.size, 3
+        try:
+            post_date = datetime(2016, 5, 10, 12, 0, 0)
+            moments = []
+            for i in range(5):
+                moment = self._create_moment(self.users[0], str(i))
+                moments.append(moment.update(post_date=post_date + timedelta(seconds=i)))
+            timeline.invalidate(self.users[0].id)
+            ids = [hex_id(m.id) for m in moments]
+            cursor = lambda i: (moments[i].post_date, ids[i])
+
+            def feed(compare, i, number):
+                found = services.get_moment_from_timeline(self.users[0].id, compare, cursor(i), number)
+                return [hex_id(m.id) for m in found]
+
+            self.assertEqual(self._feed_ids(self.users[0], number=2), [ids[4], ids[3]])
+            self.assertEqual(feed(None, 3, 2), [ids[2], ids[1]])  # the end of timeline and the database
+            self.assertEqual(feed(None, 1, 2), [ids[0]])  # all in the database
+            self.assertEqual(feed('after', 0, 2), [ids[2], ids[1]])
+            self.assertEqual(feed('after', 3, 2), [ids[4]])
+        finally:
+            backend.size = size
+
+    def test_new_member_timeline_rebuilt(self):
+        m1 = self._create_moment(self.users[2], 'first')
+        self.assertEqual(self._feed_ids(self.users[0]), [])
+
+        GroupService().add_group_member(self.home, self.users[2].id)
+        self.assertEqual(self._feed_ids(self.users[0]), [hex_id(m1.id)])
+
+
+class MomentCursorTest(TestCase):
+    def setUp(self):
+        timeline.get_backend().clear()
+        self.user = UserService().create(phone='18812341200', password='123456')
+        self.post_date = datetime(2016, 5, 10, 12, 0, 0)
+        self.moments = []
+        for i in range(4):
+            moment = MomentService.create_moment(
+                user_id=self.user.id,
+                content_type='text',
+                content={'text': str(i)},
+                visible='friends')
+            moment.update(post_date=self.post_date)  # all moments posted at the same time
+            self.moments.append(moment)
+
+        self.moments.sort(key=lambda m: hex_id(m.id), reverse=True)
+        self.ids = [hex_id(m.id) for m in self.moments]
+        timeline.invalidate(self.user.id)
+
+    def test_encode_cursor(self):
+        moment = MomentService.get_moment(id=self.ids[0])
+        post_date, moment_id = services.decode_cursor(services.encode_cursor(moment))
+
+        self.assertEqual(post_date, self.post_date)
+        self.assertEqual(moment_id, self.ids[0])
+
+    def test_unvalid_cursor(self):
+        self.assertRaises(ValueError, services.decode_cursor, 'not-a-cursor')
+
+    def _page(self, compare, cursor, number):
+        moments = MomentService.get_moments_from_user(self.user.id)
+        return [hex_id(m.id) for m in services.get_moment_page(moments, compare, cursor, number)]
+
+    def _timeline_page(self, compare, cursor, number):
+        moments = services.get_moment_from_timeline(self.user.id, compare, cursor, number)
+        return [hex_id(m.id) for m in moments]
+
+    def test_page_with_same_post_date(self):
+        for get_page in (self._page, self._timeline_page):
+            self.assertEqual(get_page(None, None, 2), self.ids[:2])
+
+            cursor = (self.post_date, self.ids[1])
+            self.assertEqual(get_page(None, cursor, 2), self.ids[2:])
+            self.assertEqual(get_page('after', cursor, 10), self.ids[:1])
+
+            cursor = (self.post_date, self.ids[3])
+            self.assertEqual(get_page('after', cursor, 2), self.ids[1:3])
+
+    def test_begin_id_compatible(self):
+        moments = MomentService.get_moments_from_user(self.user.id)
+        moments = services.get_moment_compare_with_begin_id(moments, 'previous', self.ids[0])
+        self.assertEqual([hex_id(m.id) for m in moments], self.ids[1:])
+
+
+class MomentTagTest(TestCase):
+    def setUp(self):
+        timeline.get_backend().clear()
+        self.user = UserService().create(phone='18812341300', password='123456')
+
+    def _create_moment(self, tags):
+        return MomentService.create_moment(
+            user_id=self.user.id,
+            content_type='text',
+            content={'text': 'tags'},
+            visible='friends',
+            tags=tags)
+
+    def _tagged_ids(self, tags, number=10, compare=None, cursor=None):
+        moments = MomentService.get_user_moments(self.user.id)
+        authors = services.get_moment_authors(self.user.id)
+        moments = services.get_moment_page_by_tags(moments, authors, tags, compare, cursor, number)
+        return [hex_id(m.id) for m in moments]
+
+    def test_tags_saved_and_deleted(self):
+        moment = self._create_moment([u'育儿', u'旅行'])
+        self.assertEqual(MomentTag.objects.filter(moment_id=moment.id).count(), 2)
+
+        MomentService.delete_moment(moment)
+        self.assertFalse(MomentTag.objects.filter(moment_id=moment.id).exists())
+
+    def test_filter_gives_full_page(self):
+        tagged = [self._create_moment([u'育儿']) for i in range(3)]
+        for i in range(5):
+            self._create_moment([u'旅行'])
+
+        ids = self._tagged_ids([u'育儿', u'美食'], number=3)
+        self.assertEqual(sorted(ids), sorted(hex_id(m.id) for m in tagged))
+
+    def _dated(self, moment, seconds):
+        post_date = datetime(2016, 5, 10, 12, 0, 0) + timedelta(seconds=seconds)
+        MomentTag.objects.filter(moment_id=moment.id).update(post_date=post_date)
+        return moment.update(post_date=post_date)
+
+    def test_pages_by_cursor(self):
+        tags = [u'育儿', u'旅行']
+        moments = [self._dated(self._create_moment(tags), -i) for i in range(5)]
+        ids = [hex_id(m.id) for m in moments]
+
+        self.assertEqual(self._tagged_ids(tags, number=2), ids[:2])
+        cursor = (moments[1].post_date, ids[1])
+        self.assertEqual(self._tagged_ids(tags, number=2, cursor=cursor), ids[2:4])
+        self.assertEqual(self._tagged_ids(tags, number=2, compare='after', cursor=cursor), ids[:1])
+        self.assertEqual(self._tagged_ids(tags, number=2, compare='after'), ids[:2])  # the newest
+        self.assertEqual([hex_id(m.id) for m in services.get_moment_page(
+            MomentService.get_user_moments(self.user.id), 'after', None, 2)], ids[:2])
+
+    def test_hidden_moments_skipped(self):
+        shown = self._dated(self._create_moment([u'育儿']), 0)
+        for i in range(2):
+            hidden = MomentService.create_moment(
+                user_id=self.user.id, content_type='text', content={'text': 'private'},
+                visible='private', tags=[u'育儿'])
+            self._dated(hidden, i + 1)
+
+        self.assertEqual(self._tagged_ids([u'育儿'], number=1), [hex_id(shown.id)])
+
+    def test_personal_tags(self):
+        self._create_moment([u'育儿', u'旅行'])
+        self._create_moment([u'育儿'])
+
+        self.assertEqual(sorted(services.get_user_all_personal_tags(self.user.id)), sorted([u'育儿', u'旅行']))
+
+    def test_backfill(self):
+        moment = self._create_moment([u'育儿'])
+        MomentTag.objects.all().delete()
+
+        moment_num, tag_num = backfill_moment_tags(chunk_size=1)
+        self.assertEqual((moment_num, tag_num), (1, 1))
+        self.assertEqual(self._tagged_ids([u'育儿']), [hex_id(moment.id)])
+
+
+class MomentImgSizeTest(TestCase):
+    def setUp(self):
+        timeline.get_backend().clear()
+        self.user = UserService().create(phone='18812341400', password='123456')
+        Image.objects.create(image='origin/a.jpg', width=640, height=480)
+        self.fetched = []
+        self.fetch_image_size = services.fetch_image_size
+        services.fetch_image_size = self._fetch
+
+    def tearDown(self):
+        services.fetch_image_size = self.fetch_image_size
+
+    def _fetch(self, picture):
+        self.fetched.append(picture)
+        return UNVALID_SIZE if 'broken' in picture else (320, 240)
+
+    def _create_moment(self, pics):
+        return MomentService.create_moment(
+            user_id=self.user.id,
+            content_type='pics',
+            content={'text': 'pics', 'pics': pics},
+            visible='friends')
+
+    def test_img_size_saved(self):
+        moment = self._create_moment(['origin/a.jpg'])
+        moment = MomentService.get_moment(id=moment.id)
+        self.assertEqual(tuple(moment.content['img_size']['origin/a.jpg']), (640, 480))
+        self.assertEqual(self.fetched, [])
+
+    def test_unknown_picture_recorded(self):
+        moment = self._create_moment(['origin/a.jpg', 'http://wechat/b.jpg'])
+        # enqueued on commit, which TestCase never does
+        self.assertEqual(jobs.record_img_sizes([moment.id]), 1)
+        moment = Moment.objects.find(id=moment.id).first()
+        self.assertEqual(tuple(moment.content['img_size']['http://wechat/b.jpg']), (320, 240))
+        self.assertEqual(tuple(moment.content['img_size']['origin/a.jpg']), (640, 480))
+
+    def test_failed_picture_tried_again(self):
+        moment = self._create_moment(['http://wechat/broken.jpg'])
+        jobs.record_img_sizes([moment.id])
+        moment = Moment.objects.find(id=moment.id).first()
+        self.assertNotIn('http://wechat/broken.jpg', moment.content.get('img_size', {}))
+
+        moment = services.fill_moment_img_size([moment])[0]
+        self.assertNotIn('http://wechat/broken.jpg', moment.content.get('img_size', {}))  # not unvalid
+
+        jobs.record_img_sizes([moment.id])
+        self.assertEqual(self.fetched, ['http://wechat/broken.jpg'] * 2)
+
+    def test_import_records_sizes(self):
+        item = {
+            'origin_id': 'w1', 'type': 'image', 'content': 'wechat', 'link_list': [''],
+            'pic_list': ['origin/a.jpg', 'http://wechat/c.jpg'], 'post_date': '2016-05-10 12:00:00',
+        }
+        jobs.import_wechat({'data': {'cuid': self.user.id.hex, 'items': [item]}}, chunk_size=10)
+
+        moment = MomentService.get_moments_from_user(self.user.id).first()
+        self.assertEqual(tuple(moment.content['img_size']['http://wechat/c.jpg']), (320, 240))
+        self.assertEqual(tuple(moment.content['img_size']['origin/a.jpg']), (640, 480))
+
+
+class MomentActivityTest(TestCase):
+    def setUp(self):
+        timeline.get_backend().clear()
+        self.user = UserService().create(phone='18812341500', password='123456')
+        self.moments = [
+            MomentService.create_moment(
+                user_id=self.user.id,
+                content_type='text',
+                content={'text': str(i)},
+                visible='friends')
+            for i in range(3)]
+        self.ids = [hex_id(m.id) for m in self.moments]
+        self.user_id = hex_id(self.user.id)  # as a logined user
+
+    def test_get_contents(self):
+        MarkService.add(self.ids[0], self.user_id, {'mark': 'like'})
+        CommentService.add(self.ids[0], self.user_id, {'msg': 'first', 'at': self.user_id})
+        CommentService.add(self.ids[1], self.user_id, {'msg': 'second', 'at': self.user_id})
+
+        marks = MarkService.get_contents(self.ids, self.user_id)
+        comments = CommentService.get_contents(self.ids, self.user_id)
+
+        self.assertEqual(sorted(marks.keys()), sorted(self.ids))
+        self.assertEqual(marks[self.ids[0]]['like']['total'], 1)
+        self.assertEqual(marks[self.ids[1]]['like']['total'], 0)
+        self.assertEqual([c['total'] for c in map(comments.get, self.ids)], [1, 1, 0])
+
+    def test_same_as_get_content(self):
+        CommentService.add(self.ids[2], self.user_id, {'msg': 'third', 'at': self.user_id})
+        self.assertEqual(
+            CommentService.get_contents(self.ids, self.user_id)[self.ids[2]],
+            CommentService.get_content(self.ids[2], self.user_id))
+
+    def test_stat_maintained(self):
+        MarkService.add(self.ids[0], self.user_id, {'mark': 'like'})
+        MarkService.add(self.ids[0], self.user_id, {'mark': 'like'})  # already marked
+        CommentService.add(self.ids[0], self.user_id, {'msg': 'first', 'at': self.user_id})
+        CommentService.add(self.ids[0], self.user_id, {'msg': 'second', 'at': self.user_id})
+        CommentService.cancle(self.ids[0], self.user_id)
+
+        stat = services.get_moment_stats([self.ids[0]])[self.ids[0]]
+        self.assertEqual((stat.like_count, stat.comment_count), (1, 1))
+
+        MarkService.cancle(self.ids[0], self.user_id)
+        stat = services.get_moment_stats([self.ids[0]])[self.ids[0]]
+        self.assertEqual(stat.like_count, 0)
+
+    @override_settings(CACHE_QUERY=True)
+    def test_created_stat_not_hidden_by_cache(self):
+        MarkService.add(self.ids[2], self.user_id, {'mark': 'like'})
+        MomentStat.objects.all().delete()
+        stat = services.get_moment_stats([self.ids[2]])[self.ids[2]]  # caches no stat
+        self.assertEqual(stat.like_count, 0)
+
+        rebuild_moment_stats(chunk_size=10)  # stats are bulk created
+        stat = services.get_moment_stats([self.ids[2]])[self.ids[2]]
+        self.assertEqual(stat.like_count, 1)
+
+    def test_rebuild_stats(self):
+        MarkService.add(self.ids[1], self.user_id, {'mark': 'like'})
+        CommentService.add(self.ids[1], self.user_id, {'msg': 'second', 'at': self.user_id})
+        MomentStat.objects.all().delete()
+
+        self.assertEqual(rebuild_moment_stats(chunk_size=2), 3)
+        stat = services.get_moment_stats([self.ids[1]])[self.ids[1]]
+        self.assertEqual((stat.like_count, stat.comment_count), (1, 1))
+
+
+class MomentAuthorGroupTest(TestCase):
+    def setUp(self):
+        timeline.get_backend().clear()
+        PRE = '1881234160'
+        self.users = [UserService().create(phone=PRE + str(i), password='123456') for i in range(3)]
+
+    def _create_moment(self, user, visible='friends'):
+        return MomentService.create_moment(
+            user_id=user.id,
+            content_type='text',
+            content={'text': visible},
+            visible=visible)
+
+    def _group_ids(self, members, number=10):
+        group = Author.objects.create(creator_id=self.users[0].id, members={'user': map(str, members)})
+        moments = services.get_moment_from_author_list(self.users[0].id.hex, group.id)
+        return [hex_id(m.id) for m in services.get_moment_page(moments, None, None, number)]
+
+    def test_visible_moments(self):
+        own_private = self._create_moment(self.users[0], 'private')
+        other_private = self._create_moment(self.users[1], 'private')
+        other_public = self._create_moment(self.users[1], 'public')
+        self._create_moment(self.users[2], 'public')
+
+        ids = self._group_ids([self.users[0].id, self.users[1].id])
+        self.assertEqual(sorted(ids), sorted(hex_id(m.id) for m in [own_private, other_public]))
+        self.assertNotIn(hex_id(other_private.id), ids)
+
+    def test_page_number(self):
+        for i in range(3):
+            self._create_moment(self.users[1])
+        self.assertEqual(len(self._group_ids([self.users[1].id], number=2)), 2)
+
+    def test_empty_group(self):
+        self.assertEqual(self._group_ids([]), [])
+
+
+class WechatImportTest(TestCase):
+    def setUp(self):
+        timeline.get_backend().clear()
+        self.user = UserService().create(phone='18812341700', password='123456')
+
+    def _item(self, origin_id):
+        return {
+            'origin_id': origin_id,
+            'type': 'text',
+            'content': 'wechat ' + origin_id,
+            'pic_list': [],
+            'link_list': [''],
+            'post_date': '2016-05-10 12:00:00',
+        }
+
+    def _data(self, origin_ids):
+        return {'data': {'cuid': self.user.id.hex, 'items': map(self._item, origin_ids)}}
+
+    def _import(self, origin_ids, chunk_size=2):
+        return MomentService.import_wechat_bulk(self._data(origin_ids), chunk_size=chunk_size)
+
+    def test_import(self):
+        moments = self._import(['w1', 'w2', 'w3', 'w2'])
+
+        self.assertEqual(len(moments), 3)
+        self.assertEqual(WechatMoment.objects.count(), 3)
+        self.assertEqual(MomentService.get_moments_from_user(self.user.id).count(), 3)
+        self.assertEqual(MomentTag.objects.filter(tag='__wechat').count(), 3)
+
+    def test_import_again(self):
+        self._import(['w1', 'w2'])
+        moments = self._import(['w2', 'w3'])
+
+        self.assertEqual(len(moments), 1)
+        self.assertEqual(MomentService.get_moments_from_user(self.user.id).count(), 3)
+
+    @override_settings(CACHE_QUERY=True)
+    def test_import_not_hidden_by_cache(self):
+        self.assertEqual(MomentService.get_user_moments(self.user.id).count(), 0)  # cached
+        self.assertEqual(services.get_moment_from_timeline(self.user.id, None, None, 10), [])
+
+        moments = self._import(['w1', 'w2'])
+
+        self.assertEqual(MomentService.get_user_moments(self.user.id).count(), 2)
+        feed = services.get_moment_from_timeline(self.user.id, None, None, 10)
+        self.assertEqual(sorted(hex_id(m.id) for m in feed), sorted(hex_id(m.id) for m in moments))
+
+    def test_import_job(self):
+        job_id = jobs.enqueue_wechat_import(self._data(['w1', 'w2']))
+        other = UserService().create(phone='18812341701', password='123456')
+        self.assertIsNone(jobs.get_wechat_import_status(job_id, other.id))  # not the importer
+        status = jobs.get_wechat_import_status(job_id, self.user.id)
+
+        self.assertEqual(status['status'], 'finished')
+        self.assertEqual((status['total'], status['processed'], status['failed']), (2, 2, 0))
+        self.assertEqual(status['imported'], 2)
@@ -0,0 +1,245 @@
+# -*- coding:utf-8 -*-
+'''
+Per-receiver moment timelines.
+
+When a moment is created, its id is pushed to the timeline of every home
+member who can see it (fan-out on write). A feed read only needs a page of
+ids from the timeline and one `id__in` query to hydrate them.
+
+A timeline keeps at most MOMENT_TIMELINE_SIZE ids, ordered by post date,
+the older moments are read from the database (see get_moment_from_timeline).
+Timelines are dropped when home membership changes and rebuilt on the next
+read.
+'''
+
+import time
+import bisect
+import threading
+
+from django.conf import settings
+from django.db import connection
+from customs import backends
+from customs.funcs import get_setting, hex_id
+
+
+def date_to_score(date):
+    score = time.mktime(date.timetuple())
+    if connection.features.supports_microsecond_precision:
+        # keep the same precision as the post_date stored in database
+        score += date.microsecond / 1000000.0
+    return score
+
+
+class MemoryTimelineBackend(object):
+    '''
+    Keeps every timeline as a sorted list of (score, id) in this process.
+    '''
+
+    def __init__(self, size):
+        self.size = size
+        self.timelines = {}
+        self.lock = threading.Lock()
+
+    def exists(self, receiver_id):
+        return hex_id(receiver_id) in self.timelines
+
+    def push(self, receiver_ids, moment_id, score):
+        with self.lock:
+            for receiver_id in receiver_ids:
+                timeline = self.timelines.get(hex_id(receiver_id))
+                if timeline is None:
+                    continue  # would be a partial timeline, build it when read
+                self._remove(timeline, moment_id)
+                bisect.insort(timeline, (score, moment_id))
+                del timeline[:-self.size]
+
+    def fill(self, receiver_id, items):
+        with self.lock:
+            timeline = sorted((score, mid) for mid, score in items)
+            self.timelines[hex_id(receiver_id)] = timeline[-self.size:]
+
+    def remove(self, receiver_ids, moment_id):
+        with self.lock:
+            for receiver_id in receiver_ids:
+                self._remove(self.timelines.get(hex_id(receiver_id), []), moment_id)
+
+    def _remove(self, timeline, moment_id):
+        timeline[:] = [item for item in timeline if item[1] != moment_id]
+
+    def drop(self, receiver_ids):
+        with self.lock:
+            for receiver_id in receiver_ids:
+                self.timelines.pop(hex_id(receiver_id), None)
+
+    def count(self, receiver_id, score):
+        timeline = self.timelines.get(hex_id(receiver_id), [])
+        return len([item for item in timeline if item[0] == score])
+
+    def oldest_score(self, receiver_id):
+        timeline = self.timelines.get(hex_id(receiver_id))
+        return timeline[0][0] if timeline else None
+
+    def range_before(self, receiver_id, score, number):
+        '''
+        Gets (id, score) with score <= `score`, newer to older.
+        '''
+        timeline = self.timelines.get(hex_id(receiver_id), [])
+        items = [(mid, s) for s, mid in reversed(timeline) if score is None or s <= score]
+        return items[:number]
+
+    def range_after(self, receiver_id, score, number):
+        '''
+        Gets (id, score) with score >= `score`, older to newer.
+        '''
+        timeline = self.timelines.get(hex_id(receiver_id), [])
+        items = [(mid, s) for s, mid in timeline if s >= score]
+        return items[:number]
+
+    def clear(self):
+        with self.lock:
+            self.timelines = {}
+
+
+class RedisTimelineBackend(backends.RedisBackend):
+    '''
+    Keeps every timeline as a sorted set scored by post date.
+    '''
+
+    def __init__(self, size, db, client=None):
+        super(RedisTimelineBackend, self).__init__(db, client)
+        self.size = size
+
+    def _key(self, receiver_id):
+        return '{0}:timeline:{1}'.format(settings.REDIS_PUBSUB_TAG, hex_id(receiver_id))
+
+    def exists(self, receiver_id):
+        return self.client.exists(self._key(receiver_id))
+
+    def push(self, receiver_ids, moment_id, score):
+        keys = [self._key(receiver_id) for receiver_id in receiver_ids]
+        pipe = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipe.exists(key)
+        keys = [key for key, existed in zip(keys, pipe.execute()) if existed]
+        # receivers without a timeline would get a partial one, build it when read
+
+        for key in keys:
+            pipe.zadd(key, score, moment_id)
+            pipe.zremrangebyrank(key, 0, -(self.size + 1))
+        pipe.execute()
+
+    def fill(self, receiver_id, items):
+        key = self._key(receiver_id)
+        pipe = self.client.pipeline()
+        pipe.delete(key)
+        for moment_id, score in items:
+            pipe.zadd(key, score, moment_id)
+        pipe.zremrangebyrank(key, 0, -(self.size + 1))
+        pipe.execute()
+
+    def remove(self, receiver_ids, moment_id):
+        pipe = self.client.pipeline(transaction=False)
+        for receiver_id in receiver_ids:
+            pipe.zrem(self._key(receiver_id), moment_id)
+        pipe.execute()
+
+    def drop(self, receiver_ids):
+        keys = [self._key(receiver_id) for receiver_id in receiver_ids]
+        if keys:
+            self.client.delete(*keys)
+
+    def count(self, receiver_id, score):
+        return self.client.zcount(self._key(receiver_id), score, score)
+
+    def oldest_score(self, receiver_id):
+        oldest = self.client.zrange(self._key(receiver_id), 0, 0, withscores=True)
+        return oldest[0][1] if oldest else None
+
+    def range_before(self, receiver_id, score, number):
+        '''
+        Gets (id, score) with score <= `score`, newer to older.
+        '''
+        max_score = '+inf' if score is None else repr(score)
+        return self.client.zrevrangebyscore(
+            self._key(receiver_id), max_score, '-inf', start=0, num=number, withscores=True)
+
+    def range_after(self, receiver_id, score, number):
+        '''
+        Gets (id, score) with score >= `score`, older to newer.
+        '''
+        return self.client.zrangebyscore(
+            self._key(receiver_id), repr(score), '+inf', start=0, num=number, withscores=True)
+
+    def clear(self):
+        keys = self.client.keys(self._key('*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+def _get_size():
+    return get_setting('MOMENT_TIMELINE_SIZE', 500)
+
+
+get_backend = backends.lazy_backend('MOMENT_TIMELINE_BACKEND', {
+    backends.MEMORY: lambda: MemoryTimelineBackend(_get_size()),
+    backends.REDIS: lambda: RedisTimelineBackend(_get_size(), get_setting('MOMENT_TIMELINE_REDIS_DB', 3)),
+})
+
+
+def push_moment(receiver_ids, moment):
+    get_backend().push(receiver_ids, hex_id(moment.id), date_to_score(moment.post_date))
+
+
+def remove_moment(receiver_ids, moment):
+    get_backend().remove(receiver_ids, hex_id(moment.id))
+
+
+def invalidate(*receiver_ids):
+    get_backend().drop(receiver_ids)
+
+
+def rebuild(receiver_id, moments):
+    '''
+    Fills receiver's timeline with the newest moments of a queryset.
+    '''
+    backend = get_backend()
+    moments = moments.order_by('-post_date').values_list('id', 'post_date')[:backend.size]
+    backend.fill(receiver_id, [(hex_id(mid), date_to_score(post_date)) for mid, post_date in moments])
+
+
+def is_older_than_tail(receiver_id, cursor):
+    '''
+    Whether the moments next to cursor may be trimmed from the timeline,
+    as cursor is not newer than its oldest moment.
+    '''
+    oldest = get_backend().oldest_score(receiver_id)
+    return oldest is None or date_to_score(cursor[0]) <= oldest
+
+
+def get_moment_ids(receiver_id, number, cursor=None, after=False):
+    '''
+    Gets a page of moment ids next to cursor (post_date, id), newer to older.
+    Moments posted at the same time are ordered by id, as the database does.
+    Returns None if receiver has no timeline yet.
+    '''
+    backend = get_backend()
+    number = int(number)
+    if not backend.exists(receiver_id):
+        return None
+
+    if cursor is None:
+        return [mid for mid, _ in backend.range_before(receiver_id, None, number)]
+
+    post_date, moment_id = cursor
+    score, moment_id = date_to_score(post_date), hex_id(moment_id)
+    ties = backend.count(receiver_id, score)
+
+    if after:
+        items = backend.range_after(receiver_id, score, number + ties)
+        ids = [mid for mid, s in items if s > score or mid > moment_id][:number]
+        ids.reverse()
+    else:
+        items = backend.range_before(receiver_id, score, number + ties)
+        ids = [mid for mid, s in items if s < score or mid < moment_id][:number]
+
+    return ids
@@ -0,0 +1,176 @@
+# -*- coding:utf-8 -*-
+'''
+Runs redis pub/sub listeners with a pool of workers.
+
+The listener reads messages from redis and puts them into a bounded queue,
+it blocks when max_in_flight messages are waiting, so memory of this process
+stays bounded. Redis pub/sub does not keep messages for a slow subscriber:
+they wait in its output buffer on the redis server, and when the buffer
+passes `client-output-buffer-limit pubsub` (32mb hard, or 8mb for 60 seconds
+by default) redis disconnects the listener and the buffered messages are
+lost. Keep workers fast enough for the bursts, or read the redis streams
+(information.streams, read_group), which keep messages until acked.
+Workers keep their own database connection and only reconnect when it is
+broken.
+
+    consumer = Consumer('dev:->login', handle_login, workers=8)
+    consumer.run()  # until SIGTERM or SIGINT
+'''
+
+import time
+import signal
+import logging
+import threading
+from Queue import Queue
+
+from optparse import make_option
+from django.core.management.base import CommandError
+from django.db import connection
+from settings import REDIS_PUBSUB_DB
+from customs.redis_pool import get_redis
+
+logger = logging.getLogger('pubsub')
+
+_STOP = object()
+
+CONSUMER_OPTIONS = (
+    make_option('--workers',
+                action='store',
+                type='int',
+                dest='workers',
+                default=4,
+                help='messages handled at the same time'),
+    make_option('--max-in-flight',
+                action='store',
+                type='int',
+                dest='max_in_flight',
+                default=100,
+                help='messages waiting for workers, stop reading redis when full '
+                     '(redis buffers them up to its pubsub output limit)'),
+    make_option('--gevent',
+                action='store_true',
+                dest='gevent',
+                default=False,
+                help='run workers as greenlets instead of threads'),
+)
+
+
+def use_gevent():
+    '''
+    Makes threads, queues and sockets cooperative, call it before consumer runs.
+    '''
+    try:
+        from gevent import monkey
+    except ImportError:
+        raise CommandError('gevent is not installed')
+    monkey.patch_all()
+
+
+def ensure_db_connection():
+    '''
+    Closes the connection of this thread if it is broken, Django reconnects on next query.
+    '''
+    if connection.connection is not None and not connection.is_usable():
+        connection.close()
+
+
+class Consumer(object):
+
+    def __init__(self, channel, handler, workers=4, max_in_flight=100, poll_timeout=1.0):
+        self.channel = channel
+        self.handler = handler
+        self.workers = workers
+        self.poll_timeout = poll_timeout
+        self.queue = Queue(maxsize=max_in_flight)
+        self.stopping = threading.Event()
+        self.threads = []
+
+        self.lock = threading.Lock()
+        self.handled = 0
+        self.failed = 0
+        self.total_latency = 0.0
+
+    def run(self):
+        self._install_signal_handlers()
+        self.start_workers()
+
+        p = get_redis(REDIS_PUBSUB_DB).pubsub(ignore_subscribe_messages=True)
+        p.subscribe(self.channel)
+        logger.info('listen on {0} with {1} workers'.format(self.channel, self.workers))
+
+        try:
+            while not self.stopping.is_set():
+                message = p.get_message(timeout=self.poll_timeout)
+                if message is not None:
+                    self.submit(message)
+        finally:
+            p.close()
+            self.stop()
+
+    def start_workers(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name='pubsub-worker-{0}'.format(i))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, message):
+        '''
+        Blocks when the queue is full.
+        '''
+        self.queue.put((time.time(), message))
+
+    def stop(self):
+        '''
+        Lets workers finish the messages in queue, then exit.
+        '''
+        self.stopping.set()
+        for thread in self.threads:
+            self.queue.put(_STOP)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        logger.info(self.report())
+
+    def report(self):
+        with self.lock:
+            average = self.total_latency / self.handled if self.handled else 0
+            return 'handled {0} messages, {1} failed, average latency {2:.1f} ms'.format(
+                self.handled, self.failed, average * 1000)
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            received_at, message = item
+            self._handle(received_at, message)
+        connection.close()
+
+    def _handle(self, received_at, message):
+        ensure_db_connection()
+        failed = False
+        try:
+            self.handler(message)
+        except Exception as e:
+            failed = True
+            logger.exception('fail to handle message {0}: {1}'.format(message, e))
+            ensure_db_connection()
+
+        latency = time.time() - received_at
+        with self.lock:
+            self.handled += 1
+            self.failed += failed
+            self.total_latency += latency
+        logger.info('handled message in {0:.1f} ms'.format(latency * 1000))
+
+    def _install_signal_handlers(self):
+        if not isinstance(threading.current_thread(), threading._MainThread):
+            return  # signals only work in main thread
+
+        def handle_signal(signum, frame):
+            logger.info('receive signal {0}, stopping'.format(signum))
+            self.stopping.set()
+
+        signal.signal(signal.SIGTERM, handle_signal)
+        signal.signal(signal.SIGINT, handle_signal)
@@ -1,33 +1,31 @@
 # -*- coding:utf-8 -*-
 
-import redis
+import logging
 from optparse import make_option
-from json import JSONDecoder, JSONEncoder
+from json import JSONDecoder
 from django.core.management.base import BaseCommand
-from django.db import connection
-from settings import REDIS_PUBSUB_DB, REDIS_PUBSUB_TAG
+from settings import REDIS_PUBSUB_TAG
+from information import redis_tools
 
-from apps.message.services import MessageService, GroupMessageService
-from utils import redis_utils
+from apps.pubsub.consumer import Consumer, CONSUMER_OPTIONS, use_gevent
 
+logger = logging.getLogger('pubsub')
 
-def listen_on_redis_pubsub():
-    r = redis.StrictRedis(db=REDIS_PUBSUB_DB)
-    p = r.pubsub(ignore_subscribe_messages=True)
-    CHAT = 'chat'
 
-    p.subscribe(REDIS_PUBSUB_TAG + ":->" + CHAT)
-    for m in p.listen():
-        print 'receive message:', m
-        message = JSONDecoder().decode(m['data'])
-        if _message_valid(message):
-            redis_utils.publish_redis_message(CHAT, message)
+def handle_chat_message(m):
+    logger.info('receive message: {0}'.format(m))
+    message = JSONDecoder().decode(m['data'])
+    if _message_valid(message):
+        redis_tools.publish_redis_message(message)
+
 
-        connection.close()
+def listen_on_redis_pubsub(workers, max_in_flight):
+    CHAT = 'chat'
+    Consumer(REDIS_PUBSUB_TAG + ":->" + CHAT, handle_chat_message, workers, max_in_flight).run()
 
 
 def _message_valid(messaege):
-    if messaege['event'] == 'chat' and messaege['sub_event'] in ['p2p', 'p2g']:
+    if messaege.get('event') == 'chat' and messaege.get('sub_event') in ['p2p', 'p2g']:
         return True
     else:
         return False
@@ -39,15 +37,17 @@ class Command(BaseCommand):
     option_list = BaseCommand.option_list + (
         make_option('--usage',
                     action='help',
-                    help='python manage.py listen_chat --redis'),
+                    help='python manage.py listen_chat --redis --workers=8'),
         make_option('--redis',
                     action='store_true',
                     dest='redis',
                     default=False,
                     help='listen on redis'),
-    )
+    ) + CONSUMER_OPTIONS
 
     def handle(self, *args, **options):
         if options['redis']:
+            if options['gevent']:
+                use_gevent()
             print 'listen on redis pub/sub'
-            listen_on_redis_pubsub()
+            listen_on_redis_pubsub(options['workers'], options['max_in_flight'])
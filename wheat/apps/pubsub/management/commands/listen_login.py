@@ -1,43 +1,41 @@
 # -*- coding:utf-8 -*-
 
-import redis
 import logging
 from optparse import make_option
-from json import JSONDecoder, JSONEncoder
+from json import JSONDecoder
 from django.core.management.base import BaseCommand
-from django.db import connection
-from settings import REDIS_PUBSUB_DB, REDIS_PUBSUB_TAG
+from settings import REDIS_PUBSUB_TAG
 from information import redis_tools
 
 from apps.user.services import AuthService
 from apps.user.services import UserService
+from apps.pubsub.consumer import Consumer, CONSUMER_OPTIONS, use_gevent
 
 logger = logging.getLogger('pubsub')
 
 
-def listen_on_redis_pubsub():
-    r = redis.StrictRedis(db=REDIS_PUBSUB_DB)
-    p = r.pubsub(ignore_subscribe_messages=True)
-    p.subscribe(REDIS_PUBSUB_TAG + ":->login")
-    for m in p.listen():
-        logger.info('receive message: {0}'.format(m))
-        login_data = JSONDecoder().decode(m['data'])
-        user_id = login_data.get('user_id')
-        token = login_data.get('token')
+def handle_login_message(m):
+    logger.info('receive message: {0}'.format(m))
+    login_data = JSONDecoder().decode(m['data'])
+    user_id = login_data.get('user_id')
+    token = login_data.get('token')
 
-        data = {
-                'event': 'login',
-                'login': True,
-                'receiver_id': user_id,
-        }
-        if AuthService().check_auth_token(user_id, token):
-            user = UserService().get(id=user_id)
-            data['user'] = UserService().serialize(user)
-        else:
-            data['login'] = False
+    data = {
+            'event': 'login',
+            'login': True,
+            'receiver_id': user_id,
+    }
+    if AuthService().check_auth_token(user_id, token):
+        user = UserService().get(id=user_id)
+        data['user'] = UserService().serialize(user)
+    else:
+        data['login'] = False
 
-        redis_tools.publish_redis_message(data)
-        connection.close()
+    redis_tools.publish_redis_message(data)
+
+
+def listen_on_redis_pubsub(workers, max_in_flight):
+    Consumer(REDIS_PUBSUB_TAG + ":->login", handle_login_message, workers, max_in_flight).run()
 
 
 class Command(BaseCommand):
@@ -46,15 +44,17 @@ class Command(BaseCommand):
     option_list = BaseCommand.option_list + (
         make_option('--usage',
                     action='help',
-                    help='python manage.py listen_login --redis'),
+                    help='python manage.py listen_login --redis --workers=8'),
         make_option('--redis',
                     action='store_true',
                     dest='redis',
                     default=False,
                     help='listen on redis'),
-    )
+    ) + CONSUMER_OPTIONS
 
     def handle(self, *args, **options):
         if options['redis']:
+            if options['gevent']:
+                use_gevent()
             print 'listen on redis pub/sub'
-            listen_on_redis_pubsub()
+            listen_on_redis_pubsub(options['workers'], options['max_in_flight'])
@@ -0,0 +1,36 @@
+# -*- coding:utf-8 -*-
+'''
+Tests for pub/sub consumers.
+'''
+
+import threading
+from django.test import TestCase
+
+from apps.pubsub.consumer import Consumer
+from apps.pubsub.management.commands.listen_chat import _message_valid
+
+
+class ConsumerTest(TestCase):
+    def test_handle_in_workers(self):
+        handled = []
+        lock = threading.Lock()
+
+        def handler(message):
+            if message == 'bad':
+                raise ValueError(message)
+            with lock:
+                handled.append(message)
+
+        consumer = Consumer('test', handler, workers=3, max_in_flight=2)
+        consumer.start_workers()
+        for i in range(10):
+            consumer.submit(i)
+        consumer.submit('bad')
+        consumer.stop()
+
+        self.assertEqual(sorted(handled), range(10))
+        self.assertEqual((consumer.handled, consumer.failed), (11, 1))
+
+    def test_chat_message_valid(self):
+        self.assertTrue(_message_valid({'event': 'chat', 'sub_event': 'p2p'}))
+        self.assertFalse(_message_valid({'event': 'login'}))
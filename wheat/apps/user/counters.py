@@ -0,0 +1,72 @@
+# -*- coding:utf-8 -*-
+'''
+Keeps UserCounter up to date, so badges are read from one row.
+
+Counters are changed by F() updates in the transaction of the event,
+concurrent events never lose a count.
+
+    counters.incr(receiver_ids, unread_feeds=1)
+    counters.clear(user_id, 'unread_feeds')
+'''
+
+from django.db import transaction, IntegrityError
+from django.db.models import F
+
+from customs.funcs import hex_id
+from .models import UserCounter
+
+UNREAD_MSGS, UNREAD_FEEDS, UNREAD_COMMENTS, UNREAD_INVITATIONS = \
+    'unread_msgs', 'unread_feeds', 'unread_comments', 'unread_invitations'
+
+FIELDS = (UNREAD_MSGS, UNREAD_FEEDS, UNREAD_COMMENTS, UNREAD_INVITATIONS,
+          'unread_topics', 'chat_ats', 'feed_ats')
+
+
+def incr(user_ids, **deltas):
+    '''
+    Adds deltas to the counters of users, such as unread_feeds=1.
+    '''
+    user_ids = set(hex_id(user_id) for user_id in user_ids if user_id)
+    deltas = dict((field, delta) for field, delta in deltas.items() if delta)
+    if not user_ids or not deltas:
+        return
+
+    updates = dict((field, F(field) + delta) for field, delta in deltas.items())
+    existed = set(hex_id(user_id) for user_id in UserCounter.objects.filter(
+        user_id__in=user_ids).values_list('user_id', flat=True))
+    if existed:
+        UserCounter.objects.filter(user_id__in=existed).update(**updates)
+
+    missing = user_ids - existed
+    if not missing:
+        return
+    try:
+        with transaction.atomic():
+            UserCounter.objects.bulk_create([UserCounter(user_id=user_id, **deltas) for user_id in missing])
+    except IntegrityError:  # created by others just now
+        UserCounter.objects.filter(user_id__in=missing).update(**updates)
+
+
+def decr(user_id, field, number=1):
+    '''
+    Subtracts number from a counter, it never goes below 0.
+    '''
+    if number <= 0:
+        return
+    if not UserCounter.objects.filter(user_id=user_id, **{field + '__gte': number}) \
+            .update(**{field: F(field) - number}):
+        UserCounter.objects.filter(user_id=user_id).update(**{field: 0})
+
+
+def clear(user_id, *fields):
+    fields = fields or FIELDS
+    UserCounter.objects.filter(user_id=user_id).update(**dict((field, 0) for field in fields))
+
+
+def get_counter(user_id):
+    ''' A user who has nothing unread may have no counter yet '''
+    return UserCounter.objects.filter(user_id=user_id).first() or UserCounter(user_id=user_id)
+
+
+def serialize_counter(counter):
+    return dict((field, getattr(counter, field)) for field in FIELDS)
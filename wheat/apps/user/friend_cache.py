@@ -0,0 +1,84 @@
+# -*- coding:utf-8 -*-
+'''
+Cached friend sets of users.
+
+The friend ids of a user are loaded with one query and kept in Redis,
+FriendshipService drops them when a friendship is created or deleted.
+Visibility checks take a FriendSnapshot, which keeps the sets it has read
+in process, so checking many rows is pure set operations.
+'''
+
+from django.db.models import Q
+from customs import backends
+from customs.funcs import get_setting, hex_id
+
+from .models import Friendship
+
+get_backend = backends.lazy_backend('FRIEND_CACHE_BACKEND', {
+    backends.MEMORY: backends.MemoryIdSets,
+    backends.REDIS: lambda: backends.RedisIdSets(
+        'friends',
+        get_setting('FRIEND_CACHE_REDIS_DB', 3),
+        get_setting('FRIEND_CACHE_TIMEOUT', 60 * 60 * 24)),
+})
+
+
+def load_friend_ids(user_id):
+    '''
+    Gets friend ids of user from database, as hex strings.
+    '''
+    condition = Q(user_a=user_id) | Q(user_b=user_id)
+    pairs = Friendship.objects.filter(condition, deleted=False).values_list('user_a', 'user_b')
+    user_id = hex_id(user_id)
+    friend_ids = set()
+    for user_a, user_b in pairs:
+        user_a, user_b = hex_id(user_a), hex_id(user_b)
+        friend_ids.add(user_b if user_a == user_id else user_a)
+    return friend_ids
+
+
+def get_friend_ids(user_id):
+    backend = get_backend()
+    friend_ids = backend.get(user_id)
+    if friend_ids is None:
+        friend_ids = load_friend_ids(user_id)
+        backend.set(user_id, friend_ids)
+    return friend_ids
+
+
+def invalidate(*user_ids):
+    get_backend().drop(user_ids)
+
+
+class FriendSnapshot(object):
+    '''
+    Friend sets read during one request, every user is looked up once.
+    '''
+
+    def __init__(self):
+        self.friends = {}
+
+    def get_friend_ids(self, user_id):
+        if user_id is None:
+            return set()
+        user_id = hex_id(user_id)
+        if user_id not in self.friends:
+            self.friends[user_id] = get_friend_ids(user_id)
+        return self.friends[user_id]
+
+    def is_friend(self, user_a_id, user_b_id):
+        return self.all_is_friend([user_a_id, user_b_id])
+
+    def all_is_friend(self, user_ids):
+        '''
+        Judges if the users are all friends of each other. A user counts
+        as a friend of themselves, as FriendshipService.is_friend does.
+        '''
+        user_ids = set(user_ids)
+        if None in user_ids:  # nobody is friend of None
+            return len(user_ids) == 1
+        user_ids = set(hex_id(u) for u in user_ids)
+        for user_id in user_ids:
+            if not user_ids - set([user_id]) <= self.get_friend_ids(user_id):
+                return False
+        return True
@@ -0,0 +1,37 @@
+# -*- coding:utf-8 -*-
+'''
+Loads the users of a member list at once, instead of one query per member.
+
+    profiles.get_profiles(group.members)
+    # {'<hex id>': {'nickname': ..., 'avatar': ..., 'gender': ...}}
+
+Results are keyed by hex id, as ids of members may be kept with dashes.
+'''
+
+from customs.funcs import hex_id
+from .models import User
+
+
+def get_users(user_ids):
+    '''
+    Users by hex id, with one query. Missing users are not in the result.
+    '''
+    user_ids = set(hex_id(user_id) for user_id in user_ids if user_id)
+    if not user_ids:
+        return {}
+    return dict((hex_id(user.id), user) for user in User.objects.filter(id__in=user_ids))
+
+
+def serialize_profile(user):
+    return {
+        'nickname': user.nickname,
+        'avatar': str(user.avatar),
+        'gender': user.gender,
+    }
+
+
+def get_profiles(user_ids):
+    '''
+    Compact profiles (nickname, avatar, gender) by hex id, with one query.
+    '''
+    return dict((user_id, serialize_profile(user)) for user_id, user in get_users(user_ids).items())
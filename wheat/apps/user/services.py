@@ -4,9 +4,11 @@ from django.db import transaction
 from django.contrib.auth import authenticate
 
 from customs.services import BaseService
+from customs.transaction_hooks import on_commit
 from .models import User, AuthToken, Friendship, Captcha
 from .serializers import UserSerializer, AuthTokenSerializer, CaptchaSerializer
 from .serializers import FriendshipSerializer
+from . import friend_cache
 from datetime import datetime, timedelta
 from django.db.models import Q
 from customs.services import MessageService
@@ -246,6 +248,7 @@ class FriendshipService(BaseService):
                 friendship = super(FriendshipService, self).create(user_a=user_a_id, user_b=user_b_id)
             elif friendship.deleted:
                 friendship = super(FriendshipService, self).update(friendship, deleted=False)
+            self._invalidate_friends(user_a_id, user_b_id)
             return friendship
         else:
             return None
@@ -260,6 +263,7 @@ class FriendshipService(BaseService):
 
         if friendship:
             friendship = super(FriendshipService, self).delete(friendship)
+            self._invalidate_friends(user_a_id, user_b_id)
         return friendship
 
     def update(self, user_a_id, user_b_id, **kwargs):
@@ -270,9 +274,15 @@ class FriendshipService(BaseService):
         friendship = self.get(user_a_id, user_b_id)
         if friendship:
             friendship = super(FriendshipService, self).update(friendship, **kwargs)
+            self._invalidate_friends(user_a_id, user_b_id)
 
         return friendship
 
+    def _invalidate_friends(self, user_a_id, user_b_id):
+        friend_cache.invalidate(user_a_id, user_b_id)
+        # others may cache the old friends before the change commits
+        on_commit(lambda: friend_cache.invalidate(user_a_id, user_b_id))
+
     def get(self, user_a_id, user_b_id):
         '''
         Get infor of user_a and user_b
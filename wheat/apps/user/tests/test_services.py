@@ -12,6 +12,8 @@ from apps.user.services import UserService
 from apps.user.services import CaptchaService
 from apps.user.services import AuthService
 from apps.user.services import FriendshipService
+from apps.user import friend_cache
+from apps.user import profiles
 from apps.group.models import Group
 from django.conf import settings
 from django.utils.importlib import import_module
@@ -19,6 +21,7 @@ from django.http import HttpRequest
 import datetime
 from django.db.models import Q
 import itertools
+import uuid
 
 user_service = UserService()
 
@@ -539,3 +542,65 @@ class TestFriendship(TestCase):
             if str(u) != str(test_person.id):
                 self.assertTrue(fs_service.is_friend(test_person.id, u))
         
+
+
+class TestFriendCache(TestCase):
+    def setUp(self):
+        friend_cache.get_backend().clear()
+        self.users = [User.objects.create(phone='1885745310' + str(i)) for i in range(3)]
+        fs_service.create(self.users[0].id, self.users[1].id)
+        fs_service.create(self.users[1].id, self.users[2].id)
+
+    def test_friend_ids(self):
+        friend_ids = friend_cache.get_friend_ids(self.users[1].id)
+        self.assertEqual(friend_ids, set([self.users[0].id.hex, self.users[2].id.hex]))
+
+    def test_invalidated_by_friendship(self):
+        self.assertEqual(friend_cache.get_friend_ids(self.users[0].id), set([self.users[1].id.hex]))
+
+        fs_service.create(self.users[0].id, self.users[2].id)
+        self.assertEqual(len(friend_cache.get_friend_ids(self.users[0].id)), 2)
+
+        fs_service.delete(self.users[0].id, self.users[1].id)
+        self.assertEqual(friend_cache.get_friend_ids(self.users[0].id), set([self.users[2].id.hex]))
+
+    def test_snapshot(self):
+        snapshot = friend_cache.FriendSnapshot()
+        user_ids = [u.id for u in self.users]
+
+        self.assertTrue(snapshot.is_friend(user_ids[0], str(user_ids[1])))
+        self.assertFalse(snapshot.all_is_friend(user_ids))
+        self.assertTrue(snapshot.all_is_friend(user_ids[:2] + [user_ids[0]]))
+        self.assertFalse(snapshot.all_is_friend([user_ids[0], None]))
+
+        with self.assertNumQueries(0):
+            snapshot.all_is_friend(user_ids)
+
+    def test_snapshot_self_is_friend(self):
+        snapshot = friend_cache.FriendSnapshot()
+        user_id = self.users[0].id
+
+        self.assertEqual(snapshot.is_friend(user_id, user_id), fs_service.is_friend(user_id, user_id))
+        self.assertTrue(snapshot.all_is_friend([user_id, user_id.hex]))
+        self.assertFalse(snapshot.all_is_friend([user_id, self.users[2].id]))
+
+
+class TestProfiles(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create(phone='1885745320' + str(i), nickname='n' + str(i), gender='F')
+                      for i in range(3)]
+
+    def test_profiles(self):
+        user_ids = [str(u.id) for u in self.users] + [None]  # dashed, as kept in members
+        profiles_by_id = profiles.get_profiles(user_ids)
+
+        self.assertEqual(len(profiles_by_id), 3)
+        profile = profiles_by_id[self.users[0].id.hex]
+        self.assertEqual(profile['nickname'], 'n0')
+        self.assertEqual(profile['gender'], 'F')
+        self.assertTrue('avatar' in profile)
+
+    def test_missing_users(self):
+        self.assertEqual(profiles.get_profiles([]), {})
+        users = profiles.get_users([self.users[1].id, uuid.uuid4()])
+        self.assertEqual(users.keys(), [self.users[1].id.hex])
@@ -0,0 +1,131 @@
+# -*- coding:utf-8 -*-
+'''
+Pieces shared by the modules keeping data in redis, or in process memory
+when testing (moment timelines, friend and home member caches, buffered
+notifications).
+
+A module chooses its backend by a setting, and makes it on first use:
+
+    get_backend = backends.lazy_backend('FRIEND_CACHE_BACKEND', {
+        backends.MEMORY: backends.MemoryIdSets,
+        backends.REDIS: lambda: backends.RedisIdSets('friends', db, timeout),
+    })
+'''
+
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from customs.funcs import get_setting, hex_id
+from customs.redis_pool import get_redis
+
+REDIS, MEMORY = 'redis', 'memory'
+
+
+def lazy_backend(setting, factories, default=REDIS):
+    '''
+    Gives a function returning one backend, made by factories[name] on the
+    first call, where name is the value of setting.
+    '''
+    made = []
+    lock = threading.Lock()
+
+    def get_backend():
+        if not made:
+            with lock:
+                if not made:
+                    name = get_setting(setting, default)
+                    if name not in factories:
+                        raise ImproperlyConfigured('{0} should be one of {1}, not {2}'.format(
+                            setting, ', '.join(sorted(factories)), name))
+                    made.append(factories[name]())
+        return made[0]
+
+    return get_backend
+
+
+class RedisBackend(object):
+    '''
+    Base of the redis backends, the client is got from the shared pool of
+    db on first use, or given (a fakeredis client in tests).
+    '''
+
+    def __init__(self, db, client=None):
+        self.db = db
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = get_redis(self.db)
+        return self._client
+
+
+class MemoryIdSets(object):
+    '''
+    Sets of ids by key, in a dict of this process.
+    '''
+
+    def __init__(self):
+        self.sets = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        ''' A copy of the set, None if not cached '''
+        ids = self.sets.get(hex_id(key))
+        return set(ids) if ids is not None else None
+
+    def set(self, key, ids):
+        with self.lock:
+            self.sets[hex_id(key)] = set(ids)
+
+    def drop(self, keys):
+        with self.lock:
+            for key in keys:
+                self.sets.pop(hex_id(key), None)
+
+    def clear(self):
+        with self.lock:
+            self.sets = {}
+
+
+class RedisIdSets(RedisBackend):
+    '''
+    Sets of ids by key, every set is a redis set expiring in timeout seconds.
+    '''
+
+    EMPTY = '-'  # redis cannot keep an empty set, this member marks it exists
+
+    def __init__(self, name, db, timeout, client=None):
+        super(RedisIdSets, self).__init__(db, client)
+        self.name = name
+        self.timeout = timeout
+
+    def _key(self, key):
+        return '{0}:{1}:{2}'.format(settings.REDIS_PUBSUB_TAG, self.name, hex_id(key))
+
+    def get(self, key):
+        ids = self.client.smembers(self._key(key))
+        if not ids:
+            return None
+        ids.discard(self.EMPTY)
+        return ids
+
+    def set(self, key, ids):
+        redis_key = self._key(key)
+        pipe = self.client.pipeline()
+        pipe.delete(redis_key)
+        pipe.sadd(redis_key, self.EMPTY, *ids)
+        pipe.expire(redis_key, self.timeout)
+        pipe.execute()
+
+    def drop(self, keys):
+        redis_keys = [self._key(key) for key in keys]
+        if redis_keys:
+            self.client.delete(*redis_keys)
+
+    def clear(self):
+        redis_keys = self.client.keys(self._key('*'))
+        if redis_keys:
+            self.client.delete(*redis_keys)
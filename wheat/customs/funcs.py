@@ -4,6 +4,8 @@ Defines some customed functions for functional programming.
 Author: Minchiuan Gao 2016-Mar-1
 '''
 
+from django.conf import settings
+
 
 def reduce(function, iterable, initializer=None):
     '''
@@ -22,3 +24,18 @@ def reduce(function, iterable, initializer=None):
         function(accum_value, x)
 
     return accum_value
+
+
+def get_setting(name, default):
+    '''
+    Gets an optional setting, default if it is not set.
+    '''
+    return getattr(settings, name, default)
+
+
+def hex_id(uid):
+    '''
+    A fresh model id is a uuid.UUID, a loaded one is a hex string,
+    ids from request may have dashes. Gives the hex string of them all.
+    '''
+    return str(getattr(uid, 'hex', uid)).replace('-', '')
@@ -69,6 +69,18 @@ class CacheableQuerySet(QuerySet):
             invalidate_model(self.model)
         return n
 
+    def bulk_create(self, objs, batch_size=None):
+        # no post_save is sent, cacheops would keep the queries missing the new rows
+        objs = super(CacheableQuerySet, self).bulk_create(objs, batch_size)
+        if self.is_cacheable() and objs:
+            from cacheops import invalidate_model
+            from customs.transaction_hooks import on_commit
+            model = self.model
+            invalidate_model(model)
+            # again after commit, others may cache the old rows before it
+            on_commit(lambda: invalidate_model(model), using=self.db)
+        return objs
+
 
 class CacheableManager(models.Manager):
 
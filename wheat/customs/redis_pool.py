@@ -0,0 +1,52 @@
+# -*- coding:utf-8 -*-
+'''
+Shared redis clients, one connection pool for every redis db.
+
+    from customs.redis_pool import get_redis
+    get_redis(settings.REDIS_PUBSUB_DB).publish(channel, data)
+
+Pools are made on first use, so importing a module opens no socket, and
+connections are reused by all the clients of a db in the process. A pool made
+before fork is dropped by redis-py in the child, workers never share sockets.
+
+Host, port and pool size are set by REDIS_HOST, REDIS_PORT,
+REDIS_MAX_CONNECTIONS and REDIS_SOCKET_TIMEOUT.
+'''
+
+import threading
+
+import redis
+from customs.funcs import get_setting
+
+_pools = {}
+_lock = threading.Lock()
+
+
+def get_pool(db=0):
+    pool = _pools.get(db)
+    if pool is None:
+        with _lock:
+            pool = _pools.get(db)
+            if pool is None:
+                pool = redis.BlockingConnectionPool(
+                    host=get_setting('REDIS_HOST', 'localhost'),
+                    port=get_setting('REDIS_PORT', 6379),
+                    db=db,
+                    max_connections=get_setting('REDIS_MAX_CONNECTIONS', 50),
+                    socket_timeout=get_setting('REDIS_SOCKET_TIMEOUT', None))
+                _pools[db] = pool
+    return pool
+
+
+def get_redis(db=0):
+    '''
+    A client on the shared pool of db, cheap to make.
+    '''
+    return redis.StrictRedis(connection_pool=get_pool(db))
+
+
+def disconnect_all():
+    with _lock:
+        for pool in _pools.values():
+            pool.disconnect()
+        _pools.clear()
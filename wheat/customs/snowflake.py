@@ -0,0 +1,199 @@
+# -*- coding:utf-8 -*-
+'''
+Snowflake style 64-bit ids, sorted by the time they are made.
+
+    | 41 bits milliseconds since EPOCH | 10 bits worker id | 12 bits sequence |
+
+Ids made by one worker are always increasing. Every process leases its own
+worker id in redis (SNOWFLAKE_LEASE_*), a forked process leases another one.
+The lease is renewed while ids are made, a process which lost it while idle
+leases again before making an id. SNOWFLAKE_WORKER_ID pins the id to lease, it
+fails if another process holds it. No id is made without a lease.
+'''
+
+import os
+import socket
+import time
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from customs import backends
+from customs.funcs import get_setting
+
+EPOCH = 1451606400000  # 2016-01-01 00:00:00 UTC, in milliseconds
+
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKER = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+ID_LENGTH = 19  # digits of the max 63 bits id
+
+
+def _now():
+    return int(time.time() * 1000)
+
+
+class SnowflakeGenerator(object):
+
+    def __init__(self, worker_id):
+        if not 0 <= worker_id <= MAX_WORKER:
+            raise ValueError('worker id should be in [0, {0}]'.format(MAX_WORKER))
+        self.worker_id = worker_id
+        self.last_timestamp = -1
+        self.sequence = 0
+        self.lock = threading.Lock()
+
+    def next_id(self):
+        with self.lock:
+            timestamp = _now()
+            if timestamp < self.last_timestamp:
+                timestamp = self._wait_until(self.last_timestamp)  # clock moved backwards
+
+            if timestamp == self.last_timestamp:
+                self.sequence = (self.sequence + 1) & MAX_SEQUENCE
+                if self.sequence == 0:  # used up in this millisecond
+                    timestamp = self._wait_until(self.last_timestamp + 1)
+            else:
+                self.sequence = 0
+
+            self.last_timestamp = timestamp
+            return ((timestamp - EPOCH) << (WORKER_BITS + SEQUENCE_BITS)) \
+                | (self.worker_id << SEQUENCE_BITS) | self.sequence
+
+    def _wait_until(self, timestamp):
+        now = _now()
+        while now < timestamp:
+            time.sleep(0.0001)
+            now = _now()
+        return now
+
+
+def id_to_str(uid):
+    '''
+    Zero padded, so ids in string are sorted the same as in number.
+    '''
+    return str(uid).zfill(ID_LENGTH)
+
+
+def id_to_timestamp(uid):
+    '''
+    Gets the milliseconds when an id was made.
+    '''
+    return (int(uid) >> (WORKER_BITS + SEQUENCE_BITS)) + EPOCH
+
+
+class MemoryWorkerLeases(object):
+    '''
+    Leases of worker ids in this process, for tests.
+    '''
+
+    def __init__(self):
+        self.owners = {}
+        self.start = 0
+        self.lock = threading.Lock()
+
+    def next_start(self):
+        with self.lock:
+            self.start += 1
+            return self.start
+
+    def take(self, worker_id, owner, timeout):
+        with self.lock:
+            if worker_id in self.owners:
+                return False
+            self.owners[worker_id] = owner
+            return True
+
+    def renew(self, worker_id, owner, timeout):
+        return self.owners.get(worker_id) == owner
+
+    def clear(self):
+        with self.lock:
+            self.owners = {}
+
+
+class RedisWorkerLeases(backends.RedisBackend):
+    '''
+    A worker id is leased by a key holding its owner, expiring in timeout seconds.
+    '''
+
+    # extends the lease only if owner still holds it
+    RENEW_SCRIPT = '''
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+'''
+
+    def _key(self, name):
+        return '{0}:snowflake:{1}'.format(settings.REDIS_PUBSUB_TAG, name)
+
+    def next_start(self):
+        return self.client.incr(self._key('next'))
+
+    def take(self, worker_id, owner, timeout):
+        return bool(self.client.set(self._key(worker_id), owner, nx=True, ex=timeout))
+
+    def renew(self, worker_id, owner, timeout):
+        return bool(self.client.eval(self.RENEW_SCRIPT, 1, self._key(worker_id), owner, timeout))
+
+    def clear(self):
+        keys = self.client.keys(self._key('*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+get_leases = backends.lazy_backend('SNOWFLAKE_LEASE_BACKEND', {
+    backends.MEMORY: MemoryWorkerLeases,
+    backends.REDIS: lambda: RedisWorkerLeases(get_setting('SNOWFLAKE_LEASE_REDIS_DB', 4)),
+})
+
+
+def lease_worker_id(leases, owner, timeout, worker_id=None):
+    '''
+    Takes worker_id, or the first free id after the next start of a shared
+    counter, so processes starting together do not try the same ids.
+    '''
+    if worker_id is not None:
+        if not leases.take(worker_id, owner, timeout):
+            raise ImproperlyConfigured('SNOWFLAKE_WORKER_ID {0} is used by another process'.format(worker_id))
+        return worker_id
+
+    start = leases.next_start()
+    for i in range(MAX_WORKER + 1):
+        worker_id = (start + i) & MAX_WORKER
+        if leases.take(worker_id, owner, timeout):
+            return worker_id
+    raise RuntimeError('all {0} snowflake worker ids are leased'.format(MAX_WORKER + 1))
+
+
+_generator = None
+_owner = None
+_renewed_at = 0
+_lock = threading.Lock()
+
+
+def _get_generator():
+    global _generator, _owner, _renewed_at
+    owner = '{0}:{1}'.format(socket.gethostname(), os.getpid())
+    timeout = get_setting('SNOWFLAKE_LEASE_TIMEOUT', 60 * 10)
+    now = time.time()
+    if _generator is not None and _owner == owner and now - _renewed_at < timeout / 3.0:
+        return _generator
+
+    with _lock:
+        leases = get_leases()
+        pinned_id = get_setting('SNOWFLAKE_WORKER_ID', None)
+        if _generator is None or _owner != owner:  # forked workers lease their own
+            _generator, _owner = SnowflakeGenerator(lease_worker_id(leases, owner, timeout, pinned_id)), owner
+        elif now - _renewed_at >= timeout / 3.0 and not leases.renew(_generator.worker_id, owner, timeout):
+            # expired while idle, another process may make ids with it now
+            _generator = SnowflakeGenerator(lease_worker_id(leases, owner, timeout, pinned_id))
+        _renewed_at = now
+    return _generator
+
+
+def next_id():
+    return _get_generator().next_id()
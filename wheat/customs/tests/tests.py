@@ -1,10 +1,20 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
+from django.db import transaction
 from customs.urls import get_urlpattern
 from customs.urls import get_url
 from customs import class_tools
 from apps.user.services import user_service
+from apps.user.models import User
 from customs import response
 from customs.services import MessageService
+from customs import transaction_hooks
+from customs import snowflake
+from customs import redis_pool
+from customs import backends
+from customs.funcs import hex_id
+from django.core.exceptions import ImproperlyConfigured
+from django.test.utils import override_settings
+import uuid
 
 
 class TestUrlUtils(TestCase):
@@ -89,3 +99,138 @@ class TestMessage(TestCase):
         okay = MessageService.send_invitation('18857453090', '18857453090', 'xuexue', 'where are you', 'son')
         self.assertTrue(okay)
 
+
+
+class TestTransactionHooks(TransactionTestCase):
+    def test_run_after_commit(self):
+        called = []
+        with transaction.atomic():
+            transaction_hooks.on_commit(lambda: called.append(1))
+            self.assertEqual(called, [])
+        self.assertEqual(called, [1])
+
+    def test_dropped_by_rollback(self):
+        called = []
+        try:
+            with transaction.atomic():
+                transaction_hooks.on_commit(lambda: called.append(1))
+                raise ValueError
+        except ValueError:
+            pass
+        with transaction.atomic():
+            pass
+        self.assertEqual(called, [])
+
+    def test_run_without_transaction(self):
+        called = []
+        transaction_hooks.on_commit(lambda: called.append(1))
+        self.assertEqual(called, [1])
+
+    def test_write_after_commit(self):
+        states = []
+
+        def create_user():
+            connection = transaction.get_connection()
+            states.append((connection.in_atomic_block, connection.get_autocommit()))
+            User.objects.create(phone='18857453099')
+
+        with transaction.atomic():
+            User.objects.create(phone='18857453098')
+            transaction_hooks.on_commit(create_user)
+        self.assertEqual(states, [(False, True)])
+        self.assertTrue(User.objects.filter(phone='18857453099').exists())
+
+        # the write of the hook was committed, not left to a later transaction
+        try:
+            with transaction.atomic():
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertTrue(User.objects.filter(phone='18857453099').exists())
+
+
+class TestSnowflake(TestCase):
+    def test_ids_increase(self):
+        generator = snowflake.SnowflakeGenerator(worker_id=1)
+        ids = [generator.next_id() for i in range(10000)]
+
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertTrue(ids[-1] < 1 << 63)
+
+    def test_str_sorted(self):
+        generator = snowflake.SnowflakeGenerator(worker_id=1)
+        ids = [generator.next_id() for i in range(100)]
+
+        self.assertEqual(map(snowflake.id_to_str, ids), sorted(map(snowflake.id_to_str, ids)))
+
+    def test_timestamp(self):
+        uid = snowflake.next_id()
+        self.assertTrue(abs(snowflake.id_to_timestamp(uid) - snowflake._now()) < 1000)
+
+    def test_unvalid_worker(self):
+        self.assertRaises(ValueError, snowflake.SnowflakeGenerator, 1024)
+
+    def test_lease_worker_ids(self):
+        leases = snowflake.MemoryWorkerLeases()
+        worker_ids = [snowflake.lease_worker_id(leases, 'host:{0}'.format(pid), 60) for pid in range(3)]
+        self.assertEqual(len(set(worker_ids)), 3)
+
+        self.assertTrue(leases.renew(worker_ids[0], 'host:0', 60))
+        self.assertFalse(leases.renew(worker_ids[0], 'host:1', 60))
+        # a pinned id is not shared, and no fallback when all are leased
+        self.assertRaises(ImproperlyConfigured, snowflake.lease_worker_id, leases, 'other:0', 60, worker_ids[0])
+        for pid in range(3, snowflake.MAX_WORKER + 1):
+            snowflake.lease_worker_id(leases, 'host:{0}'.format(pid), 60)
+        self.assertRaises(RuntimeError, snowflake.lease_worker_id, leases, 'other:0', 60)
+
+    def test_forked_worker_leases_again(self):
+        generator = snowflake._get_generator()
+        owner = snowflake._owner
+        snowflake._owner = 'parent:0'  # as if made before fork
+        try:
+            self.assertNotEqual(snowflake._get_generator().worker_id, generator.worker_id)
+        finally:
+            snowflake._generator, snowflake._owner = generator, owner
+
+
+class TestRedisPool(TestCase):
+    def tearDown(self):
+        redis_pool.disconnect_all()
+
+    def test_pool_shared_by_db(self):
+        self.assertIs(redis_pool.get_redis(5).connection_pool, redis_pool.get_redis(5).connection_pool)
+        self.assertIsNot(redis_pool.get_redis(5).connection_pool, redis_pool.get_redis(6).connection_pool)
+
+    def test_lazy(self):
+        redis_pool.disconnect_all()
+        pool = redis_pool.get_pool(5)
+        self.assertEqual(len(pool._connections), 0)  # nothing opened until a command
+
+
+class TestBackends(TestCase):
+    def test_hex_id(self):
+        uid = uuid.uuid4()
+        self.assertEqual(hex_id(uid), uid.hex)
+        self.assertEqual(hex_id(str(uid)), uid.hex)
+        self.assertEqual(hex_id(uid.hex), uid.hex)
+
+    def test_lazy_backend(self):
+        get_backend = backends.lazy_backend('TEST_BACKEND', {backends.MEMORY: backends.MemoryIdSets})
+        with override_settings(TEST_BACKEND=backends.MEMORY):
+            self.assertIs(get_backend(), get_backend())
+
+        get_backend = backends.lazy_backend('TEST_BACKEND', {backends.MEMORY: backends.MemoryIdSets})
+        with override_settings(TEST_BACKEND='unknown'):
+            self.assertRaises(ImproperlyConfigured, get_backend)
+
+    def test_memory_id_sets(self):
+        sets = backends.MemoryIdSets()
+        uid = uuid.uuid4()
+        self.assertIsNone(sets.get(uid))
+
+        sets.set(uid, ['a'])
+        sets.get(str(uid)).add('b')  # a copy is given
+        self.assertEqual(sets.get(uid.hex), set(['a']))
+
+        sets.drop([uid])
+        self.assertIsNone(sets.get(uid))
@@ -0,0 +1,73 @@
+# -*- coding:utf-8 -*-
+'''
+Runs functions after the current transaction commits, as on_commit() of Django 1.9.
+
+Functions registered in an atomic block run when the outermost block commits,
+and are dropped when it rolls back. Outside of atomic blocks they run at once.
+Notice a savepoint rolled back alone does not drop the functions registered in it.
+
+The functions run when the outermost block has exited and autocommit is back,
+not inside connection.commit(), so they may write to the database themselves.
+'''
+
+import logging
+
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+
+logger = logging.getLogger('django')
+
+
+def _install_hooks(connection):
+    if getattr(connection, 'commit_hooks', None) is not None:
+        return
+
+    connection.commit_hooks = []
+    connection.committed_hooks = []
+    commit, rollback = connection.commit, connection.rollback
+
+    def commit_and_keep_hooks():
+        commit()
+        connection.committed_hooks.extend(connection.commit_hooks)
+        connection.commit_hooks = []
+
+    def rollback_and_drop_hooks():
+        connection.commit_hooks = []
+        rollback()
+
+    connection.commit = commit_and_keep_hooks
+    connection.rollback = rollback_and_drop_hooks
+
+
+def _run_hooks(connection):
+    hooks, connection.committed_hooks = connection.committed_hooks, []
+    for func in hooks:
+        try:
+            func()
+        except Exception:  # the transaction is committed, do not fail the caller
+            logger.exception('fail to run {0} after commit'.format(func))
+
+
+_atomic_exit = transaction.Atomic.__exit__
+
+
+def _atomic_exit_and_run_hooks(self, exc_type, exc_value, traceback):
+    # Atomic.__exit__ commits first and turns autocommit on in its finally,
+    # the hooks can only run after it
+    try:
+        return _atomic_exit(self, exc_type, exc_value, traceback)
+    finally:
+        connection = transaction.get_connection(self.using)
+        if not connection.in_atomic_block and getattr(connection, 'committed_hooks', None):
+            _run_hooks(connection)
+
+transaction.Atomic.__exit__ = _atomic_exit_and_run_hooks
+
+
+def on_commit(func, using=None):
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    if not connection.in_atomic_block:
+        func()
+        return
+
+    _install_hooks(connection)
+    connection.commit_hooks.append(func)
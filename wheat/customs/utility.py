@@ -5,17 +5,19 @@ from functools import partial
 
 # given an object called 'link'
 
+UNVALID_SIZE = ("Pciture Unvalid", "Picture Unvalid")
+
 
 def get_image_size(http_site_url, image_src):
   try:
-      URL = http_site_url + image_src
+      URL = image_src if image_src.startswith('http') else http_site_url + image_src
       file = cStringIO.StringIO(urllib.urlopen(URL).read())
       im = Image.open(file)
       width, height = im.size
       return width, height
   except Exception as e:
       print e
-      return "Pciture Unvalid", "Picture Unvalid"
+      return UNVALID_SIZE
 
 MAILI_URL = 'http://121.40.158.110/media/'
 get_image_from_maili = partial(get_image_size, MAILI_URL)
@@ -0,0 +1,189 @@
+# -*- coding:utf-8 -*-
+'''
+Buffers notifications per (receiver, event) for a short window, so a burst
+of moments reaches every family member as one message.
+
+The first buffered message of a receiver opens a window of
+MESSAGE_COALESCE_WINDOW seconds, messages coming in it join the buffer.
+`manage.py flush_notifications` pops the buffers whose window is over and
+publishes one aggregated message for each, see redis_tools.flush_coalesced.
+
+Buffers are kept in redis by default, so every web worker adds to the same
+buffers and a restarted ticker loses nothing.
+'''
+
+import time
+import threading
+from json import JSONEncoder, loads
+
+from django.conf import settings
+
+from customs import backends
+from customs.funcs import get_setting
+
+RECEIVER_ID, EVENT = 'receiver_id', 'event'
+
+
+def get_window():
+    ''' Seconds, 0 means not coalescing '''
+    return get_setting('MESSAGE_COALESCE_WINDOW', 0)
+
+
+def get_events():
+    return get_setting('MESSAGE_COALESCE_EVENTS', ('moment',))
+
+
+def is_coalesced(message):
+    return bool(get_window()) and message.get(EVENT) in get_events() and bool(message.get(RECEIVER_ID))
+
+
+def _buffer_name(message):
+    return '{0}:{1}'.format(message[EVENT], message[RECEIVER_ID])
+
+
+class MemoryCoalesceBackend(object):
+    '''
+    Keeps every buffer as (due time, messages) in a dict of this process.
+    '''
+
+    def __init__(self):
+        self.buffers = {}  # name => (due time, messages)
+        self.lock = threading.Lock()
+
+    def add(self, messages, window, now=None):
+        now = now or time.time()
+        with self.lock:
+            for message in messages:
+                name = _buffer_name(message)
+                due, buffered = self.buffers.setdefault(name, (now + window, []))
+                buffered.append(message)
+
+    def pop_due(self, now=None, number=1000):
+        '''
+        Gets the messages of up to `number` buffers whose window is over,
+        as [[message, ...], ...].
+        '''
+        now = now or time.time()
+        with self.lock:
+            names = sorted((due, name) for name, (due, m) in self.buffers.items() if due <= now)
+            return [self.buffers.pop(name)[1] for due, name in names[:number]]
+
+    def clear(self):
+        with self.lock:
+            self.buffers = {}
+
+
+# KEYS: due zset, buffer prefix; ARGV: due time, name, message, name, message...
+_ADD_SCRIPT = '''
+for i = 2, #ARGV, 2 do
+    local name = ARGV[i]
+    redis.call('RPUSH', KEYS[2] .. name, ARGV[i + 1])
+    if not redis.call('ZSCORE', KEYS[1], name) then
+        redis.call('ZADD', KEYS[1], ARGV[1], name)
+    end
+end
+'''
+
+# KEYS: due zset, buffer prefix; ARGV: now, number
+_POP_SCRIPT = '''
+local names = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+local buffers = {}
+for i, name in ipairs(names) do
+    buffers[i] = redis.call('LRANGE', KEYS[2] .. name, 0, -1)
+    redis.call('DEL', KEYS[2] .. name)
+    redis.call('ZREM', KEYS[1], name)
+end
+return buffers
+'''
+
+
+class RedisCoalesceBackend(backends.RedisBackend):
+    '''
+    Keeps every buffer as a list and their due times in a sorted set,
+    adding and popping are atomic scripts, so tickers can run together.
+    '''
+
+    def __init__(self, db, client=None):
+        super(RedisCoalesceBackend, self).__init__(db, client)
+        self._scripts = None
+
+    @property
+    def scripts(self):
+        ''' (add, pop) '''
+        if self._scripts is None:
+            self._scripts = (self.client.register_script(_ADD_SCRIPT),
+                             self.client.register_script(_POP_SCRIPT))
+        return self._scripts
+
+    def _keys(self):
+        prefix = '{0}:coalesce:'.format(settings.REDIS_PUBSUB_TAG)
+        return [prefix + 'due', prefix + 'buffer:']
+
+    def add(self, messages, window, now=None):
+        if not messages:
+            return
+        args = [(now or time.time()) + window]
+        for message in messages:
+            args += [_buffer_name(message), JSONEncoder().encode(message)]
+        add, pop = self.scripts
+        add(keys=self._keys(), args=args)
+
+    def pop_due(self, now=None, number=1000):
+        add, pop = self.scripts
+        buffers = pop(keys=self._keys(), args=[now or time.time(), number])
+        return [[loads(data) for data in buffered] for buffered in buffers]
+
+    def clear(self):
+        due, prefix = self._keys()
+        keys = self.client.keys(prefix + '*')
+        self.client.delete(due, *keys)
+
+
+get_backend = backends.lazy_backend('MESSAGE_COALESCE_BACKEND', {
+    backends.MEMORY: MemoryCoalesceBackend,
+    backends.REDIS: lambda: RedisCoalesceBackend(
+        get_setting('MESSAGE_COALESCE_REDIS_DB', 5)),
+})
+
+
+def aggregate_moments(messages):
+    '''
+    One message for the moments, moment_id is the newest one as in a single message.
+    '''
+    MOMENT_ID, MOMENT_IDS, MOMENT_NUMBER, SENDER, SENDERS = \
+        'moment_id', 'moment_ids', 'moment_number', 'sender', 'senders'
+    if len(messages) == 1:
+        return messages[0]
+
+    moment_ids, senders = [], []
+    for message in messages:
+        for moment_id in message.get(MOMENT_IDS, [message[MOMENT_ID]]):
+            if moment_id not in moment_ids:
+                moment_ids.append(moment_id)
+        if message[SENDER] not in senders:
+            senders.append(message[SENDER])
+
+    aggregated = dict(messages[-1])
+    aggregated.pop('mid', None)
+    aggregated.update({
+        'sub_event': 'coalesced',
+        MOMENT_IDS: moment_ids,
+        MOMENT_NUMBER: sum(message.get(MOMENT_NUMBER, 1) for message in messages),
+        SENDERS: senders,
+    })
+    return aggregated
+
+
+AGGREGATORS = {
+    'moment': aggregate_moments,
+}
+
+
+def aggregate(messages):
+    '''
+    Messages of one buffer to one message, or unchanged if their event has no aggregator.
+    '''
+    aggregator = AGGREGATORS.get(messages[0][EVENT])
+    if aggregator is None:
+        return messages
+    return [aggregator(messages)]
@@ -1,22 +1,27 @@
 # -*- coding:utf-8 -*-
 
 import redis
-import random
-import datetime
 import threading
+from django.conf import settings
 from apps.message.services import MessageService
-from information.utils import RedisPubsub
+from information import transport
+from information import coalesce
+from customs.transaction_hooks import on_commit
+from customs import snowflake
 
 
-def get_random_code(message):
-    message_len = len(str(message))
-    t = datetime.datetime.now()
-    seconds_str = "{:.9f}".format((t - datetime.datetime(1970, 1, 1)).total_seconds())
-    random_num = random.randint(100, 999)
-    # to avoid two client send message in the same time. Add a random number.
+DIRECT, OUTBOX = 'direct', 'outbox'
 
-    code = str(message_len) + seconds_str.replace(".", "") + str(random_num)
-    return code
+
+def _get_publish_mode():
+    return getattr(settings, 'MESSAGE_PUBLISH_MODE', DIRECT)
+
+
+def new_mid():
+    '''
+    Gives a message id sorted by time, see customs.snowflake.
+    '''
+    return snowflake.id_to_str(snowflake.next_id())
 
 
 def send_message_mannual(message_id):
@@ -95,12 +100,107 @@ def publish_moment_message(moment_id, sender_id, receiver_id):
 
     publish_redis_message(message)
 
+
+def publish_moment_messages(moment_id, sender_id, receiver_ids, after_commit=False):
+    messages = [{
+        'sender': sender_id,
+        'moment_id': moment_id,
+        'receiver_id': receiver_id,
+        'event': 'moment'
+    } for receiver_id in receiver_ids]
+
+    publish_redis_messages(messages, after_commit=after_commit)
+
+
+def publish_moment_import_messages(moment_id, sender_id, moment_number, receiver_ids, after_commit=False):
+    '''
+    One message for a batch of imported moments, moment_id is the newest one.
+    '''
+    messages = [{
+        'sender': sender_id,
+        'moment_id': moment_id,
+        'moment_number': moment_number,
+        'receiver_id': receiver_id,
+        'event': 'moment',
+        'sub_event': 'import'
+    } for receiver_id in receiver_ids]
+
+    publish_redis_messages(messages, after_commit=after_commit)
+
     
 def publish_redis_message(message, create_mid=True):
-    code = get_random_code(message)
-    if not create_mid:
-        RedisPubsub.pub(message)
+    publish_redis_messages([message], create_mid)
+
+
+def publish_redis_messages(messages, create_mid=True, after_commit=False):
+    '''
+    Publishes messages through one redis pipeline, and backs them up with one insert.
+    If after_commit, waits until the current transaction commits, and nothing is
+    sent if it rolls back.
+    In outbox mode, messages are saved in the caller's transaction instead, and
+    sent by the relay_outbox command.
+    New messages of the events in MESSAGE_COALESCE_EVENTS are buffered for
+    MESSAGE_COALESCE_WINDOW seconds, and sent by flush_coalesced.
+    '''
+    if create_mid and coalesce.get_window():
+        buffered = [message for message in messages if coalesce.is_coalesced(message)]
+        if buffered:
+            messages = [message for message in messages if not coalesce.is_coalesced(message)]
+            _buffer(buffered, after_commit)
+
+    _dispatch(messages, create_mid, after_commit)
+
+
+def _buffer(messages, after_commit):
+    add = lambda: coalesce.get_backend().add(messages, coalesce.get_window())
+    if after_commit:
+        on_commit(add)
+    else:
+        add()
+
+
+def flush_coalesced(now=None, number=1000):
+    '''
+    Publishes one message for every buffer whose window is over,
+    returns the number of published messages.
+    '''
+    messages = []
+    for buffered in coalesce.get_backend().pop_due(now, number):
+        messages += coalesce.aggregate(buffered)
+    _dispatch(messages, create_mid=True, after_commit=False)
+    return len(messages)
+
+
+def _dispatch(messages, create_mid, after_commit):
+    if not messages:
+        return
+    if create_mid:
+        for message in messages:
+            message['mid'] = new_mid()
+
+    if _get_publish_mode() == OUTBOX:
+        # sent by relay_outbox when the caller's transaction commits
+        MessageService.add_to_outbox(messages)
+        if create_mid:
+            MessageService.backup_many(messages)
+    elif after_commit:
+        on_commit(lambda: _publish(messages, create_mid))
     else:
-        message['mid'] = code
-        RedisPubsub.pub(message)
-        MessageService.backup(message, code, message['event'], message.get('sub_event', ""))
+        _publish(messages, create_mid)
+
+
+def _send(messages):
+    transport.get_transport().send(messages)
+
+
+def _publish(messages, backup):
+    _send(messages)
+    if backup:
+        MessageService.backup_many(messages)
+
+
+def relay_outbox(batch_size=500):
+    '''
+    Publishes a batch of outbox messages, returns the number of them.
+    '''
+    return MessageService.relay_outbox(_send, batch_size)
@@ -0,0 +1,223 @@
+# -*- coding:utf-8 -*-
+'''
+Durable message delivery on redis streams (redis >= 5.0).
+
+Pub/sub drops every message sent while nobody listens. Streams keep them:
+
+  * every message is added to the stream of its receiver, a client back from
+    a network drop gets all it missed by `replay(receiver_id, after_id)`.
+    The last id a receiver acked is kept, so `replay_unacked` needs no id.
+  * every message is also added to one shared stream, read by gateway workers
+    in consumer groups. A message is pending until acked, a restarted worker
+    reads its own pending messages again by `read_pending`.
+
+Streams are capped to MESSAGE_STREAM_MAXLEN entries (approximately, so redis
+can trim whole nodes), and to MESSAGE_STREAM_MAX_AGE seconds when it is set.
+
+The client is given to RedisStreams, so a fakeredis client works in tests.
+redis-py 2.10 has no stream methods, commands are sent by execute_command.
+'''
+
+import time
+from json import JSONEncoder, loads
+
+from redis.exceptions import ResponseError
+from django.conf import settings
+from customs import backends
+from customs.funcs import get_setting, hex_id
+
+DATA = 'data'
+ALL = 'all'
+FIRST_ID = '0-0'
+
+# sets the acked id of a receiver only if it is newer than the current one
+_ACK_SCRIPT = '''
+local current = redis.call('HGET', KEYS[1], ARGV[1])
+if current then
+    local cm, cs = string.match(current, '(%d+)-(%d+)')
+    local nm, ns = string.match(ARGV[2], '(%d+)-(%d+)')
+    cm, cs, nm, ns = tonumber(cm), tonumber(cs), tonumber(nm), tonumber(ns)
+    if cm > nm or (cm == nm and cs >= ns) then
+        return 0
+    end
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+return 1
+'''
+
+
+def is_enabled():
+    return get_setting('MESSAGE_STREAMS_ENABLED', False)
+
+
+def parse_id(stream_id):
+    '''
+    Gives (milliseconds, sequence) of a stream id, raises ValueError if invalid.
+    '''
+    ms, _, seq = str(stream_id).partition('-')
+    return int(ms), int(seq or 0)
+
+
+def _next_id(stream_id):
+    '''
+    The smallest id after stream_id, XRANGE includes its start.
+    '''
+    ms, seq = parse_id(stream_id)
+    return '{0}-{1}'.format(ms, seq + 1)
+
+
+def _decode_entries(entries):
+    '''
+    [[id, [field, value, ...]], ...] => [(id, message), ...]
+    '''
+    messages = []
+    for stream_id, fields in entries or []:
+        values = dict(zip(fields[::2], fields[1::2]))
+        messages.append((stream_id, loads(values[DATA])))
+    return messages
+
+
+class RedisStreams(backends.RedisBackend):
+
+    def __init__(self, client=None, db=None, prefix=None, maxlen=10000, max_age=None):
+        super(RedisStreams, self).__init__(db, client)
+        self.prefix = prefix
+        self.maxlen = maxlen
+        self.max_age = max_age
+        self._ack_script = None
+
+    def _key(self, name):
+        return '{0}:stream:{1}'.format(self.prefix, name)
+
+    def _receiver_key(self, receiver_id):
+        return self._key('receiver:{0}'.format(hex_id(receiver_id)))
+
+    def _acks_key(self):
+        return self._key('acks')
+
+    # adding
+
+    def add_many(self, messages):
+        '''
+        Adds messages to the shared stream and the stream of their receivers,
+        in one round trip. Returns the ids in the receiver streams, None for
+        the messages without receiver.
+        '''
+        if not messages:
+            return []
+        pipe = self.client.pipeline(transaction=False)
+        shared_key = self._key(ALL)
+        receiver_keys = []
+        for message in messages:
+            data = JSONEncoder().encode(message)
+            self._add(pipe, shared_key, data)
+
+            receiver_id = message.get('receiver_id')
+            if receiver_id:
+                key = self._receiver_key(receiver_id)
+                receiver_keys.append(key)
+                self._add(pipe, key, data)
+            else:
+                receiver_keys.append(None)
+
+        self._trim_by_age(pipe, [shared_key] + [receiver_key for receiver_key in set(receiver_keys) if receiver_key])
+        results = iter(pipe.execute())
+
+        ids = []
+        for key in receiver_keys:
+            next(results)  # id in the shared stream
+            ids.append(next(results) if key else None)
+        return ids
+
+    def _add(self, pipe, key, data):
+        pipe.execute_command('XADD', key, 'MAXLEN', '~', self.maxlen, '*', DATA, data)
+
+    def _trim_by_age(self, pipe, keys):
+        if not self.max_age:
+            return
+        min_id = '{0}-0'.format(int((time.time() - self.max_age) * 1000))
+        for key in keys:
+            pipe.execute_command('XTRIM', key, 'MINID', '~', min_id)
+            pipe.expire(key, self.max_age)  # drop the streams nobody writes to
+
+    # per receiver
+
+    def replay(self, receiver_id, after_id=FIRST_ID, count=100):
+        '''
+        Gets up to count messages of a receiver after after_id, older to newer,
+        as [(id, message), ...].
+        '''
+        entries = self.client.execute_command(
+            'XRANGE', self._receiver_key(receiver_id), _next_id(after_id), '+', 'COUNT', count)
+        return _decode_entries(entries)
+
+    def ack(self, receiver_id, stream_id):
+        '''
+        Marks the messages of a receiver until stream_id as received.
+        An older id than the acked one is ignored, returns whether it is moved.
+        '''
+        parse_id(stream_id)
+        if self._ack_script is None:
+            self._ack_script = self.client.register_script(_ACK_SCRIPT)
+        return bool(self._ack_script(keys=[self._acks_key()], args=[hex_id(receiver_id), stream_id]))
+
+    def get_acked_id(self, receiver_id):
+        return self.client.hget(self._acks_key(), hex_id(receiver_id)) or FIRST_ID
+
+    def replay_unacked(self, receiver_id, count=100):
+        return self.replay(receiver_id, self.get_acked_id(receiver_id), count)
+
+    # consumer groups on the shared stream
+
+    def ensure_group(self, group, start_id='$'):
+        '''
+        Creates the group if not exists, a new group reads from start_id on.
+        '''
+        try:
+            self.client.execute_command('XGROUP', 'CREATE', self._key(ALL), group, start_id, 'MKSTREAM')
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    def read_group(self, group, consumer, count=100, block=None):
+        '''
+        Gets messages never delivered to the group, as [(id, message), ...].
+        Blocks at most block milliseconds when there is none.
+        '''
+        return self._read_group(group, consumer, '>', count, block)
+
+    def read_pending(self, group, consumer, count=100):
+        '''
+        Gets messages delivered to this consumer but not acked yet.
+        '''
+        return self._read_group(group, consumer, FIRST_ID, count, None)
+
+    def _read_group(self, group, consumer, start_id, count, block):
+        args = ['XREADGROUP', 'GROUP', group, consumer, 'COUNT', count]
+        if block is not None:
+            args += ['BLOCK', block]
+        args += ['STREAMS', self._key(ALL), start_id]
+        result = self.client.execute_command(*args)
+        if not result:
+            return []
+        key, entries = result[0]
+        return _decode_entries(entries)
+
+    def ack_group(self, group, stream_ids):
+        if not stream_ids:
+            return 0
+        return self.client.execute_command('XACK', self._key(ALL), group, *stream_ids)
+
+
+_streams = None
+
+
+def get_streams():
+    global _streams
+    if _streams is None:
+        _streams = RedisStreams(
+            db=get_setting('MESSAGE_STREAM_REDIS_DB', 5),
+            prefix=settings.REDIS_PUBSUB_TAG,
+            maxlen=get_setting('MESSAGE_STREAM_MAXLEN', 10000),
+            max_age=get_setting('MESSAGE_STREAM_MAX_AGE', None))
+    return _streams
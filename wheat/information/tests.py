@@ -6,14 +6,27 @@ Tests for utils.
 
 from django.test import TestCase
 from information import redis_tools
+from information import transport
+from information import coalesce
+from information import streams
 from collections import namedtuple
 from information.utils import RedisPubsub
 from information.utils import get_channal_name
-from apps.message.models import MessageBackup
+from apps.message.models import MessageBackup, MessageOutbox, MessageBackupArchive
+from apps.message.services import MessageService
+from information.streams import RedisStreams
+from settings import REDIS_PUBSUB_DB
+import unittest
+from datetime import datetime, timedelta
+import redis
 import time
 
 
 class RedisUtilsTest(TestCase):
+    def setUp(self):
+        self.transport = transport.get_transport()
+        self.transport.clear()
+
     def test_get_channal_name(self):
         channal = get_channal_name()
         self.assertIsNotNone(channal)
@@ -21,6 +34,7 @@ class RedisUtilsTest(TestCase):
     def test_pub_to_redis(self):
         message = {'code': '1101'}
 
+        RedisPubsub.subscribe()
         RedisPubsub.pub(message)
 
         info = RedisPubsub.get()
@@ -36,7 +50,7 @@ class RedisUtilsTest(TestCase):
 
         redis_tools.publish_invite_message(event, 'sub_inv', 'hiruhkaf', 'i12hiur', {})
 
-        info = RedisPubsub.get()
+        info = self.transport.get()
         self.assertIsNotNone(info)
         self.assertTrue(str(info['data']).find(event) > 0)
         message = MessageBackup.objects.get(event=event)
@@ -58,6 +72,225 @@ class RedisUtilsTest(TestCase):
 
         redis_tools.publish_invitation(invitation, inviter, group, invitee, 'no')
         
-        info = RedisPubsub.get()
+        info = self.transport.get()
         self.assertIsNotNone(info)
         self.assertTrue(str(info['data']).find('invitation') > 0)
+
+    def test_publish_redis_messages(self):
+        receivers = ['receiver-1', 'receiver-2', 'receiver-3']
+
+        redis_tools.publish_moment_messages('moment-id', 'sender-id', receivers)
+
+        backups = MessageBackup.objects.filter(event='moment')
+        self.assertEqual(sorted(b.content['receiver_id'] for b in backups), receivers)
+        self.assertEqual(len(set(b.message_id for b in backups)), len(receivers))
+
+    def test_publish_after_commit(self):
+        redis_tools.publish_moment_messages('moment-id', 'sender-id', ['receiver'], after_commit=True)
+
+        # TestCase runs in a transaction never committed
+        self.assertFalse(MessageBackup.objects.filter(event='moment').exists())
+
+    def test_outbox(self):
+        with self.settings(MESSAGE_PUBLISH_MODE=redis_tools.OUTBOX):
+            redis_tools.publish_moment_messages('moment-id', 'sender-id', ['receiver-1', 'receiver-2'])
+
+        self.assertEqual(MessageOutbox.objects.filter(sent=False).count(), 2)
+        self.assertEqual(MessageBackup.objects.filter(event='moment').count(), 2)
+
+        self.assertEqual(redis_tools.relay_outbox(batch_size=1), 1)
+        self.assertEqual(redis_tools.relay_outbox(batch_size=10), 1)
+        self.assertEqual(redis_tools.relay_outbox(batch_size=10), 0)
+        self.assertFalse(MessageOutbox.objects.filter(sent=False).exists())
+
+    def test_back_ups_after(self):
+        redis_tools.publish_moment_messages('moment-id', 'sender-id', ['receiver-1', 'receiver-2', 'receiver-3'])
+        mids = sorted(MessageBackup.objects.filter(event='moment').values_list('message_id', flat=True))
+
+        backups = MessageService.get_back_ups_after(mids[0])
+        self.assertEqual([b.message_id for b in backups], mids[1:])
+
+    def test_compact_back_ups(self):
+        from apps.message.management.commands.compact_message_backup import compact
+
+        redis_tools.publish_moment_messages('moment-id', 'sender-id', ['receiver-1', 'receiver-2', 'receiver-3'])
+        mid = MessageBackup.objects.filter(event='moment')[0].message_id
+        MessageBackup.objects.update(created_data=datetime.now() - timedelta(days=31))
+
+        self.assertEqual(compact(days=30, chunk_size=2, pause=0), 3)
+        self.assertFalse(MessageBackup.objects.exists())
+        self.assertEqual(MessageBackupArchive.objects.count(), 3)
+        self.assertEqual(MessageService.get_back_up(mid).message_id, mid)  # found in archive
+
+    def test_purge_sent_outbox(self):
+        from apps.message.management.commands.compact_message_backup import purge_outbox
+
+        with self.settings(MESSAGE_PUBLISH_MODE=redis_tools.OUTBOX):
+            redis_tools.publish_moment_messages('moment-id', 'sender-id', ['receiver-1', 'receiver-2', 'receiver-3'])
+        redis_tools.relay_outbox(batch_size=2)
+        MessageOutbox.objects.filter(sent=True).update(sent_at=datetime.now() - timedelta(days=31))
+        with self.settings(MESSAGE_PUBLISH_MODE=redis_tools.OUTBOX):
+            redis_tools.publish_moment_messages('moment-id', 'sender-id', ['receiver-4'])
+        redis_tools.relay_outbox(batch_size=1)  # sent recently
+
+        self.assertEqual(purge_outbox(days=30, chunk_size=1, pause=0), 2)
+        self.assertEqual(MessageOutbox.objects.filter(sent=True).count(), 1)
+        self.assertEqual(MessageOutbox.objects.filter(sent=False).count(), 1)
+        self.assertEqual(MessageBackup.objects.filter(event='moment').count(), 4)
+
+    def test_compact_keeps_unsent(self):
+        with self.settings(MESSAGE_PUBLISH_MODE=redis_tools.OUTBOX):
+            redis_tools.publish_moment_messages('moment-id', 'sender-id', ['receiver'])
+        MessageBackup.objects.update(created_data=datetime.now() - timedelta(days=31))
+        MessageOutbox.objects.update(created_at=datetime.now() - timedelta(days=32))  # not relayed since
+
+        before = MessageService.get_compact_before(30)
+        self.assertEqual(MessageService.compact_back_ups(before, 100), 0)
+
+
+class TransportTest(TestCase):
+    def test_memory(self):
+        memory = transport.MemoryTransport(size=2)
+        memory.send([{'n': 1}, {'n': 2}, {'n': 3}])
+
+        # the oldest one is dropped
+        self.assertEqual([memory.get()['data'], memory.get()['data']], ['{"n": 2}', '{"n": 3}'])
+        self.assertIsNone(memory.get())
+
+    def test_recording(self):
+        with transport.use_transport(transport.RECORDING) as recorder:
+            redis_tools.publish_moment_messages('moment-id', 'sender-id', ['receiver-1', 'receiver-2'])
+            redis_tools.publish_book_message('receiver-1', 'book-id', {})
+
+        self.assertEqual(recorder.batches, [2, 1])
+        self.assertEqual([m['event'] for m in recorder.messages], ['moment', 'moment', 'book'])
+        self.assertIsNot(transport.get_transport(), recorder)
+
+    def test_streams_failure_logged(self):
+        get_streams = streams.get_streams
+        broken = RedisStreams(client=redis.StrictRedis(port=1), prefix='test-streams')
+        streams.get_streams = lambda: broken
+        try:
+            messages = [{'event': 'moment', 'receiver_id': 'receiver'}]
+            self.assertEqual(transport.add_to_streams(messages), messages)
+        finally:
+            streams.get_streams = get_streams
+
+    def test_benchmark(self):
+        from apps.message.management.commands.benchmark_publish import benchmark
+
+        with transport.use_transport(transport.RECORDING) as recorder:
+            seconds, messages = benchmark('invitation', 3, 2)
+
+        self.assertEqual(messages, 6)
+        self.assertEqual(len(recorder.messages), 6)
+        self.assertFalse(MessageBackup.objects.exists())  # rolled back
+
+
+class CoalesceTest(TestCase):
+    def setUp(self):
+        self.backend = coalesce.get_backend()
+        self.backend.clear()
+
+    def test_burst_coalesced(self):
+        with self.settings(MESSAGE_COALESCE_WINDOW=2):
+            for moment_id in ['moment-1', 'moment-2', 'moment-3']:
+                redis_tools.publish_moment_messages(moment_id, 'sender-id', ['receiver-1', 'receiver-2'])
+            redis_tools.publish_book_message('receiver-1', 'book-id', {})  # not coalesced
+
+            with transport.use_transport(transport.RECORDING) as recorder:
+                self.assertEqual(redis_tools.flush_coalesced(), 0)  # in window
+                self.assertEqual(redis_tools.flush_coalesced(now=time.time() + 2), 2)
+
+        self.assertEqual(sorted(m['receiver_id'] for m in recorder.messages), ['receiver-1', 'receiver-2'])
+        message = recorder.messages[0]
+        self.assertEqual(message['moment_ids'], ['moment-1', 'moment-2', 'moment-3'])
+        self.assertEqual(message['moment_id'], 'moment-3')
+        self.assertEqual(message['moment_number'], 3)
+        self.assertEqual(MessageBackup.objects.filter(event='moment').count(), 2)
+
+    def test_single_unchanged(self):
+        with self.settings(MESSAGE_COALESCE_WINDOW=2):
+            redis_tools.publish_moment_messages('moment-1', 'sender-id', ['receiver'])
+            with transport.use_transport(transport.RECORDING) as recorder:
+                redis_tools.flush_coalesced(now=time.time() + 2)
+
+        self.assertEqual(len(recorder.messages), 1)
+        self.assertFalse('moment_ids' in recorder.messages[0])
+
+
+def _streams_client():
+    '''
+    A local redis-server supporting streams, or fakeredis, or None.
+    '''
+    client = redis.StrictRedis(db=REDIS_PUBSUB_DB)
+    try:
+        version = client.info()['redis_version']
+    except redis.ConnectionError:
+        version = None
+    if version and tuple(map(int, version.split('.')[:2])) >= (5, 0):
+        return client
+    try:
+        import fakeredis
+    except ImportError:
+        return None
+    return fakeredis.FakeStrictRedis()
+
+
+class RedisStreamsTest(TestCase):
+    def setUp(self):
+        client = _streams_client()
+        if client is None:
+            raise unittest.SkipTest('needs redis >= 5.0 or fakeredis for streams')
+        self.prefix = 'test-streams-{0}'.format(time.time())
+        self.streams = RedisStreams(client=client, prefix=self.prefix, maxlen=100)
+
+    def tearDown(self):
+        client = self.streams.client
+        for key in client.keys(self.prefix + ':*'):
+            client.delete(key)
+
+    def test_replay_after_id(self):
+        ids = self.streams.add_many([
+            {'event': 'moment', 'receiver_id': 'receiver-1', 'n': n} for n in range(3)
+        ] + [{'event': 'moment', 'receiver_id': 'receiver-2', 'n': 3}])
+
+        messages = self.streams.replay('receiver-1', ids[0])
+        self.assertEqual([sid for sid, m in messages], ids[1:3])
+        self.assertEqual([m['n'] for sid, m in messages], [1, 2])
+        self.assertEqual(len(self.streams.replay('receiver-1')), 3)
+
+    def test_ack(self):
+        ids = self.streams.add_many([{'event': 'moment', 'receiver_id': 'receiver', 'n': n} for n in range(3)])
+
+        self.assertEqual(len(self.streams.replay_unacked('receiver')), 3)
+        self.assertTrue(self.streams.ack('receiver', ids[1]))
+        self.assertFalse(self.streams.ack('receiver', ids[0]))  # older than acked
+        self.assertEqual([m['n'] for sid, m in self.streams.replay_unacked('receiver')], [2])
+
+    def test_consumer_group(self):
+        self.streams.ensure_group('gateway')
+        self.streams.ensure_group('gateway')  # exists
+        self.streams.add_many([{'event': 'moment', 'receiver_id': 'receiver', 'n': n} for n in range(2)])
+
+        messages = self.streams.read_group('gateway', 'worker-1')
+        self.assertEqual([m['n'] for sid, m in messages], [0, 1])
+        self.assertEqual(self.streams.read_group('gateway', 'worker-2'), [])
+
+        self.streams.ack_group('gateway', [messages[0][0]])
+        pending = self.streams.read_pending('gateway', 'worker-1')
+        self.assertEqual([m['n'] for sid, m in pending], [1])
+
+    def test_published_with_stream_id(self):
+        get_streams = streams.get_streams
+        streams.get_streams = lambda: self.streams
+        try:
+            messages = [{'event': 'moment', 'receiver_id': 'receiver'}, {'event': 'broadcast'}]
+            published = transport.add_to_streams(messages)
+        finally:
+            streams.get_streams = get_streams
+
+        replayed = self.streams.replay('receiver')
+        self.assertEqual(published[0]['stream_id'], replayed[0][0])
+        self.assertFalse('stream_id' in published[1])
+        self.assertFalse('stream_id' in messages[0])  # copied
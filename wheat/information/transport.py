@@ -0,0 +1,155 @@
+# -*- coding:utf-8 -*-
+'''
+Where published messages go, set by MESSAGE_TRANSPORT:
+
+    redis -- the pub/sub channel, and redis streams when enabled; a message
+             added to the stream of its receiver is published with its stream_id
+    memory -- a queue in process, read by get() as a pub/sub listener would
+    recording -- a list of every sent message, for tests and benchmarks
+
+    transport.get_transport().send(messages)
+
+    with transport.use_transport('recording') as recorder:
+        redis_tools.publish_moment_messages(...)
+    recorder.messages
+'''
+
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from json import JSONEncoder
+
+from redis.exceptions import RedisError
+from customs.funcs import get_setting
+from information import streams
+from information.utils import RedisPubsub, get_channal_name
+
+REDIS, MEMORY, RECORDING = 'redis', 'memory', 'recording'
+
+logger = logging.getLogger('pubsub')
+
+
+def _to_pubsub_message(message):
+    ''' As a message got from redis pub/sub '''
+    return {
+        'type': 'message',
+        'pattern': None,
+        'channel': get_channal_name(),
+        'data': JSONEncoder().encode(message),
+    }
+
+
+def add_to_streams(messages):
+    '''
+    Adds messages to the redis streams, gives copies of them with the
+    stream_id of their receiver, so a client acks and replays after what it
+    got live. The messages are given unchanged if the streams fail.
+    '''
+    try:
+        stream_ids = streams.get_streams().add_many(messages)
+    except RedisError:
+        logger.exception('{0} messages not added to streams'.format(len(messages)))
+        return messages
+    return [dict(message, stream_id=stream_id) if stream_id else message
+            for message, stream_id in zip(messages, stream_ids)]
+
+
+class RedisTransport(object):
+
+    def send(self, messages):
+        if streams.is_enabled():
+            messages = add_to_streams(messages)
+        RedisPubsub.pub_many(messages)
+
+    def get(self):
+        return RedisPubsub.get()
+
+    def clear(self):
+        while RedisPubsub.get() is not None:
+            pass
+
+
+class MemoryTransport(object):
+    '''
+    Keeps the latest `size` messages until they are got.
+    '''
+
+    def __init__(self, size=10000):
+        self.queue = deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def send(self, messages):
+        encoded = [_to_pubsub_message(message) for message in messages]
+        with self.lock:
+            self.queue.extend(encoded)
+
+    def get(self):
+        with self.lock:
+            return self.queue.popleft() if self.queue else None
+
+    def clear(self):
+        with self.lock:
+            self.queue.clear()
+
+
+class RecordingTransport(object):
+    '''
+    Keeps every sent message and the size of every send, nothing is consumed.
+    '''
+
+    def __init__(self):
+        self.messages = []
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def send(self, messages):
+        with self.lock:
+            # copied, callers may change the message after publish
+            self.messages.extend(dict(message) for message in messages)
+            self.batches.append(len(messages))
+
+    def get(self):
+        with self.lock:
+            return _to_pubsub_message(self.messages[-1]) if self.messages else None
+
+    def clear(self):
+        with self.lock:
+            self.messages = []
+            self.batches = []
+
+
+def make_transport(name):
+    if name == MEMORY:
+        return MemoryTransport(get_setting('MESSAGE_MEMORY_TRANSPORT_SIZE', 10000))
+    elif name == RECORDING:
+        return RecordingTransport()
+    elif name == REDIS:
+        return RedisTransport()
+    raise ValueError('unknown message transport: {0}'.format(name))
+
+
+_transport = None
+
+
+def get_transport():
+    global _transport
+    if _transport is None:
+        _transport = make_transport(get_setting('MESSAGE_TRANSPORT', REDIS))
+    return _transport
+
+
+@contextmanager
+def use_transport(name_or_transport):
+    '''
+    Sends through another transport in the block, gives the transport.
+    '''
+    global _transport
+    previous = get_transport()
+    if isinstance(name_or_transport, basestring):
+        name_or_transport = make_transport(name_or_transport)
+    _transport = name_or_transport
+    try:
+        yield name_or_transport
+    finally:
+        _transport = previous
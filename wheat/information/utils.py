@@ -1,11 +1,12 @@
 '''
 Utils for information. 
 '''
-import redis
+import threading
 from settings import REDIS_PUBSUB_TAG
 from settings import REDIS_PUBSUB_DB
 from settings import REDIS_PUBSUB_CHANNEL
 from json import JSONEncoder
+from customs.redis_pool import get_redis
 
 
 def get_channal_name():
@@ -13,18 +14,51 @@ def get_channal_name():
 
 
 class RedisPubsub(object):
-    r = redis.StrictRedis(db=REDIS_PUBSUB_DB)
-    p = r.pubsub()
-    p.subscribe(get_channal_name())
+    '''
+    Publishers only take a pooled connection when they send.
+    Reading by get() needs subscribe() first, listeners run apps.pubsub instead.
+    '''
+    p = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def client():
+        return get_redis(REDIS_PUBSUB_DB)
+
+    @staticmethod
+    def subscribe():
+        with RedisPubsub._lock:
+            if RedisPubsub.p is None:
+                p = RedisPubsub.client().pubsub()
+                p.subscribe(get_channal_name())
+                RedisPubsub.p = p
+        return RedisPubsub.p
+
+    @staticmethod
+    def unsubscribe():
+        with RedisPubsub._lock:
+            if RedisPubsub.p is not None:
+                RedisPubsub.p.close()
+                RedisPubsub.p = None
 
     @staticmethod
     def get():
-        return RedisPubsub.p.get_message()
+        return RedisPubsub.subscribe().get_message()
 
     @staticmethod
     def pub(message):
-        RedisPubsub.r.publish(
+        RedisPubsub.client().publish(
             get_channal_name(),
             JSONEncoder().encode(message)
         )
-        
+
+    @staticmethod
+    def pub_many(messages):
+        '''
+        Publishes messages in one round trip.
+        '''
+        pipe = RedisPubsub.client().pipeline(transaction=False)
+        channel = get_channal_name()
+        for message in messages:
+            pipe.publish(channel, JSONEncoder().encode(message))
+        pipe.execute()
@@ -74,7 +74,7 @@ class Common(Configuration):
         # 'django_extensions',
         'rest_framework',
         'rest_framework_swagger',
-        # 'django_rq',
+        'django_rq',
         'imagekit',
         # 'django_gravatar',
         # 'rest_framework_mongoengine',
@@ -149,10 +149,18 @@ class Common(Configuration):
     }
     # END SWAGGER CONFIGURATION
 
+    # REDIS CONNECTIONS
+    # shared by every redis client below, see customs.redis_pool
+    REDIS_HOST = 'localhost'
+    REDIS_PORT = 6379
+    REDIS_MAX_CONNECTIONS = 50  # of every db in a process, callers wait when all are used
+    REDIS_SOCKET_TIMEOUT = None
+    # END REDIS CONNECTIONS
+
     # REDIS SESSION CONFIGURATION
     SESSION_ENGINE = 'redis_sessions.session'
-    SESSION_REDIS_HOST = 'localhost'
-    SESSION_REDIS_PORT = 6379
+    SESSION_REDIS_HOST = REDIS_HOST
+    SESSION_REDIS_PORT = REDIS_PORT
     SESSION_REDIS_DB = 0
     # SESSION_REDIS_PASSWORD = '123456'
     SESSION_REDIS_PREFIX = 'session'
@@ -161,30 +169,35 @@ class Common(Configuration):
     # RQ CONFIGURATION
     RQ_QUEUES = {
         'default': {
-            'HOST': 'localhost',
-            'PORT': 6379,
+            'HOST': REDIS_HOST,
+            'PORT': REDIS_PORT,
             'DB': 1,
             'DEFAULT_TIMEOUT': 900,
         },
         'high': {
-            'HOST': 'localhost',
-            'PORT': 6379,
+            'HOST': REDIS_HOST,
+            'PORT': REDIS_PORT,
             'DB': 1,
             'DEFAULT_TIMEOUT': 900,
         },
         'low': {
-            'HOST': 'localhost',
-            'PORT': 6379,
+            'HOST': REDIS_HOST,
+            'PORT': REDIS_PORT,
             'DB': 1,
             'DEFAULT_TIMEOUT': 900,
         },
     }
+    RQ_IN_PROCESS = False  # True runs jobs when enqueued, without redis (tests)
+    WECHAT_IMPORT_QUEUE = 'low'
+    MOMENT_IMG_SIZE_QUEUE = 'low'  # downloads pictures not uploaded to us
+    WECHAT_IMPORT_CHUNK = 500  # moments inserted in one transaction
+    WECHAT_IMPORT_RESULT_TTL = 60 * 60 * 24  # seconds the progress is kept after the import
     # END RQ CONFIGURATION
 
     # CACHE OPS CONFIGURATION
     CACHEOPS_REDIS = {
-        'host': 'localhost',  # redis-server is on same machine
-        'port': 6379,        # default redis port
+        'host': REDIS_HOST,
+        'port': REDIS_PORT,
         'db': 2,             # SELECT non-default redis database
                              # using separate redis db or redis instance
                              # is highly recommended
@@ -559,8 +572,69 @@ class Common(Configuration):
     REDIS_PUBSUB_CHANNEL = 'as12afzxjk@askfl'
     # END REDIS DB
 
+    # MESSAGE PUBLISH
+    # direct: publish to redis in the request
+    # outbox: save in the request's transaction, published by `manage.py relay_outbox`
+    MESSAGE_PUBLISH_MODE = 'direct'
+    MESSAGE_TRANSPORT = 'redis'  # redis | memory | recording, see information.transport
+    # every process leases a snowflake worker id (0 ~ 1023) in redis, see customs.snowflake
+    SNOWFLAKE_LEASE_BACKEND = 'redis'  # redis | memory
+    SNOWFLAKE_LEASE_REDIS_DB = 4  # not the cacheops db, a flush there would free leased ids
+    SNOWFLAKE_LEASE_TIMEOUT = 60 * 10
+    SNOWFLAKE_WORKER_ID = None  # leases this id only, for a single process
+    MESSAGE_BACKUP_RETENTION_DAYS = 30  # older ones are archived by `manage.py compact_message_backup`
+    # END MESSAGE PUBLISH
+
+    # GROUP MESSAGE
+    # rows: a group_message row for every member; cursor: one group_chat_message and a read cursor per member
+    # switch to cursor after `manage.py migrate_group_messages`
+    GROUP_MESSAGE_STORAGE = 'rows'
+    # END GROUP MESSAGE
+
+    # MESSAGE STREAMS
+    # also keep published messages in redis streams (redis >= 5.0) for replay, see information.streams
+    MESSAGE_STREAMS_ENABLED = False
+    MESSAGE_STREAM_REDIS_DB = 5  # not the cacheops db, a flush there would lose the streams
+    MESSAGE_STREAM_MAXLEN = 10000  # entries kept in every stream, approximately
+    MESSAGE_STREAM_MAX_AGE = None  # seconds, None means no limit, needs redis >= 6.2
+    # END MESSAGE STREAMS
+
+    # MESSAGE COALESCE
+    # buffer these events per receiver, sent as one message by `manage.py flush_notifications`
+    MESSAGE_COALESCE_WINDOW = 0  # seconds, 0 means every message is sent at once
+    MESSAGE_COALESCE_EVENTS = ('moment',)
+    MESSAGE_COALESCE_BACKEND = 'redis'  # redis | memory
+    MESSAGE_COALESCE_REDIS_DB = 5  # not the cacheops db, a flush there would lose the buffers
+    # END MESSAGE COALESCE
+
+    # MOMENT TIMELINE
+    MOMENT_TIMELINE_BACKEND = 'redis'  # redis | memory
+    MOMENT_TIMELINE_REDIS_DB = 3
+    MOMENT_TIMELINE_SIZE = 500  # moment ids kept for every receiver
+    # END MOMENT TIMELINE
+
+    # FRIEND CACHE
+    FRIEND_CACHE_BACKEND = 'redis'  # redis | memory
+    FRIEND_CACHE_REDIS_DB = 3
+    FRIEND_CACHE_TIMEOUT = 60 * 60 * 24
+    # END FRIEND CACHE
+
+    # HOME MEMBER CACHE
+    HOME_MEMBER_CACHE_BACKEND = 'redis'  # redis | memory
+    HOME_MEMBER_CACHE_REDIS_DB = 3
+    HOME_MEMBER_CACHE_TIMEOUT = 60 * 60 * 24
+    # END HOME MEMBER CACHE
+
     if 'test' in sys.argv:
         DATABASES['default'] = {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': 'mydatabase'
         }
+        MOMENT_TIMELINE_BACKEND = 'memory'
+        FRIEND_CACHE_BACKEND = 'memory'
+        HOME_MEMBER_CACHE_BACKEND = 'memory'
+        MESSAGE_TRANSPORT = 'memory'
+        MESSAGE_COALESCE_BACKEND = 'memory'
+        SNOWFLAKE_LEASE_BACKEND = 'memory'
+        # run jobs in process when enqueued, without redis, see apps.moment.jobs
+        RQ_IN_PROCESS = True